@@ -0,0 +1,239 @@
+"""
+Benchmark de rendimiento de Descargar_LabNancy.py contra el portal simulado.
+
+Levanta Simulador_LabNancy.py en un hilo, ejecuta uno de los modos de descarga con un
+manifiesto y un directorio temporales, y reporta resultados por minuto, latencia por
+resultado (p50/p95, tomada de la columna duracion del manifiesto) y memoria RSS máxima
+del proceso y sus hijos (Chrome, chromedriver, procesos de tramos).
+
+El modo "secuencial" mide configurar_sistema, el flujo por defecto del script, con
+mantener_abierto=False para que cierre el navegador al terminar en lugar de esperar
+a que el usuario lo cierre.
+
+Uso:
+    python Benchmark_LabNancy.py --modo secuencial --resultados 100 --latencia 150
+    python Benchmark_LabNancy.py --modo workers --paralelismo 4 --json benchmark.json
+"""
+import argparse
+import datetime
+import json
+import logging
+import math
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+import Descargar_LabNancy as descargador
+from Simulador_LabNancy import ConfiguracionSimulador, iniciar_simulador
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+MODOS = ["secuencial", "workers", "tramos", "http", "async"]
+
+class MedidorMemoria:
+    """
+    Muestrea periódicamente la memoria RSS del proceso actual y de todos sus hijos y
+    guarda el máximo observado. Sin psutil se usa getrusage, que solo cuenta los hijos
+    ya terminados.
+    """
+
+    def __init__(self, intervalo=0.5):
+        self.intervalo = intervalo
+        self.maximo = 0
+        self._detener = threading.Event()
+        self._hilo = threading.Thread(target=self._muestrear, name="medidor-memoria", daemon=True)
+
+    def _muestrear(self):
+        proceso = psutil.Process()
+        while not self._detener.is_set():
+            total = 0
+            for p in [proceso] + proceso.children(recursive=True):
+                try:
+                    total += p.memory_info().rss
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    pass
+            self.maximo = max(self.maximo, total)
+            self._detener.wait(self.intervalo)
+
+    def __enter__(self):
+        if psutil:
+            self._hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        if psutil:
+            self._detener.set()
+            self._hilo.join()
+        elif resource:
+            # ru_maxrss está en KB en Linux
+            propio = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            hijos = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            self.maximo = (propio + hijos) * 1024
+        return False
+
+def percentil(valores, p):
+    """
+    Percentil por rango más cercano; None si no hay valores.
+    """
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    posicion = max(0, math.ceil(p / 100 * len(ordenados)) - 1)
+    return ordenados[posicion]
+
+def ejecutar_modo(modo, paralelismo, fecha_desde, fecha_hasta, directorio, manifiesto, url, ligero=False):
+    """
+    Ejecuta un modo de descarga contra el simulador.
+    """
+    comunes = dict(
+        username="1234", password="1234", fecha_desde=fecha_desde, fecha_hasta=fecha_hasta,
+        headless=True, directorio_descargas=directorio, ruta_manifiesto=manifiesto, ligero=ligero,
+    )
+    if modo == "secuencial":
+        # El mismo punto de entrada que el script sin opciones, sin dejar el navegador abierto
+        descargador.configurar_sistema(mantener_abierto=False, **comunes)
+    elif modo == "workers":
+        descargador.descargar_en_paralelo(trabajadores=paralelismo, **comunes)
+    elif modo == "tramos":
+        descargador.descargar_por_tramos(particion="semana", procesos=paralelismo, **comunes)
+    elif modo == "http":
+        descargador.descargar_por_http(url_pdf=url + "pdf?clave={clave}", conexiones=paralelismo, **comunes)
+    elif modo == "async":
+        import asyncio
+        asyncio.run(descargador.descargar_async(sesiones=paralelismo, **comunes))
+
+def leer_duraciones(manifiesto):
+    """
+    Devuelve las duraciones (en segundos) de los resultados completados en el manifiesto.
+    """
+    conexion = sqlite3.connect(manifiesto)
+    try:
+        return [
+            fila[0] for fila in conexion.execute(
+                "SELECT duracion FROM descargas WHERE estado = 'completado' AND duracion IS NOT NULL"
+            )
+        ]
+    finally:
+        conexion.close()
+
+def ejecutar_benchmark(modo, paralelismo, config, ligero=False):
+    """
+    Ejecuta una corrida completa y devuelve sus métricas.
+
+    Returns:
+        Diccionario con el modo, los resultados descargados, el tiempo total,
+        resultados por minuto, latencias p50/p95, memoria RSS máxima (MB) y el
+        reporte de tiempos por paso
+    """
+    servidor, url = iniciar_simulador(config)
+    descargador.URL_PORTAL = url
+    descargador.MANIFIESTO = None  # Cada corrida empieza con un manifiesto y métricas nuevos
+    descargador.METRICAS = descargador.MetricasPasos()
+    try:
+        with tempfile.TemporaryDirectory(prefix="bench_labnancy_") as temporal:
+            directorio = os.path.join(temporal, "pdf")
+            os.makedirs(directorio)
+            manifiesto = os.path.join(temporal, "manifiesto.db")
+            descargador.configurar_cache_sesiones(os.path.join(temporal, "sesiones"))
+            inicio = time.monotonic()
+            with MedidorMemoria() as memoria:
+                ejecutar_modo(modo, paralelismo, config.fecha_desde, config.fecha_hasta, directorio, manifiesto, url, ligero)
+            duracion_total = time.monotonic() - inicio
+            duraciones = leer_duraciones(manifiesto)
+            # La salida está repartida en carpetas por año y mes (ver ruta_resultado)
+            pdfs = sum(
+                nombre.lower().endswith(".pdf")
+                for raiz, _, archivos in os.walk(directorio) if descargador.CARPETA_STAGING not in raiz
+                for nombre in archivos
+            )
+    finally:
+        if descargador.MANIFIESTO is not None:
+            descargador.MANIFIESTO.cerrar()
+            descargador.MANIFIESTO = None
+        servidor.shutdown()
+
+    return {
+        "modo": modo,
+        "paralelismo": paralelismo,
+        "ligero": ligero,
+        "resultados_portal": config.resultados,
+        "descargados": len(duraciones),
+        "pdf_en_disco": pdfs,
+        "segundos": round(duracion_total, 2),
+        "resultados_por_minuto": round(len(duraciones) / duracion_total * 60, 2) if duracion_total else 0,
+        "latencia_p50": percentil(duraciones, 50),
+        "latencia_p95": percentil(duraciones, 95),
+        "rss_maximo_mb": round(memoria.maximo / 1024 / 1024, 1) if memoria.maximo else None,
+        "peticiones_portal": servidor.RequestHandlerClass.estadisticas["peticiones"],
+        "pasos": descargador.METRICAS.reporte()["pasos"],
+    }
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+
+    parser = argparse.ArgumentParser(description='Benchmark de descarga contra el portal simulado')
+    parser.add_argument('--modo', choices=MODOS, action='append',
+                        help='Modo a medir, repetible (default: secuencial)')
+    parser.add_argument('--paralelismo', type=int, default=2,
+                        help='Trabajadores / procesos / conexiones / sesiones según el modo')
+    parser.add_argument('--repeticiones', type=int, default=1, help='Corridas por modo')
+    parser.add_argument('--resultados', type=int, default=30, help='Resultados en el portal simulado')
+    parser.add_argument('--por-pagina', type=int, default=10, help='Resultados por página del listado')
+    parser.add_argument('--latencia', type=float, default=100, help='Latencia media por petición (ms)')
+    parser.add_argument('--variacion', type=float, default=50, help='Variación aleatoria de la latencia (ms)')
+    parser.add_argument('--tamano-pdf', type=int, default=50_000, help='Tamaño de cada PDF (bytes)')
+    parser.add_argument('--lean', action='store_true', help='Usar el perfil ligero de Chrome (--lean)')
+    parser.add_argument('--json', type=str, help='Archivo donde guardar las métricas en JSON')
+
+    args = parser.parse_args()
+
+    hoy = datetime.date.today()
+    config = ConfiguracionSimulador(
+        resultados=args.resultados,
+        por_pagina=args.por_pagina,
+        latencia=args.latencia,
+        variacion=args.variacion,
+        tamano_pdf=args.tamano_pdf,
+        fecha_desde=(hoy - datetime.timedelta(days=27)).strftime("%d/%m/%Y"),
+        fecha_hasta=hoy.strftime("%d/%m/%Y"),
+    )
+
+    metricas = []
+    for modo in args.modo or ["secuencial"]:
+        for repeticion in range(args.repeticiones):
+            logger.info(f"⏱️ Benchmark {modo} (paralelismo {args.paralelismo}), corrida {repeticion+1}/{args.repeticiones}")
+            metricas.append(ejecutar_benchmark(modo, args.paralelismo, config, args.lean))
+
+    logger.info("\n📊 Resultados del benchmark:")
+    for m in metricas:
+        p50 = f"{m['latencia_p50']:.2f}s" if m['latencia_p50'] is not None else "-"
+        p95 = f"{m['latencia_p95']:.2f}s" if m['latencia_p95'] is not None else "-"
+        rss = f"{m['rss_maximo_mb']} MB" if m['rss_maximo_mb'] else "-"
+        logger.info(
+            f"{m['modo']:>10} x{m['paralelismo']}: {m['descargados']}/{m['resultados_portal']} en {m['segundos']}s "
+            f"| {m['resultados_por_minuto']} res/min | p50 {p50} | p95 {p95} | RSS máx {rss}"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(metricas, f, indent=2, ensure_ascii=False)
+        logger.info(f"📝 Métricas guardadas en {args.json}")
@@ -0,0 +1,339 @@
+"""
+Carga los resultados descargados por Descargar_LabNancy.py en la base de datos de la
+aplicación de estadística (esquema de estadistica/database/schema.sql).
+
+Cada resultado completado en el manifiesto (o revisado sin PDF, estado 'sin_pdf')
+cuenta como una atención del día de su fecha (CTLFEC). Los conteos se agregan por EPS, periodo anual, especialidad y día y se
+escriben por lotes en daily_appointments con INSERT ... ON DUPLICATE KEY UPDATE; después
+se recalcula monthly_projections.actual_appointments de los meses afectados.
+
+daily_appointments también se llena a mano desde la aplicación, y la carga reemplaza el
+conteo de cada día que escribe. Por eso, si un día ya tiene un conteo distinto (ingresado
+a mano o cargado desde otro manifiesto o rango), la carga se detiene sin escribir nada y
+lista las diferencias; con --reemplazar se escriben igual. Repetir la misma carga no
+cambia nada.
+
+Uso:
+    python Cargar_LabNancy.py --eps "Nueva EPS" --manifiesto descargas_lab_nancy.db
+"""
+import argparse
+import datetime
+import json
+import logging
+import re
+import sqlite3
+import sys
+from collections import Counter
+
+# mysql-connector-python es necesario para escribir en la base de datos de estadística
+try:
+    import mysql.connector
+    from mysql.connector import pooling
+except ImportError:
+    mysql = None
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler(sys.stdout)
+    ]
+)
+
+logger = logging.getLogger(__name__)
+
+# Los mismos parámetros que estadistica/config/database.php
+CONEXION_POR_DEFECTO = {
+    "host": "localhost",
+    "database": "quimiosalud",
+    "user": "root",
+    "password": "",
+}
+
+RUTA_MANIFIESTO = "descargas_lab_nancy.db"
+ESPECIALIDAD_POR_DEFECTO = "Laboratorios"
+TAMANO_LOTE = 1000
+
+def crear_pool(conexion=None, tamano=2):
+    """
+    Crea el pool de conexiones a MySQL/MariaDB.
+
+    Raises:
+        RuntimeError si no está instalado mysql-connector-python
+    """
+    if mysql is None:
+        raise RuntimeError("La carga requiere el paquete 'mysql-connector-python' (pip install mysql-connector-python)")
+    parametros = dict(CONEXION_POR_DEFECTO, **(conexion or {}))
+    return pooling.MySQLConnectionPool(
+        pool_name="carga_lab_nancy", pool_size=tamano, charset="utf8mb4", autocommit=False, **parametros
+    )
+
+def leer_resultados(ruta_manifiesto, desde=None, hasta=None):
+    """
+    Lee del manifiesto los resultados completados o sin PDF que tienen fecha.
+
+    Returns:
+        Lista de tuplas (fecha, examen)
+    """
+    consulta = "SELECT fecha_resultado, examen FROM descargas WHERE estado IN ('completado', 'sin_pdf') AND fecha_resultado IS NOT NULL"
+    parametros = []
+    if desde:
+        consulta += " AND fecha_resultado >= ?"
+        parametros.append(desde.isoformat())
+    if hasta:
+        consulta += " AND fecha_resultado <= ?"
+        parametros.append(hasta.isoformat())
+    conexion = sqlite3.connect(ruta_manifiesto)
+    try:
+        return [
+            (datetime.date.fromisoformat(fecha), examen)
+            for fecha, examen in conexion.execute(consulta, parametros)
+        ]
+    finally:
+        conexion.close()
+
+def cargar_catalogos(conexion):
+    """
+    Lee EPS, especialidades y periodos anuales de la base de estadística.
+
+    Returns:
+        Tupla (eps {nombre: id}, especialidades {nombre: id}, periodos [(id, inicio, fin)])
+    """
+    cursor = conexion.cursor()
+    try:
+        cursor.execute("SELECT id, name FROM eps WHERE status = TRUE")
+        eps = {nombre.lower(): id_ for id_, nombre in cursor.fetchall()}
+        cursor.execute("SELECT id, name FROM specialties")
+        especialidades = {nombre.lower(): id_ for id_, nombre in cursor.fetchall()}
+        cursor.execute("SELECT id, start_date, end_date FROM annual_periods")
+        periodos = cursor.fetchall()
+    finally:
+        cursor.close()
+    return eps, especialidades, periodos
+
+def periodo_de(fecha, periodos):
+    """
+    Id del periodo anual que contiene la fecha, o None.
+    """
+    for id_, inicio, fin in periodos:
+        if inicio <= fecha <= fin:
+            return id_
+    return None
+
+def especialidad_de(examen, mapa_examenes, especialidad_defecto):
+    """
+    Especialidad (nombre) de un examen según el mapa {expresión regular: especialidad}.
+    """
+    for patron, especialidad in mapa_examenes.items():
+        if examen and re.search(patron, examen, re.IGNORECASE):
+            return especialidad
+    return especialidad_defecto
+
+def agregar_conteos(resultados, eps_id, especialidades, periodos, mapa_examenes=None,
+                    especialidad_defecto=ESPECIALIDAD_POR_DEFECTO):
+    """
+    Agrupa los resultados por (eps_id, period_id, specialty_id, appointment_date).
+
+    Returns:
+        Tupla (Counter con los conteos, número de resultados omitidos)
+    """
+    conteos = Counter()
+    omitidos = 0
+    for fecha, examen in resultados:
+        periodo_id = periodo_de(fecha, periodos)
+        especialidad_id = especialidades.get(especialidad_de(examen, mapa_examenes or {}, especialidad_defecto).lower())
+        if periodo_id is None or especialidad_id is None:
+            omitidos += 1
+            continue
+        conteos[(eps_id, periodo_id, especialidad_id, fecha)] += 1
+    return conteos, omitidos
+
+def leer_existentes(conexion, conteos):
+    """
+    Lee de daily_appointments los conteos actuales de los días de la carga.
+
+    Returns:
+        Diccionario {(eps_id, period_id, specialty_id, appointment_date): appointments_count}
+        con los días que ya tienen fila
+    """
+    grupos = {}
+    for eps_id, periodo_id, especialidad_id, fecha in conteos:
+        grupos.setdefault((eps_id, periodo_id, especialidad_id), []).append(fecha)
+    existentes = {}
+    cursor = conexion.cursor()
+    try:
+        for (eps_id, periodo_id, especialidad_id), fechas in sorted(grupos.items()):
+            cursor.execute(
+                "SELECT appointment_date, appointments_count FROM daily_appointments "
+                "WHERE eps_id = %s AND period_id = %s AND specialty_id = %s AND appointment_date BETWEEN %s AND %s",
+                (eps_id, periodo_id, especialidad_id, min(fechas), max(fechas))
+            )
+            for fecha, cantidad in cursor.fetchall():
+                clave = (eps_id, periodo_id, especialidad_id, fecha)
+                if clave in conteos:
+                    existentes[clave] = cantidad
+    finally:
+        cursor.close()
+    return existentes
+
+def diferencias_existentes(conteos, existentes):
+    """
+    Días cuyo conteo actual en la base es distinto del que se va a cargar.
+
+    Returns:
+        Diccionario {clave: (conteo actual, conteo nuevo)}
+    """
+    return {
+        clave: (existentes[clave], cantidad)
+        for clave, cantidad in conteos.items()
+        if clave in existentes and existentes[clave] != cantidad
+    }
+
+def escribir_diarios(conexion, conteos, tamano_lote=TAMANO_LOTE):
+    """
+    Escribe los conteos diarios con INSERT multi-fila ... ON DUPLICATE KEY UPDATE, un
+    lote por sentencia. Los conteos reemplazan a los anteriores: la carga se puede
+    repetir sin duplicar (cargar_resultados comprueba antes que no se pise un conteo distinto).
+    """
+    filas = [(*clave, cantidad) for clave, cantidad in sorted(conteos.items())]
+    cursor = conexion.cursor()
+    try:
+        for inicio in range(0, len(filas), tamano_lote):
+            lote = filas[inicio:inicio + tamano_lote]
+            cursor.execute(
+                "INSERT INTO daily_appointments (eps_id, period_id, specialty_id, appointment_date, appointments_count) "
+                "VALUES " + ", ".join(["(%s, %s, %s, %s, %s)"] * len(lote)) +
+                " ON DUPLICATE KEY UPDATE appointments_count = VALUES(appointments_count)",
+                [valor for fila in lote for valor in fila]
+            )
+            logger.info(f"📥 Lote de {len(lote)} días escrito ({inicio + len(lote)}/{len(filas)})")
+    finally:
+        cursor.close()
+
+def actualizar_mensuales(conexion, conteos):
+    """
+    Recalcula monthly_projections.actual_appointments como la suma de daily_appointments
+    de cada mes afectado por la carga. El mes se identifica por año y mes dentro de las
+    fechas del periodo: un periodo que cruza de un año a otro no suma el mismo mes de
+    los dos años.
+    """
+    meses = {(eps_id, periodo_id, especialidad_id, fecha.year, fecha.month)
+             for eps_id, periodo_id, especialidad_id, fecha in conteos}
+    cursor = conexion.cursor()
+    try:
+        for eps_id, periodo_id, especialidad_id, anio, mes in sorted(meses):
+            cursor.execute(
+                """INSERT INTO monthly_projections (eps_id, period_id, specialty_id, month, actual_appointments)
+                   SELECT d.eps_id, d.period_id, d.specialty_id, MONTH(d.appointment_date), SUM(d.appointments_count)
+                   FROM daily_appointments d
+                   JOIN annual_periods p ON p.id = d.period_id
+                   WHERE d.eps_id = %s AND d.period_id = %s AND d.specialty_id = %s
+                     AND YEAR(d.appointment_date) = %s AND MONTH(d.appointment_date) = %s
+                     AND d.appointment_date BETWEEN p.start_date AND p.end_date
+                   GROUP BY d.eps_id, d.period_id, d.specialty_id, MONTH(d.appointment_date)
+                   ON DUPLICATE KEY UPDATE actual_appointments = VALUES(actual_appointments)""",
+                (eps_id, periodo_id, especialidad_id, anio, mes)
+            )
+    finally:
+        cursor.close()
+    logger.info(f"📊 actual_appointments actualizado en {len(meses)} meses")
+
+def cargar_resultados(eps, ruta_manifiesto=RUTA_MANIFIESTO, desde=None, hasta=None, conexion=None,
+                      especialidad=ESPECIALIDAD_POR_DEFECTO, mapa_examenes=None, tamano_lote=TAMANO_LOTE,
+                      reemplazar=False):
+    """
+    Carga los resultados del manifiesto en daily_appointments y monthly_projections en
+    una sola transacción.
+
+    Args:
+        eps: Nombre de la EPS a la que corresponden los resultados (tabla eps)
+        desde / hasta: Filtrar por fecha del resultado (datetime.date)
+        conexion: Parámetros de conexión que reemplazan a CONEXION_POR_DEFECTO
+        especialidad: Especialidad de los exámenes que no coinciden con mapa_examenes
+        mapa_examenes: Diccionario {expresión regular del examen: nombre de especialidad}
+        reemplazar: Escribir aunque un día ya tenga un conteo distinto (p. ej. ingresado a mano)
+
+    Returns:
+        Número de días escritos en daily_appointments
+
+    Raises:
+        ValueError si la EPS no existe en la base de datos, o si algún día ya tiene un
+        conteo distinto y no se pidió reemplazar
+    """
+    resultados = leer_resultados(ruta_manifiesto, desde, hasta)
+    logger.info(f"🔎 {len(resultados)} resultados completados con fecha en {ruta_manifiesto}")
+    if not resultados:
+        return 0
+
+    pool = crear_pool(conexion)
+    cnx = pool.get_connection()
+    try:
+        catalogo_eps, especialidades, periodos = cargar_catalogos(cnx)
+        eps_id = catalogo_eps.get(eps.lower())
+        if eps_id is None:
+            raise ValueError(f"La EPS '{eps}' no existe o no está activa. Opciones: {', '.join(catalogo_eps)}")
+        conteos, omitidos = agregar_conteos(resultados, eps_id, especialidades, periodos, mapa_examenes, especialidad)
+        if omitidos:
+            logger.warning(f"⚠️ {omitidos} resultados sin periodo anual o especialidad configurados, se omiten")
+        diferencias = diferencias_existentes(conteos, leer_existentes(cnx, conteos))
+        if diferencias:
+            for (_, _, especialidad_id, fecha), (actual, nuevo) in sorted(diferencias.items())[:10]:
+                logger.warning(f"⚠️ {fecha} (especialidad {especialidad_id}): hay {actual} atenciones registradas, la carga tiene {nuevo}")
+            if not reemplazar:
+                raise ValueError(
+                    f"{len(diferencias)} días ya tienen un conteo distinto en daily_appointments; "
+                    "no se cargó nada (use --reemplazar para escribirlos igual)"
+                )
+            logger.warning(f"⚠️ Se reemplazan {len(diferencias)} conteos diarios existentes")
+        escribir_diarios(cnx, conteos, tamano_lote)
+        actualizar_mensuales(cnx, conteos)
+        cnx.commit()
+    except Exception:
+        cnx.rollback()
+        raise
+    finally:
+        cnx.close()
+    logger.info(f"✅ Carga completada: {sum(conteos.values())} resultados en {len(conteos)} días")
+    return len(conteos)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Cargar los resultados descargados en la base de estadística')
+    parser.add_argument('--eps', type=str, required=True, help='Nombre de la EPS (tabla eps)')
+    parser.add_argument('--manifiesto', type=str, default=RUTA_MANIFIESTO, help='Manifiesto SQLite de Descargar_LabNancy.py')
+    parser.add_argument('--desde', type=str, help='Fecha desde (DD/MM/AAAA)')
+    parser.add_argument('--hasta', type=str, help='Fecha hasta (DD/MM/AAAA)')
+    parser.add_argument('--especialidad', type=str, default=ESPECIALIDAD_POR_DEFECTO,
+                        help='Especialidad a la que se cargan los resultados')
+    parser.add_argument('--mapa-examenes', type=str,
+                        help='Archivo JSON {expresión regular del examen: especialidad} para repartir por especialidad')
+    parser.add_argument('--lote', type=int, default=TAMANO_LOTE, help='Filas por sentencia INSERT')
+    parser.add_argument('--reemplazar', action='store_true',
+                        help='Reemplazar los conteos diarios existentes que difieren de la carga (p. ej. ingresados a mano)')
+    parser.add_argument('--host', type=str, default=CONEXION_POR_DEFECTO["host"])
+    parser.add_argument('--port', type=int, default=3306)
+    parser.add_argument('--base', type=str, default=CONEXION_POR_DEFECTO["database"])
+    parser.add_argument('--usuario', type=str, default=CONEXION_POR_DEFECTO["user"])
+    parser.add_argument('--clave', type=str, default=CONEXION_POR_DEFECTO["password"])
+
+    args = parser.parse_args()
+
+    mapa_examenes = None
+    if args.mapa_examenes:
+        with open(args.mapa_examenes, encoding="utf-8") as f:
+            mapa_examenes = json.load(f)
+
+    def fecha(texto):
+        return datetime.datetime.strptime(texto, "%d/%m/%Y").date() if texto else None
+
+    cargar_resultados(
+        eps=args.eps,
+        ruta_manifiesto=args.manifiesto,
+        desde=fecha(args.desde),
+        hasta=fecha(args.hasta),
+        conexion={"host": args.host, "port": args.port, "database": args.base,
+                  "user": args.usuario, "password": args.clave},
+        especialidad=args.especialidad,
+        mapa_examenes=mapa_examenes,
+        tamano_lote=args.lote,
+        reemplazar=args.reemplazar
+    )
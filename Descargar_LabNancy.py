@@ -19,6 +19,56 @@ import datetime
 import argparse
 import logging
 import traceback
+import threading
+import weakref
+import os
+import sqlite3
+import re
+import asyncio
+import base64
+import functools
+import hashlib
+import json
+import math
+import multiprocessing
+import random
+from collections import deque
+from fnmatch import fnmatch
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait as esperar_futuros
+from urllib.parse import urljoin, quote
+
+# requests solo es necesario para el motor de descarga HTTP directa
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except ImportError:
+    requests = None
+
+# playwright solo es necesario para el motor asíncrono (--sesiones-async)
+try:
+    from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeout
+except ImportError:
+    async_playwright = None
+
+# pypdf solo es necesario para extraer los datos de los PDF descargados (--extraer-jsonl / --extraer-db)
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+# cryptography solo es necesario para guardar la sesión cifrada en disco (sin ella no se guarda)
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+
+# pyarrow solo es necesario para exportar el historial en Parquet (--parquet)
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
 import sys
 # Configurar logging
 logging.basicConfig(
@@ -31,7 +81,707 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-def wait_and_click(driver, by, selector, timeout=20, retry_count=3):
+# Página de login del portal del laboratorio
+URL_PORTAL = ""
+
+# Techo de espera (en segundos) para cada paso del flujo. Las esperas terminan en
+# cuanto el portal está listo; estos valores solo limitan cuánto se espera como máximo
+# hasta que LatenciaPortal reúne muestras suficientes para ajustarlos.
+LIMITES_ESPERA = {
+    "pagina": 30,            # Carga completa de una página (login, recargas)
+    "login": 20,             # Cada control del formulario de login
+    "buscar": 30,            # Resultados después de hacer clic en "Buscar"
+    "ver": 15,               # Enlaces "Ver" del listado
+    "iframe": 15,            # Carga del iframe de detalle
+    "imprimir": 15,
+    "descargar": 20,
+    "descarga": 60,          # Sin avance en la descarga del archivo (bytes o tamaño en disco)
+    "alerta": 3,             # Alerta JavaScript opcional después de DESCARGAR
+    "volver": 15,
+    "cancel": 15,
+    "pagina_siguiente": 20,  # Cambio de página del listado
+    "recuperacion": 10,
+    "sesion": 8,             # Comprobación de una sesión restaurada de la caché
+}
+
+# Script que indica si el portal GeneXus terminó de procesar: documento cargado,
+# sin peticiones AJAX pendientes y sin el aviso de "procesando" de GeneXus visible.
+SCRIPT_PORTAL_INACTIVO = """
+if (document.readyState !== 'complete') { return false; }
+if (!window.__labXhrPendientes) {
+    window.__labXhrPendientes = {n: 0};
+    var send = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function() {
+        var contador = window.__labXhrPendientes;
+        contador.n++;
+        this.addEventListener('loadend', function() { contador.n = Math.max(0, contador.n - 1); });
+        return send.apply(this, arguments);
+    };
+}
+if (window.__labXhrPendientes.n > 0) { return false; }
+if (window.jQuery && window.jQuery.active > 0) { return false; }
+var aviso = document.getElementById('gx_ajax_notification');
+if (aviso && aviso.offsetParent !== null) { return false; }
+return true;
+"""
+
+def configurar_limites_espera(valores):
+    """
+    Actualiza LIMITES_ESPERA a partir de una lista de cadenas "paso=segundos".
+
+    Args:
+        valores: Lista como ["descargar=40", "ver=10"] (o un dict paso -> segundos)
+    """
+    if not valores:
+        return
+    if isinstance(valores, dict):
+        valores = [f"{paso}={segundos}" for paso, segundos in valores.items()]
+    for valor in valores:
+        paso, _, segundos = valor.partition("=")
+        paso = paso.strip()
+        if paso not in LIMITES_ESPERA:
+            raise ValueError(f"Paso de espera desconocido: '{paso}'. Opciones: {', '.join(LIMITES_ESPERA)}")
+        LIMITES_ESPERA[paso] = float(segundos)
+        logger.info(f"Límite de espera para '{paso}': {LIMITES_ESPERA[paso]} s")
+
+# Límites superiores (en segundos) de los buckets de los histogramas de duración por paso
+BUCKETS_METRICAS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60)
+
+class MetricasPasos:
+    """
+    Histogramas de duración por paso del flujo (ver, iframe, imprimir, descargar,
+    alerta, volver, cancel, pagina_siguiente, login, recuperacion...). Es seguro usarlo
+    desde varios hilos; los procesos de tramos envían su instantánea al orquestador.
+    
+    Al terminar una corrida se exporta como reporte JSON y/o como archivo de texto
+    para el textfile collector de Prometheus (node_exporter).
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pasos = {}
+        self.inicio = time.time()
+        self.ruta_json = None
+        self.ruta_prometheus = None
+    
+    def registrar(self, paso, segundos, exito=True):
+        with self._lock:
+            datos = self._pasos.setdefault(paso, {
+                "conteo": 0, "errores": 0, "suma": 0.0, "maximo": 0.0,
+                "buckets": [0] * len(BUCKETS_METRICAS),
+            })
+            datos["conteo"] += 1
+            datos["suma"] += segundos
+            datos["maximo"] = max(datos["maximo"], segundos)
+            if not exito:
+                datos["errores"] += 1
+            for i, limite in enumerate(BUCKETS_METRICAS):
+                if segundos <= limite:
+                    datos["buckets"][i] += 1
+                    break
+    
+    @contextmanager
+    def medir(self, paso):
+        """
+        Mide la duración del bloque; si el bloque lanza una excepción cuenta como error.
+        """
+        inicio = time.monotonic()
+        try:
+            yield
+        except BaseException:
+            self.registrar(paso, time.monotonic() - inicio, exito=False)
+            raise
+        self.registrar(paso, time.monotonic() - inicio)
+    
+    def instantanea(self):
+        with self._lock:
+            return {paso: dict(datos, buckets=list(datos["buckets"])) for paso, datos in self._pasos.items()}
+    
+    def combinar(self, instantanea):
+        """
+        Suma a estas métricas la instantánea de otro proceso.
+        """
+        with self._lock:
+            for paso, otros in (instantanea or {}).items():
+                datos = self._pasos.setdefault(paso, {
+                    "conteo": 0, "errores": 0, "suma": 0.0, "maximo": 0.0,
+                    "buckets": [0] * len(BUCKETS_METRICAS),
+                })
+                for campo in ("conteo", "errores", "suma"):
+                    datos[campo] += otros[campo]
+                datos["maximo"] = max(datos["maximo"], otros["maximo"])
+                datos["buckets"] = [a + b for a, b in zip(datos["buckets"], otros["buckets"])]
+    
+    def reporte(self):
+        """
+        Reporte de la corrida: duración total y, por paso, conteo, errores, promedio,
+        máximo y los buckets del histograma (no acumulados).
+        """
+        pasos = {}
+        for paso, datos in sorted(self.instantanea().items()):
+            pasos[paso] = {
+                "conteo": datos["conteo"],
+                "errores": datos["errores"],
+                "total_segundos": round(datos["suma"], 3),
+                "promedio_segundos": round(datos["suma"] / datos["conteo"], 3) if datos["conteo"] else 0,
+                "maximo_segundos": round(datos["maximo"], 3),
+                "histograma": {
+                    **{f"<={limite}": n for limite, n in zip(BUCKETS_METRICAS, datos["buckets"])},
+                    f">{BUCKETS_METRICAS[-1]}": datos["conteo"] - sum(datos["buckets"]),
+                },
+            }
+        return {
+            "inicio": datetime.datetime.fromtimestamp(self.inicio).isoformat(timespec="seconds"),
+            "duracion_segundos": round(time.time() - self.inicio, 1),
+            "pasos": pasos,
+        }
+    
+    def texto_prometheus(self):
+        lineas = [
+            "# HELP labnancy_paso_duracion_segundos Duración de cada paso del flujo de descarga",
+            "# TYPE labnancy_paso_duracion_segundos histogram",
+        ]
+        errores = [
+            "# HELP labnancy_paso_errores_total Pasos que terminaron en error",
+            "# TYPE labnancy_paso_errores_total counter",
+        ]
+        for paso, datos in sorted(self.instantanea().items()):
+            acumulado = 0
+            for limite, n in zip(BUCKETS_METRICAS, datos["buckets"]):
+                acumulado += n
+                lineas.append(f'labnancy_paso_duracion_segundos_bucket{{paso="{paso}",le="{limite}"}} {acumulado}')
+            lineas.append(f'labnancy_paso_duracion_segundos_bucket{{paso="{paso}",le="+Inf"}} {datos["conteo"]}')
+            lineas.append(f'labnancy_paso_duracion_segundos_sum{{paso="{paso}"}} {datos["suma"]:.6f}')
+            lineas.append(f'labnancy_paso_duracion_segundos_count{{paso="{paso}"}} {datos["conteo"]}')
+            errores.append(f'labnancy_paso_errores_total{{paso="{paso}"}} {datos["errores"]}')
+        return "\n".join(lineas + errores) + "\n"
+    
+    def exportar(self):
+        """
+        Escribe el reporte JSON y el archivo de Prometheus en las rutas configuradas
+        (el archivo se reemplaza de forma atómica para que el collector nunca lea uno a medias).
+        """
+        for ruta, contenido in (
+            (self.ruta_json, lambda: json.dumps(self.reporte(), indent=2, ensure_ascii=False)),
+            (self.ruta_prometheus, self.texto_prometheus),
+        ):
+            if not ruta:
+                continue
+            try:
+                temporal = f"{ruta}.tmp"
+                with open(temporal, "w", encoding="utf-8") as f:
+                    f.write(contenido())
+                os.replace(temporal, ruta)
+                logger.info(f"📊 Métricas guardadas en {ruta}")
+            except OSError as e:
+                logger.error(f"❌ No se pudieron guardar las métricas en {ruta}: {e}")
+    
+    def log_resumen(self):
+        for paso, datos in self.reporte()["pasos"].items():
+            logger.info(f"⏱️ {paso}: {datos['conteo']} veces, promedio {datos['promedio_segundos']} s, "
+                        f"máximo {datos['maximo_segundos']} s, {datos['errores']} errores")
+
+# Métricas del proceso actual
+METRICAS = MetricasPasos()
+
+def configurar_metricas(ruta_json=None, ruta_prometheus=None):
+    """
+    Define dónde se exportan las métricas de la corrida (reporte JSON y textfile de Prometheus).
+    """
+    METRICAS.ruta_json = ruta_json
+    METRICAS.ruta_prometheus = ruta_prometheus
+
+def medido(paso, falso_es_error=True):
+    """
+    Decorador que registra la duración de cada llamada en METRICAS. Una excepción o
+    (si falso_es_error) un valor de retorno False cuentan como error.
+    """
+    def decorador(funcion):
+        if asyncio.iscoroutinefunction(funcion):
+            @functools.wraps(funcion)
+            async def envoltura_async(*args, **kwargs):
+                inicio = time.monotonic()
+                exito = False
+                try:
+                    resultado = await funcion(*args, **kwargs)
+                    exito = resultado is not False or not falso_es_error
+                    return resultado
+                finally:
+                    METRICAS.registrar(paso, time.monotonic() - inicio, exito)
+            return envoltura_async
+        
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            inicio = time.monotonic()
+            exito = False
+            try:
+                resultado = funcion(*args, **kwargs)
+                exito = resultado is not False or not falso_es_error
+                return resultado
+            finally:
+                METRICAS.registrar(paso, time.monotonic() - inicio, exito)
+        return envoltura
+    return decorador
+
+# Ajuste de las esperas a partir de la latencia observada del portal (LatenciaPortal)
+VENTANA_LATENCIA = 200   # Muestras recientes que se conservan por paso
+MUESTRAS_MINIMAS = 10    # Con menos muestras se usa el límite fijo de LIMITES_ESPERA
+MARGEN_LATENCIA = 4      # Espera = p95 x margen...
+ESPERA_MINIMA = 3        # ...nunca por debajo de estos segundos...
+TECHO_ADAPTATIVO = 2     # ...ni por encima de este múltiplo del límite configurado
+PAUSA_MAXIMA = 30        # Pausa máxima entre reintentos (segundos)
+# Pasos cuyo tiempo agotado decide cómo se clasifica un resultado (p. ej. sin PDF): su
+# espera puede crecer con la latencia, pero nunca baja del límite de LIMITES_ESPERA
+PASOS_SIN_ACORTAR = {"imprimir", "descargar"}
+
+class LatenciaPortal:
+    """
+    Percentiles móviles de la latencia de cada espera del portal, usados para fijar el
+    tiempo máximo de espera y la pausa entre reintentos de cada paso.
+    
+    Cuando el portal responde rápido las esperas se acortan hasta p95 x MARGEN_LATENCIA
+    (así un elemento que no va a aparecer se detecta en segundos), salvo las de
+    PASOS_SIN_ACORTAR; cuando se degrada, los tiempos agotados entran en la ventana como
+    muestras y la espera crece hasta TECHO_ADAPTATIVO veces el límite de LIMITES_ESPERA.
+    Las pausas entre reintentos parten de la mediana del paso y crecen de forma
+    exponencial con jitter, para que los trabajadores no reintenten todos a la vez.
+    
+    Es seguro usarla desde varios hilos.
+    """
+    
+    def __init__(self, ventana=VENTANA_LATENCIA):
+        self.ventana = ventana
+        self.activa = True
+        self._muestras = {}
+        self._lock = threading.Lock()
+    
+    def registrar(self, clave, segundos):
+        with self._lock:
+            if clave not in self._muestras:
+                self._muestras[clave] = deque(maxlen=self.ventana)
+            self._muestras[clave].append(segundos)
+    
+    def percentil(self, clave, p):
+        """
+        Percentil por rango más cercano de las muestras recientes, o None si todavía
+        no hay MUESTRAS_MINIMAS.
+        """
+        with self._lock:
+            muestras = sorted(self._muestras.get(clave, ()))
+        if len(muestras) < MUESTRAS_MINIMAS:
+            return None
+        return muestras[max(0, math.ceil(p / 100 * len(muestras)) - 1)]
+    
+    def espera(self, paso, clave=None):
+        """
+        Tiempo máximo de espera (segundos) para un paso de LIMITES_ESPERA.
+        
+        Args:
+            clave: Serie de muestras a usar si no es la del propio paso
+        """
+        limite = LIMITES_ESPERA[paso]
+        p95 = self.percentil(clave or paso, 95) if self.activa else None
+        if p95 is None:
+            return limite
+        minima = limite if paso in PASOS_SIN_ACORTAR else ESPERA_MINIMA
+        return min(limite * TECHO_ADAPTATIVO, max(minima, p95 * MARGEN_LATENCIA))
+    
+    def pausa(self, paso, intento):
+        """
+        Pausa antes del reintento número `intento` (desde 0): backoff exponencial con
+        jitter a partir de la mediana del paso.
+        """
+        if not self.activa:
+            return 2
+        base = min(max(self.percentil(paso, 50) or 1, 0.25), 5)
+        return random.uniform(base, min(PAUSA_MAXIMA, base * 2 ** (intento + 1)))
+    
+    def esperar(self, driver, condicion, paso, clave=None):
+        """
+        WebDriverWait con la espera adaptativa del paso. Registra cuánto tardó la
+        condición o, si se agotó el tiempo, la espera completa.
+        
+        Raises:
+            TimeoutException si la condición no se cumple a tiempo
+        """
+        clave = clave or paso
+        espera = self.espera(paso, clave)
+        inicio = time.monotonic()
+        try:
+            resultado = WebDriverWait(driver, espera, poll_frequency=0.2).until(condicion)
+        except TimeoutException:
+            self.registrar(clave, espera)
+            raise
+        self.registrar(clave, time.monotonic() - inicio)
+        return resultado
+    
+    async def esperar_async(self, accion, paso, clave=None):
+        """
+        Versión de esperar() para Playwright: `accion` recibe la espera adaptativa del paso
+        en milisegundos, p. ej. lambda ms: frame.click(selector, timeout=ms).
+        
+        Raises:
+            PlaywrightTimeout si la acción no termina a tiempo
+        """
+        clave = clave or paso
+        espera = self.espera(paso, clave)
+        inicio = time.monotonic()
+        try:
+            resultado = await accion(espera * 1000)
+        except PlaywrightTimeout:
+            self.registrar(clave, espera)
+            raise
+        self.registrar(clave, time.monotonic() - inicio)
+        return resultado
+    
+    def log_resumen(self):
+        with self._lock:
+            claves = sorted(self._muestras)
+        for clave in claves:
+            p50, p95 = self.percentil(clave, 50), self.percentil(clave, 95)
+            if p95 is not None:
+                logger.info(f"📈 Latencia {clave}: p50 {p50:.2f} s, p95 {p95:.2f} s")
+
+# Latencias del proceso actual (compartidas por los trabajadores)
+LATENCIA = LatenciaPortal()
+
+# Circuito de protección del portal (LimitadorPortal)
+UMBRAL_CIRCUITO = 5          # Fallos dentro de la ventana que abren el circuito
+VENTANA_CIRCUITO = 60        # Segundos
+PAUSA_CIRCUITO = 60          # Pausa inicial con el circuito abierto (segundos)...
+PAUSA_CIRCUITO_MAXIMA = 600  # ...que se duplica si el portal sigue fallando, hasta este máximo
+
+class LimitadorPortal:
+    """
+    Limitador de acciones contra el portal (token bucket) y circuito de protección,
+    compartidos por todos los trabajadores del proceso.
+    
+    Cada clic, cambio de página o descarga toma una ficha; con tasa=None no hay límite
+    de ritmo. Si en VENTANA_CIRCUITO segundos se acumulan UMBRAL_CIRCUITO fallos
+    (resultados fallidos, páginas de error, descargas HTTP rechazadas), el circuito se
+    abre y todas las acciones esperan PAUSA_CIRCUITO segundos. Al cerrarse queda a
+    prueba: el primer éxito lo normaliza y el primer fallo lo vuelve a abrir con el
+    doble de pausa.
+    """
+    
+    def __init__(self, tasa=None, rafaga=None):
+        self._lock = threading.Lock()
+        self._fallos = deque()
+        self._abierto_hasta = 0
+        self._a_prueba = False
+        self._pausa = PAUSA_CIRCUITO
+        self.configurar(tasa, rafaga)
+    
+    def configurar(self, tasa=None, rafaga=None):
+        """
+        Args:
+            tasa: Acciones por segundo entre todos los trabajadores (None = sin límite)
+            rafaga: Acciones que se pueden hacer seguidas tras un periodo inactivo (default: max(1, tasa))
+        """
+        with self._lock:
+            self.tasa = tasa
+            self.rafaga = rafaga or max(1, tasa or 1)
+            self._fichas = self.rafaga
+            self._ultima = time.monotonic()
+        if tasa:
+            logger.info(f"🚦 Límite de {tasa} acciones/s contra el portal (ráfaga de {self.rafaga})")
+    
+    def _reservar(self):
+        """
+        Toma una ficha si hay; si no, devuelve los segundos que hay que esperar.
+        """
+        with self._lock:
+            ahora = time.monotonic()
+            if ahora < self._abierto_hasta:
+                return self._abierto_hasta - ahora
+            if not self.tasa:
+                return 0
+            self._fichas = min(self.rafaga, self._fichas + (ahora - self._ultima) * self.tasa)
+            self._ultima = ahora
+            if self._fichas >= 1:
+                self._fichas -= 1
+                return 0
+            return (1 - self._fichas) / self.tasa
+    
+    def adquirir(self):
+        """
+        Bloquea hasta que se pueda hacer una acción contra el portal.
+        """
+        while True:
+            espera = self._reservar()
+            if espera <= 0:
+                return
+            time.sleep(espera)
+    
+    async def adquirir_async(self):
+        while True:
+            espera = self._reservar()
+            if espera <= 0:
+                return
+            await asyncio.sleep(espera)
+    
+    def registrar(self, exito, motivo=None):
+        """
+        Informa el resultado de un paso completo (p. ej. un resultado descargado o fallido).
+        """
+        with self._lock:
+            ahora = time.monotonic()
+            if exito:
+                if self._a_prueba and ahora >= self._abierto_hasta:
+                    self._a_prueba = False
+                    self._pausa = PAUSA_CIRCUITO
+                    logger.info("🟢 Circuito cerrado: el portal vuelve a responder")
+                return
+            if ahora < self._abierto_hasta:
+                return  # Fallos de acciones que empezaron antes de abrir el circuito
+            self._fallos.append(ahora)
+            while self._fallos and ahora - self._fallos[0] > VENTANA_CIRCUITO:
+                self._fallos.popleft()
+            if not self._a_prueba and len(self._fallos) < UMBRAL_CIRCUITO:
+                return
+            if self._a_prueba:
+                self._pausa = min(self._pausa * 2, PAUSA_CIRCUITO_MAXIMA)
+            self._abierto_hasta = ahora + self._pausa
+            self._a_prueba = True
+            fallos = len(self._fallos)
+            self._fallos.clear()
+        logger.warning(f"🔴 Circuito abierto ({fallos} fallos, último: {motivo or 'fallo'}); "
+                       f"todos los trabajadores esperan {self._pausa} s")
+    
+    @property
+    def abierto(self):
+        return time.monotonic() < self._abierto_hasta
+
+# Limitador del proceso actual (compartido por los trabajadores)
+LIMITADOR = LimitadorPortal()
+
+# Textos de las páginas de error del portal o del servidor que lo publica
+SCRIPT_PAGINA_ERROR = """
+var texto = (document.title + ' ' + (document.body ? document.body.innerText.slice(0, 500) : '')).toLowerCase();
+return /service unavailable|too many requests|bad gateway|gateway time-?out|internal server error|error 50[0-9]|error 429|servicio no disponible/.test(texto);
+"""
+
+def pagina_de_error(driver):
+    """
+    True si el navegador muestra una página de error del servidor en lugar del portal.
+    """
+    try:
+        return bool(driver.execute_script(SCRIPT_PAGINA_ERROR))
+    except WebDriverException:
+        return False
+
+# Página de login o aviso de sesión vencida, en el documento actual o en el principal
+# (GeneXus puede mostrar el login dentro del iframe de detalle)
+SCRIPT_SESION_EXPIRADA = """
+var documentos = [document];
+try { if (window.top !== window) { documentos.push(window.top.document); } } catch (e) {}
+return documentos.some(function(d) {
+    if (d.getElementById('vCRITERIO')) { return false; }
+    if (d.getElementById('vNUM_DOC') || d.getElementById('vPASSWORD') || d.getElementById('INGRESAR')) { return true; }
+    var texto = (d.title + ' ' + (d.body ? d.body.innerText.slice(0, 500) : '')).toLowerCase();
+    return /sesi[oó]n (ha )?(expirado|expirada|caducado|caducada|finalizado|finalizada|terminado)|session (has )?(expired|timed out)|vuelva a (ingresar|iniciar sesi[oó]n)/.test(texto);
+});
+"""
+
+# Reautenticaciones permitidas por navegador dentro de la ventana; si la sesión sigue
+# expirando más seguido, se reinicia el navegador (supervisar_descarga)
+MAX_REAUTENTICACIONES = 3
+VENTANA_REAUTENTICACION = 600
+
+def sesion_expirada(driver):
+    """
+    True si el navegador muestra el login o un aviso de sesión expirada (un solo script).
+    """
+    try:
+        return bool(driver.execute_script(SCRIPT_SESION_EXPIRADA))
+    except InvalidSessionIdException:
+        raise
+    except WebDriverException:
+        return False
+
+class GuardiaSesion:
+    """
+    Middleware de sesión de un navegador: sabe con qué usuario se inició la sesión y
+    en qué búsqueda y página va la corrida (cursor), para volver a iniciar sesión en el
+    mismo navegador y dejar el listado donde estaba sin reiniciar nada más.
+    """
+    
+    def __init__(self, username, password, cursor=None):
+        self.username = username
+        self.password = password
+        self.cursor = cursor
+        self.reautenticaciones = 0
+        self._recientes = deque()
+    
+    def reautenticar(self, driver):
+        """
+        Inicia sesión de nuevo (sin usar la sesión guardada, que ya no sirve) y repite
+        la búsqueda y el salto de página del cursor.
+        
+        Raises:
+            NavegadorPerdido si la sesión expira demasiado seguido o no se pudo renovar
+        """
+        ahora = time.monotonic()
+        while self._recientes and ahora - self._recientes[0] > VENTANA_REAUTENTICACION:
+            self._recientes.popleft()
+        if len(self._recientes) >= MAX_REAUTENTICACIONES:
+            raise NavegadorPerdido(f"La sesión expiró {len(self._recientes)} veces en {VENTANA_REAUTENTICACION} s")
+        self._recientes.append(ahora)
+        self.reautenticaciones += 1
+        
+        logger.warning("🔑 La sesión del portal expiró; iniciando sesión de nuevo en el mismo navegador...")
+        try:
+            with METRICAS.medir("reautenticar"):
+                borrar_sesion(self.username, ranura_sesion())
+                salir_de_marco(driver)
+                iniciar_sesion(driver, self.username, self.password)
+                if self.cursor is not None:
+                    reanudar_en_cursor(driver, self.cursor)
+        except (NavegadorPerdido, InvalidSessionIdException):
+            raise
+        except Exception as e:
+            raise NavegadorPerdido(f"No se pudo renovar la sesión: {e}") from e
+        logger.info(f"✅ Sesión renovada en {time.monotonic() - ahora:.1f} s" + (f"; listado en {self.cursor}" if self.cursor else ""))
+
+_GUARDIAS = weakref.WeakKeyDictionary()
+
+def proteger_sesion(driver, username, password, cursor=None):
+    """
+    Activa la renovación automática de la sesión para este navegador.
+    
+    Args:
+        cursor: CursorDescarga con la búsqueda y la página que hay que restaurar
+    """
+    _GUARDIAS[driver] = GuardiaSesion(username, password, cursor)
+
+def recuperar_sesion(driver, comprobar=True):
+    """
+    Si la sesión del navegador expiró, la renueva en el mismo navegador (ver GuardiaSesion).
+    
+    Args:
+        comprobar: False si quien llama ya sabe que la sesión expiró
+    
+    Returns:
+        True si la sesión se renovó y el paso interrumpido se puede repetir
+    
+    Raises:
+        NavegadorPerdido si no se pudo renovar la sesión
+    """
+    guardia = _GUARDIAS.get(driver)
+    if guardia is None or (comprobar and not sesion_expirada(driver)):
+        return False
+    guardia.reautenticar(driver)
+    return True
+
+def con_sesion(preparar_reintento=None):
+    """
+    Decorador para los pasos que reciben el driver como primer argumento: si el paso
+    falla (excepción o False) con la sesión expirada, la renueva y repite el paso una vez.
+    La comprobación solo se hace cuando el paso falla.
+    
+    Args:
+        preparar_reintento: Función opcional (driver, *args, **kwargs) -> (args, kwargs)
+            que ajusta los argumentos del reintento al listado restaurado (p. ej. para
+            cambiar elementos que pertenecen al DOM de la sesión expirada)
+    """
+    def decorador(funcion):
+        def reintentar(driver, args, kwargs):
+            if preparar_reintento is not None:
+                args, kwargs = preparar_reintento(driver, *args, **kwargs)
+            return funcion(driver, *args, **kwargs)
+        
+        @functools.wraps(funcion)
+        def envoltura(driver, *args, **kwargs):
+            try:
+                resultado = funcion(driver, *args, **kwargs)
+            except (NavegadorPerdido, InvalidSessionIdException):
+                raise
+            except Exception:
+                if not recuperar_sesion(driver):
+                    raise
+                return reintentar(driver, args, kwargs)
+            if resultado is False and recuperar_sesion(driver):
+                return reintentar(driver, args, kwargs)
+            return resultado
+        return envoltura
+    return decorador
+
+def portal_inactivo(driver):
+    """
+    Condición para WebDriverWait: True cuando el portal no tiene actividad AJAX pendiente.
+    """
+    try:
+        return bool(driver.execute_script(SCRIPT_PORTAL_INACTIVO))
+    except StaleElementReferenceException:
+        return False
+    except WebDriverException as e:
+        # Durante una navegación el script puede fallar; se considera "ocupado"
+        if isinstance(e, InvalidSessionIdException):
+            raise
+        return False
+
+def esperar_portal_inactivo(driver, paso="pagina"):
+    """
+    Espera a que el portal termine de procesar (carga de página y AJAX de GeneXus).
+
+    Returns:
+        True si el portal quedó inactivo dentro del límite del paso, False en caso contrario
+    """
+    espera = LATENCIA.espera(paso, f"{paso}:inactivo")
+    try:
+        LATENCIA.esperar(driver, portal_inactivo, paso, f"{paso}:inactivo")
+        return True
+    except TimeoutException:
+        logger.warning(f"⚠️ El portal sigue ocupado después de {espera:.1f} s (paso '{paso}')")
+        return False
+
+def clic_cuando_listo(driver, by, selector, paso, esperar_despues=True, intentos=3):
+    """
+    Hace clic en un elemento en cuanto es interactuable y espera a que el portal procese el clic.
+    Si el elemento o su iframe se vuelven a dibujar entre la espera y el clic, se vuelve
+    a resolver por su localizador dentro del mismo marco.
+
+    Args:
+        driver: Instancia del WebDriver
+        by: Método de localización (By.ID, By.XPATH, etc.)
+        selector: Selector del elemento
+        paso: Nombre del paso en LIMITES_ESPERA que define el techo de espera
+        esperar_despues: Si es False no espera la inactividad del portal (p. ej. cuando
+            el clic cierra el iframe actual)
+        intentos: Veces que se vuelve a resolver un elemento obsoleto
+
+    Returns:
+        El elemento sobre el que se hizo clic
+
+    Raises:
+        TimeoutException si el elemento no es clickeable dentro del límite del paso
+    """
+    for intento in range(intentos):
+        try:
+            elemento = LATENCIA.esperar(driver, EC.element_to_be_clickable((by, selector)), paso)
+            driver.execute_script("arguments[0].scrollIntoView(true);", elemento)
+            LIMITADOR.adquirir()
+            elemento.click()
+            break
+        except (StaleElementReferenceException, NoSuchFrameException):
+            if intento == intentos - 1:
+                raise
+            logger.info(f"  ↳ {selector} quedó obsoleto, se vuelve a resolver en su marco")
+            marcos_de(driver).reingresar(driver)
+    if esperar_despues:
+        esperar_portal_inactivo(driver, paso)
+    return elemento
+
+def _esperar_elemento(driver, condicion, selector, timeout=None, paso="pagina"):
+    """
+    Espera fija si se indica timeout; si no, la espera adaptativa del paso con las
+    muestras propias del selector.
+    """
+    if timeout is not None:
+        return WebDriverWait(driver, timeout, poll_frequency=0.2).until(condicion)
+    return LATENCIA.esperar(driver, condicion, paso, f"{paso}:{selector}")
+
+def wait_and_click(driver, by, selector, timeout=None, retry_count=3, paso="pagina"):
     """
     Espera a que un elemento sea clickeable y luego hace clic en él con reintentos.
     
@@ -39,80 +789,94 @@ def wait_and_click(driver, by, selector, timeout=20, retry_count=3):
         driver: Instancia del WebDriver
         by: Método de localización (By.ID, By.XPATH, etc.)
         selector: Selector del elemento
-        timeout: Tiempo máximo de espera (en segundos)
+        timeout: Tiempo máximo de espera (en segundos); por defecto se ajusta a la latencia del portal
         retry_count: Número de reintentos
+        paso: Paso de LIMITES_ESPERA que define el techo de la espera adaptativa
         
     Returns:
         True si el clic fue exitoso, False en caso contrario
     """
     for attempt in range(retry_count):
         try:
-            element = WebDriverWait(driver, timeout).until(
-                EC.element_to_be_clickable((by, selector))
-            )
+            element = _esperar_elemento(driver, EC.element_to_be_clickable((by, selector)), selector, timeout, paso)
             # Hacer scroll al elemento para asegurar que sea visible
             driver.execute_script("arguments[0].scrollIntoView(true);", element)
-            time.sleep(0.5)  # Pequeña pausa después del scroll
+            LIMITADOR.adquirir()
             element.click()
+            esperar_portal_inactivo(driver)
             logger.info(f"✅ Clic exitoso en {selector}")
             return True
         except Exception as e:
             logger.warning(f"⚠️ Intento {attempt+1}/{retry_count} fallido para clic en {selector}: {str(e)}")
-            time.sleep(2)  # Esperar antes de reintentar
             
-            # Intentar refrescar el elemento si está obsoleto
-            if isinstance(e, StaleElementReferenceException):
-                logger.info("Elemento obsoleto, refrescando página...")
+            if isinstance(e, (StaleElementReferenceException, NoSuchFrameException)):
+                if attempt < retry_count - 2:
+                    # Volver a resolver el elemento en su marco; recargar borra el estado del listado
+                    logger.info("Elemento obsoleto, se vuelve a resolver en su marco...")
+                    marcos_de(driver).reingresar(driver)
+                    continue
+                logger.info("Elemento obsoleto otra vez, refrescando página como último recurso...")
                 try:
                     driver.refresh()
-                    time.sleep(3)
+                    esperar_portal_inactivo(driver)
                 except:
                     pass
+            time.sleep(LATENCIA.pausa(paso, attempt))  # Esperar antes de reintentar
     
     logger.error(f"❌ No se pudo hacer clic en {selector} después de {retry_count} intentos")
     return False
 
-def wait_for_element(driver, by, selector, timeout=20, retry_count=3):
+def wait_for_element(driver, by, selector, timeout=None, retry_count=3, paso="pagina"):
     """
     Espera a que un elemento esté presente con reintentos.
     
+    Args:
+        timeout: Tiempo máximo de espera (en segundos); por defecto se ajusta a la latencia del portal
+        paso: Paso de LIMITES_ESPERA que define el techo de la espera adaptativa
+    
     Returns:
         El elemento si se encuentra, None en caso contrario
     """
     for attempt in range(retry_count):
         try:
-            element = WebDriverWait(driver, timeout).until(
-                EC.presence_of_element_located((by, selector))
-            )
+            element = _esperar_elemento(driver, EC.presence_of_element_located((by, selector)), selector, timeout, paso)
             return element
         except Exception as e:
             logger.warning(f"⚠️ Intento {attempt+1}/{retry_count} fallido encontrando {selector}: {str(e)}")
-            time.sleep(2)
+            time.sleep(LATENCIA.pausa(paso, attempt))
     
     logger.error(f"❌ No se pudo encontrar el elemento {selector} después de {retry_count} intentos")
     return None
 
+@medido("recuperacion")
 def recuperar_navegacion(driver, intentos=3):
     """
     Intenta recuperar la navegación cuando hay errores.
     """
     logger.info("Intentando recuperar la navegación...")
+    if pagina_de_error(driver):
+        LIMITADOR.registrar(False, "página de error del portal")
     
     for intento in range(intentos):
+        # Con el circuito abierto, esperar a que se cierre en lugar de reintentar a ciegas
+        LIMITADOR.adquirir()
         try:
             # Primero intentar usar los botones VOLVER y CANCEL si están disponibles
             try:
+                # El detalle abierto está en su iframe; si no hay detalle se queda en el documento principal
+                marcos_de(driver).entrar(driver, "detalle")
                 volver_elements = driver.find_elements(By.ID, "VOLVER")
                 if volver_elements and len(volver_elements) > 0:
                     logger.info("Encontrado botón VOLVER, haciendo clic...")
                     volver_elements[0].click()
-                    time.sleep(3)
+                    esperar_portal_inactivo(driver, "recuperacion")
                     
                     cancel_elements = driver.find_elements(By.ID, "CANCEL")
                     if cancel_elements and len(cancel_elements) > 0:
                         logger.info("Encontrado botón CANCEL, haciendo clic...")
                         cancel_elements[0].click()
-                        time.sleep(3)
+                        salir_de_marco(driver)
+                        esperar_portal_inactivo(driver, "recuperacion")
                         logger.info("Recuperación exitosa usando botones")
                         return True
             except Exception as e:
@@ -120,8 +884,9 @@ def recuperar_navegacion(driver, intentos=3):
             
             # Si los botones no funcionaron, intentar navegar hacia atrás
             logger.info("Intentando recuperar con navegación back()")
+            salir_de_marco(driver)
             driver.back()
-            time.sleep(3)
+            esperar_portal_inactivo(driver, "recuperacion")
             
             # Verificar si estamos en la página principal comprobando algún elemento clave
             try:
@@ -137,7 +902,7 @@ def recuperar_navegacion(driver, intentos=3):
                     current_url = driver.current_url
                     logger.info(f"Intentando recargar la URL: {current_url}")
                     driver.get(current_url)
-                    time.sleep(5)
+                    esperar_portal_inactivo(driver, "pagina")
                     
                     # Verificar si se cargó correctamente
                     if driver.find_elements(By.ID, "vCRITERIO"):
@@ -152,20 +917,20 @@ def recuperar_navegacion(driver, intentos=3):
         except Exception as e:
             logger.error(f"Error durante recuperación (intento {intento+1}): {str(e)}")
         
-        time.sleep(2)
+        time.sleep(LATENCIA.pausa("recuperacion", intento))
     
     logger.error("❌ No se pudo recuperar la navegación después de varios intentos")
     return False
 
-def reiniciar_navegador(opciones_chrome):
+@medido("reinicio")
+def reiniciar_navegador(configuracion):
     """
     Reinicia el navegador cuando hay problemas graves.
     """
     logger.info("🔄 Reiniciando el navegador...")
     try:
         # Crear un nuevo driver
-        nuevo_driver = webdriver.Chrome(options=opciones_chrome)
-        nuevo_driver.maximize_window()
+        nuevo_driver = crear_navegador(configuracion)
         
         logger.info("✅ Navegador reiniciado correctamente")
         return nuevo_driver
@@ -173,84 +938,726 @@ def reiniciar_navegador(opciones_chrome):
         logger.error(f"❌ Error al reiniciar navegador: {str(e)}")
         return None
 
-# Función para registrar en archivo log
-def log_descarga(nombre_archivo):
+RUTA_MANIFIESTO = "descargas_lab_nancy.db"
+
+class ManifiestoDescargas:
+    """
+    Registro SQLite de los resultados procesados: clave (CTLCOD), rango de fechas,
+    página, estado, archivo y tiempos. Permite reanudar una corrida saltando en O(1)
+    los resultados ya completados (se mantienen en memoria al abrir el manifiesto).
+    
+    Es seguro usarlo desde varios hilos; varios procesos pueden compartir el mismo
+    archivo gracias al modo WAL.
     """
-    Registra la descarga exitosa en un archivo de log
+    
+    ESQUEMA = """
+    CREATE TABLE IF NOT EXISTS descargas (
+        clave TEXT PRIMARY KEY,
+        fecha_desde TEXT,
+        fecha_hasta TEXT,
+        pagina INTEGER,
+        estado TEXT NOT NULL,
+        ruta_archivo TEXT,
+        bytes INTEGER,
+        intentos INTEGER NOT NULL DEFAULT 0,
+        inicio TEXT,
+        fin TEXT,
+        duracion REAL,
+        error TEXT,
+        fecha_resultado TEXT,
+        examen TEXT,
+        sha256 TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_descargas_rango ON descargas (fecha_desde, fecha_hasta, estado);
+    CREATE INDEX IF NOT EXISTS idx_descargas_estado ON descargas (estado);
+    CREATE TABLE IF NOT EXISTS marcas (
+        nombre TEXT PRIMARY KEY,
+        valor TEXT NOT NULL,
+        actualizado TEXT
+    );
     """
-    log_file = "descargas_lab_nancy.txt"
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     
-    with open(log_file, "a", encoding="utf-8") as f:
-        f.write(f"{timestamp} - Descarga exitosa: {nombre_archivo}\n")
+    def __init__(self, ruta=RUTA_MANIFIESTO, fecha_desde=None, fecha_hasta=None):
+        self.ruta = ruta
+        self.fecha_desde = fecha_desde
+        self.fecha_hasta = fecha_hasta
+        self._lock = threading.Lock()
+        self._inicios = {}
+        self._conexion = sqlite3.connect(ruta, timeout=30, check_same_thread=False)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.executescript(self.ESQUEMA)
+        # Manifiestos creados antes de registrar la fecha, el examen y el hash de cada resultado
+        columnas = {fila[1] for fila in self._conexion.execute("PRAGMA table_info(descargas)")}
+        for columna in ("fecha_resultado", "examen", "sha256"):
+            if columna not in columnas:
+                self._conexion.execute(f"ALTER TABLE descargas ADD COLUMN {columna} TEXT")
+        self._completados = {
+            fila[0] for fila in self._conexion.execute("SELECT clave FROM descargas WHERE estado = 'completado'")
+        }
+        logger.info(f"📝 Manifiesto {ruta}: {len(self._completados)} resultados ya completados")
     
-    logger.info(f"📝 Registro guardado en {log_file}")
-#proceso para cambiar al iframe
-def cambiar_a_iframe(driver, index):
+    @staticmethod
+    def clave_valida(clave):
+        """
+        Solo se registran claves reales; las provisionales ("resultado_...", ver
+        filas_desde_instantanea) no identifican un resultado y nunca se saltan.
+        """
+        return bool(clave) and clave != "desconocido" and not clave.startswith("resultado_")
+    
+    def completado(self, clave):
+        return clave in self._completados
+    
+    def iniciar(self, clave, pagina=None, fila=None):
+        """
+        Marca un resultado como en curso antes de empezar su descarga.
+        
+        Args:
+            fila: Fila de instantanea_listado del resultado (registra su fecha y examen)
+        """
+        if not self.clave_valida(clave):
+            return
+        ahora = datetime.datetime.now()
+        fecha = fila.get("fecha") if fila else None
+        examen = fila.get("examen") if fila else None
+        with self._lock:
+            self._inicios[clave] = time.monotonic()
+            self._conexion.execute(
+                """INSERT INTO descargas (clave, fecha_desde, fecha_hasta, pagina, estado, intentos, inicio, fecha_resultado, examen)
+                   VALUES (?, ?, ?, ?, 'en_curso', 1, ?, ?, ?)
+                   ON CONFLICT(clave) DO UPDATE SET
+                       fecha_desde = excluded.fecha_desde, fecha_hasta = excluded.fecha_hasta,
+                       pagina = excluded.pagina, estado = 'en_curso', intentos = intentos + 1,
+                       inicio = excluded.inicio, error = NULL,
+                       fecha_resultado = COALESCE(excluded.fecha_resultado, fecha_resultado),
+                       examen = COALESCE(excluded.examen, examen)""",
+                (clave, self.fecha_desde, self.fecha_hasta, pagina, ahora.isoformat(timespec="seconds"),
+                 fecha.isoformat() if fecha else None, examen)
+            )
+            self._conexion.commit()
+    
+    def completar(self, clave, ruta_archivo=None, tamano=None, sha256=None):
+        """
+        Marca un resultado como descargado.
+        """
+        if not self.clave_valida(clave):
+            return
+        ahora = datetime.datetime.now()
+        with self._lock:
+            inicio = self._inicios.pop(clave, None)
+            duracion = time.monotonic() - inicio if inicio is not None else None
+            self._conexion.execute(
+                """INSERT INTO descargas (clave, fecha_desde, fecha_hasta, estado, ruta_archivo, bytes, intentos, inicio, fin, duracion, sha256)
+                   VALUES (?, ?, ?, 'completado', ?, ?, 1, ?, ?, ?, ?)
+                   ON CONFLICT(clave) DO UPDATE SET
+                       estado = 'completado', ruta_archivo = excluded.ruta_archivo, bytes = excluded.bytes,
+                       fin = excluded.fin, duracion = excluded.duracion, error = NULL, sha256 = excluded.sha256""",
+                (clave, self.fecha_desde, self.fecha_hasta, ruta_archivo, tamano,
+                 ahora.isoformat(timespec="seconds"), ahora.isoformat(timespec="seconds"), duracion, sha256)
+            )
+            self._conexion.commit()
+            self._completados.add(clave)
+    
+    def sin_pdf(self, clave):
+        """
+        Marca un resultado cuyo detalle cargó sin IMPRIMIR. No cuenta como completado: la
+        próxima corrida lo vuelve a revisar, por si el laboratorio publica el PDF después.
+        """
+        if not self.clave_valida(clave):
+            return
+        ahora = datetime.datetime.now()
+        with self._lock:
+            inicio = self._inicios.pop(clave, None)
+            duracion = time.monotonic() - inicio if inicio is not None else None
+            self._conexion.execute(
+                """INSERT INTO descargas (clave, fecha_desde, fecha_hasta, estado, intentos, inicio, fin, duracion)
+                   VALUES (?, ?, ?, 'sin_pdf', 1, ?, ?, ?)
+                   ON CONFLICT(clave) DO UPDATE SET
+                       estado = 'sin_pdf', ruta_archivo = NULL, bytes = NULL, sha256 = NULL,
+                       fin = excluded.fin, duracion = excluded.duracion, error = NULL""",
+                (clave, self.fecha_desde, self.fecha_hasta,
+                 ahora.isoformat(timespec="seconds"), ahora.isoformat(timespec="seconds"), duracion)
+            )
+            self._conexion.commit()
+            self._completados.discard(clave)
+    
+    def fallar(self, clave, error=None):
+        """
+        Marca un resultado como fallido; se volverá a intentar en la próxima corrida.
+        """
+        if not self.clave_valida(clave):
+            return
+        with self._lock:
+            self._inicios.pop(clave, None)
+            self._conexion.execute(
+                "UPDATE descargas SET estado = 'fallido', fin = ?, error = ? WHERE clave = ?",
+                (datetime.datetime.now().isoformat(timespec="seconds"), str(error) if error else None, clave)
+            )
+            self._conexion.commit()
+    
+    def marca(self, nombre):
+        """
+        Devuelve el valor de una marca de agua (p. ej. la última fecha sincronizada), o None.
+        """
+        with self._lock:
+            fila = self._conexion.execute("SELECT valor FROM marcas WHERE nombre = ?", (nombre,)).fetchone()
+        return fila[0] if fila else None
+    
+    def fijar_marca(self, nombre, valor):
+        with self._lock:
+            self._conexion.execute(
+                """INSERT INTO marcas (nombre, valor, actualizado) VALUES (?, ?, ?)
+                   ON CONFLICT(nombre) DO UPDATE SET valor = excluded.valor, actualizado = excluded.actualizado""",
+                (nombre, valor, datetime.datetime.now().isoformat(timespec="seconds"))
+            )
+            self._conexion.commit()
+    
+    def cerrar(self):
+        with self._lock:
+            self._conexion.close()
+
+# Manifiesto del proceso actual (se abre con abrir_manifiesto al comenzar una corrida)
+MANIFIESTO = None
+
+def abrir_manifiesto(ruta=RUTA_MANIFIESTO, fecha_desde=None, fecha_hasta=None):
     """
-    Cambia correctamente al iframe que contiene el contenido de resultados.
+    Abre (o crea) el manifiesto de descargas para el proceso actual.
     """
-    try:
-        logger.info("Intentando cambiar al iframe...")
+    global MANIFIESTO
+    if MANIFIESTO is not None and MANIFIESTO.ruta == ruta:
+        MANIFIESTO.fecha_desde, MANIFIESTO.fecha_hasta = fecha_desde, fecha_hasta
+        return MANIFIESTO
+    MANIFIESTO = ManifiestoDescargas(ruta, fecha_desde, fecha_hasta)
+    return MANIFIESTO
+
+def hash_archivo(ruta, bloque=1 << 20):
+    """
+    SHA-256 del archivo descargado, o None si no existe.
+    """
+    if not ruta or not os.path.isfile(ruta):
+        return None
+    digest = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for parte in iter(lambda: f.read(bloque), b""):
+            digest.update(parte)
+    return digest.hexdigest()
+
+# Función para registrar la descarga en el manifiesto
+def log_descarga(nombre_archivo, ruta_archivo=None, tamano=None):
+    """
+    Registra la descarga exitosa en el manifiesto de descargas
+    """
+    if MANIFIESTO is None:
+        logger.info(f"📝 Descarga exitosa: {nombre_archivo} (sin manifiesto)")
+        return
+    MANIFIESTO.completar(nombre_archivo, ruta_archivo, tamano, hash_archivo(ruta_archivo))
+    logger.info(f"📝 Registro guardado en {MANIFIESTO.ruta}")
+
+def log_sin_pdf(nombre_archivo):
+    """
+    Registra en el manifiesto un resultado sin PDF (ver ManifiestoDescargas.sin_pdf)
+    """
+    if MANIFIESTO is None:
+        logger.info(f"📝 Resultado sin PDF: {nombre_archivo} (sin manifiesto)")
+        return
+    MANIFIESTO.sin_pdf(nombre_archivo)
+    logger.info(f"📝 Resultado sin PDF registrado en {MANIFIESTO.ruta}")
+# Iframes conocidos del portal y los IDs de elementos que solo existen dentro de cada uno.
+# El iframe se reconoce por su contenido, no por su posición en la página.
+MARCOS_PORTAL = {
+    "detalle": ("IMPRIMIR", "DESCARGAR", "VOLVER", "CANCEL"),
+}
+
+class MarcosNavegador:
+    """
+    Caché de los iframes de una sesión del navegador: para cada marco de MARCOS_PORTAL
+    guarda el elemento <iframe> y su posición. Mientras el iframe siga en la página se
+    entra en él con un solo comando; cuando el portal lo reemplaza (nuevo detalle,
+    navegación) el elemento queda obsoleto y se vuelve a buscar, empezando por la
+    posición anterior.
+    
+    También recuerda en qué marco está el driver, para poder volver a resolver ahí un
+    elemento obsoleto sin recargar la página.
+    """
+    
+    def __init__(self):
+        self._iframes = {}
+        self.actual = None
+    
+    def _buscar(self, driver, marco):
+        marcadores = MARCOS_PORTAL[marco]
         iframes = driver.find_elements(By.TAG_NAME, "iframe")
-        if len(iframes) >= 2:
-            iframe = iframes[1]  # índice 1 para el segundo iframe
-            driver.switch_to.frame(iframe)
-            logger.info("Cambiado exitosamente al iframe")
+        posicion_anterior = self._iframes.get(marco, (None, 1))[1]
+        for posicion in sorted(range(len(iframes)), key=lambda i: i != posicion_anterior):
+            try:
+                driver.switch_to.frame(iframes[posicion])
+                if any(driver.find_elements(By.ID, marcador) for marcador in marcadores):
+                    self._iframes[marco] = (iframes[posicion], posicion)
+                    return True
+            except (StaleElementReferenceException, NoSuchFrameException):
+                pass
+            driver.switch_to.default_content()
+        return False
+    
+    def entrar(self, driver, marco):
+        """
+        Cambia el driver al marco indicado (None = documento principal).
+        
+        Returns:
+            True si el driver quedó dentro del marco, False si el marco no está en la página
+        """
+        driver.switch_to.default_content()
+        self.actual = None
+        if marco is None:
             return True
-        else:
-            logger.info(f"No se encontraron suficientes iframes. Solo hay {len(iframes)} disponibles.")
-            # Intentar con el primer iframe si solo hay uno
-            if len(iframes) == 1:
-                driver.switch_to.frame(iframes[0])
-                logger.info("Cambiado al único iframe disponible")
+        iframe = self._iframes.get(marco, (None, None))[0]
+        if iframe is not None:
+            try:
+                driver.switch_to.frame(iframe)
+                self.actual = marco
                 return True
+            except (StaleElementReferenceException, NoSuchFrameException):
+                driver.switch_to.default_content()
+        if self._buscar(driver, marco):
+            self.actual = marco
+            return True
+        return False
+    
+    def entrar_por_posicion(self, driver, posicion):
+        """
+        Último recurso cuando ningún iframe tiene el contenido esperado: entrar por posición.
+        """
+        driver.switch_to.default_content()
+        iframes = driver.find_elements(By.TAG_NAME, "iframe")
+        if not iframes:
             return False
+        driver.switch_to.frame(iframes[min(posicion, len(iframes) - 1)])
+        self.actual = None
+        return True
+    
+    def reingresar(self, driver):
+        """
+        Vuelve a entrar en el marco actual después de que un elemento o el propio
+        iframe quedaron obsoletos.
+        """
+        return self.entrar(driver, self.actual)
+
+# Caché de marcos de cada navegador (se libera sola cuando el driver deja de usarse)
+_MARCOS = weakref.WeakKeyDictionary()
+
+def marcos_de(driver):
+    marcos = _MARCOS.get(driver)
+    if marcos is None:
+        marcos = _MARCOS[driver] = MarcosNavegador()
+    return marcos
+
+def salir_de_marco(driver):
+    """
+    Vuelve al documento principal del portal.
+    """
+    marcos_de(driver).entrar(driver, None)
+
+#proceso para cambiar al iframe
+@medido("iframe")
+def cambiar_a_iframe(driver, index, marco="detalle"):
+    """
+    Cambia correctamente al iframe que contiene el contenido de resultados.
+    
+    Args:
+        index: Posición del iframe si ninguno tiene el contenido del marco (último recurso)
+        marco: Marco de MARCOS_PORTAL que se busca por contenido
+    """
+    try:
+        logger.info("Intentando cambiar al iframe...")
+        marcos = marcos_de(driver)
+        # Esperar a que el iframe con el contenido del marco esté cargado en lugar de una pausa fija
+        try:
+            LATENCIA.esperar(driver, lambda d: marcos.entrar(d, marco), "iframe")
+        except TimeoutException:
+            logger.warning(f"⚠️ Ningún iframe tiene el contenido de '{marco}', se usa el iframe {index}")
+            if not marcos.entrar_por_posicion(driver, index):
+                logger.info("No se encontró ningún iframe en la página")
+                return False
+        esperar_portal_inactivo(driver, "iframe")
+        logger.info("Cambiado exitosamente al iframe")
+        return True
     except Exception as e:
         logger.error(f"Error al cambiar al iframe: {e}")
         return False
-#Proceso para descargar resultados
-def descargar_resultado(driver, index, total):
+
+# Script que lee en un solo viaje todas las filas del listado. Cada fila se arma a partir
+# de su enlace "Ver": el identificador (CTLCOD/CTLID), la fecha (CTLFEC) y el examen
+# (CTLEXA) se buscan en el mismo <tr>, o por el sufijo de fila de GeneXus (_0001, ...).
+# arguments[0] = false omite los elementos (para Playwright, que solo devuelve datos).
+SCRIPT_INSTANTANEA_LISTADO = """
+var incluirEnlaces = arguments.length ? arguments[0] !== false : true;
+var enlaces = document.evaluate("//span[starts-with(@id, 'span_CTLVER_')]/a", document, null,
+                                XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+var filas = [];
+for (var i = 0; i < enlaces.snapshotLength; i++) {
+    var enlace = enlaces.snapshotItem(i);
+    var fila = enlace.closest('tr');
+    var sufijo = (enlace.parentNode.id.match(/_\\d+$/) || [''])[0];
+    var texto = function(controles) {
+        for (var j = 0; j < controles.length; j++) {
+            var celda = fila ? fila.querySelector('td[id*="' + controles[j] + '"]') : null;
+            if (!celda && sufijo) {
+                celda = document.querySelector('[id*="' + controles[j] + '"][id$="' + sufijo + '"]');
+            }
+            if (celda) { return celda.textContent.trim(); }
+        }
+        return null;
+    };
+    filas.push({
+        clave: texto(['_CTLCOD', '_CTLID']),
+        fecha: texto(['_CTLFEC']),
+        examen: texto(['_CTLEXA']),
+        enlace: incluirEnlaces ? enlace : null
+    });
+}
+return filas;
+"""
+
+def filas_desde_instantanea(filas, pagina=None):
     """
-    Función para descargar un resultado individual con mejor manejo de errores.
+    Normaliza las filas devueltas por SCRIPT_INSTANTANEA_LISTADO: fecha convertida a
+    datetime.date (o None) y, si la fila no tiene identificador, una clave provisional
+    por posición ("resultado_<página>_<fila>", o "resultado_<fila>" sin página), para
+    que dos filas sin identificador no compartan archivo.
+    """
+    for posicion, fila in enumerate(filas, 1):
+        if not fila.get("clave"):
+            fila["clave"] = f"resultado_{pagina}_{posicion}" if pagina else f"resultado_{posicion}"
+        coincidencia = re.search(r"\d{2}/\d{2}/\d{4}", fila.get("fecha") or "")
+        fila["fecha"] = datetime.datetime.strptime(coincidencia.group(0), "%d/%m/%Y").date() if coincidencia else None
+    return filas
+
+def instantanea_listado(driver):
+    """
+    Lee todas las filas de la página actual del listado con un solo script.
     
     Returns:
-        True si la descarga fue exitosa, False en caso contrario
+        Lista de diccionarios {clave, fecha, examen, enlace} en el orden del listado;
+        "enlace" es el WebElement del enlace "Ver" de la fila
     """
-    logger.info(f"✅ Enlace Ver {index+1}/{total}: Iniciando secuencia de descarga")
+    return filas_desde_instantanea(driver.execute_script(SCRIPT_INSTANTANEA_LISTADO) or [])
+
+# Carpeta de salida por defecto de todos los motores
+DIRECTORIO_SALIDA = "resultados_lab_nancy"
+
+# Subcarpeta de la salida donde Chrome deja las descargas de cada sesión antes de moverlas
+CARPETA_STAGING = ".staging"
+
+def _nombre_seguro(texto):
+    return re.sub(r"[^\w.-]", "_", texto)
+
+def ruta_resultado(directorio, clave, fecha=None, extension=".pdf"):
+    """
+    Ruta definitiva de un resultado: <directorio>/<AAAA>/<MM>/<clave>.pdf según la fecha del
+    resultado (sin_fecha/ si no se conoce). Con la clave y la fecha del manifiesto o del
+    listado se llega al archivo sin listar carpetas, y cada carpeta tiene a lo sumo un mes.
+    """
+    carpeta = os.path.join(directorio, f"{fecha:%Y}", f"{fecha:%m}") if fecha else os.path.join(directorio, "sin_fecha")
+    return os.path.join(carpeta, _nombre_seguro(clave) + extension)
+
+def guardar_resultado(origen, directorio, clave, fecha=None):
+    """
+    Mueve un archivo terminado de la carpeta de staging a su ruta definitiva. os.replace es
+    atómico dentro del mismo disco (staging está dentro de la salida): quien lea la salida
+    nunca ve un archivo a medias, y un resultado repetido reemplaza al anterior.
     
-    try:
-        # Intentar obtener el nombre/identificador del resultado para el log
-        try:
-            # Buscar el identificador (puede ser un ID de paciente, número de muestra, etc.)
-            # Ajusta este selector según la estructura real de la página
-            identificadores = driver.find_elements(By.XPATH, f"//tr[{index+1}]/td[contains(@id, '_CTLCOD') or contains(@id, '_CTLID')]")
-            nombre_archivo = "desconocido"
-            if identificadores and len(identificadores) > 0:
-                nombre_archivo = identificadores[0].text.strip()
-        except:
-            nombre_archivo = f"resultado_{index+1}"
-        
-        # Volver a obtener los enlaces por si el DOM se recarga
-        ver_links = driver.find_elements(By.XPATH, "//span[starts-with(@id, 'span_CTLVER_')]/a")
-        if index >= len(ver_links):
-            logger.error(f"❌ Índice {index} fuera de rango. Solo hay {len(ver_links)} enlaces disponibles")
-            return False
-        
-        # 1. Clic en "Ver"
+    Returns:
+        La ruta definitiva
+    """
+    destino = ruta_resultado(directorio, clave, fecha, os.path.splitext(origen)[1].lower() or ".pdf")
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    os.replace(origen, destino)
+    return destino
+
+def carpeta_staging(directorio):
+    """
+    Carpeta de descargas propia de la sesión actual (ver ranura_sesion), vacía: lo que
+    quedó de un navegador anterior de la misma sesión está incompleto.
+    """
+    ruta = os.path.join(directorio, CARPETA_STAGING, _nombre_seguro(ranura_sesion()))
+    os.makedirs(ruta, exist_ok=True)
+    for nombre in os.listdir(ruta):
+        try:
+            os.remove(os.path.join(ruta, nombre))
+        except OSError:
+            pass
+    return ruta
+
+class DescargasNavegador:
+    """
+    Carpetas de descarga de un navegador: la salida definitiva de los PDF y la carpeta
+    donde Chrome los escribe (la de staging, o la propia salida si no se pudo fijar por
+    DevTools).
+    """
+    
+    def __init__(self, directorio_salida=None, directorio_staging=None):
+        self.directorio_salida = directorio_salida
+        self.directorio_staging = directorio_staging
+
+# Carpetas de descarga de cada navegador, registradas por crear_navegador
+_DESCARGAS = weakref.WeakKeyDictionary()
+
+def descargas_de(driver):
+    """
+    Carpetas de descarga del navegador; si no lo creó crear_navegador, ambas son None.
+    """
+    descargas = _DESCARGAS.get(driver)
+    return descargas if descargas is not None else DescargasNavegador()
+
+class DescargaIncompleta(Exception):
+    """
+    Se lanza cuando Chrome cancela una descarga o el archivo queda truncado.
+    """
+
+# Archivos que Chrome está escribiendo todavía
+EXTENSIONES_TEMPORALES = (".crdownload", ".tmp", ".part")
+
+def pdf_completo(ruta, nombre=None):
+    """
+    Comprueba que un PDF tenga encabezado y marca de fin (%%EOF) para detectar archivos truncados.
+    Los archivos que no son PDF se dan por buenos.
+    
+    Args:
+        nombre: Nombre que decide si es un PDF (default: la ruta), p. ej. el destino de un .part
+    """
+    if not (nombre or ruta).lower().endswith(".pdf"):
+        return True
+    with open(ruta, "rb") as f:
+        if not f.read(5).startswith(b"%PDF"):
+            return False
+        f.seek(max(0, os.path.getsize(ruta) - 2048))
+        return b"%%EOF" in f.read()
+
+class SeguimientoDescarga:
+    """
+    Sigue la descarga que dispara un clic (DESCARGAR) hasta que el archivo está completo
+    en disco, en lugar de una pausa fija.
+    
+    El mecanismo principal es la carpeta de descargas (staging de la sesión): un archivo
+    nuevo sin extensión temporal cuyo tamaño se mantiene entre dos revisiones y que es
+    un PDF completo. El log de rendimiento de chromedriver solo reenvía eventos de la
+    página, no los Browser.download* que activa Browser.setDownloadBehavior; si Chrome
+    emite los Page.downloadWillBegin / Page.downloadProgress se usan como complemento
+    (nombre sugerido, bytes esperados, cancelación), pero no son necesarios.
+    
+    Se crea justo antes del clic; esperar() devuelve la ruta, los bytes y los segundos.
+    Sin carpeta conocida la descarga solo se da por terminada con el evento de Chrome, y
+    sin carpeta ni eventos no se puede verificar: revisar() lanza DescargaIncompleta.
+    """
+    
+    def __init__(self, driver):
+        self.driver = driver
+        self.directorio = descargas_de(driver).directorio_staging
+        self.previos = set(os.listdir(self.directorio)) if self.directorio else set()
+        self.descargas = {}
+        self.eventos = True
+        self._leer_eventos()  # Descartar los eventos anteriores al clic
+        self.descargas.clear()
+        self.inicio = time.monotonic()
+        self._ultimo_avance = self.inicio
+        self._progreso_anterior = None
+        self._anteriores = {}
+    
+    def _leer_eventos(self):
+        if not self.eventos:
+            return
         try:
-            ver_links[index].click()
-            logger.info("  ↳ 1/5: Clic en enlace 'Ver' completado")
-            time.sleep(3)  # Espera para que cargue la página
-        except StaleElementReferenceException:
-            # Si el elemento está obsoleto, refrescar la lista
-            ver_links = driver.find_elements(By.XPATH, "//span[starts-with(@id, 'span_CTLVER_')]/a")
-            if index >= len(ver_links):
-                logger.error("❌ Enlaces 'Ver' ya no disponibles después de refresco")
+            entradas = self.driver.get_log("performance")
+        except (WebDriverException, ValueError):
+            self.eventos = False
+            return
+        for entrada in entradas:
+            mensaje = json.loads(entrada["message"]).get("message", {})
+            metodo = mensaje.get("method", "")
+            params = mensaje.get("params", {})
+            # Solo llegan los Page.download* (si Chrome los emite): el log no reenvía el dominio Browser
+            if metodo.endswith(".downloadWillBegin"):
+                self.descargas.setdefault(params["guid"], {}).update(nombre=params.get("suggestedFilename"))
+            elif metodo.endswith(".downloadProgress"):
+                self.descargas.setdefault(params["guid"], {}).update(
+                    estado=params.get("state"), recibidos=params.get("receivedBytes"), total=params.get("totalBytes")
+                )
+    
+    def _archivos_nuevos(self):
+        """
+        Archivos nuevos de la carpeta de descargas: (terminados, en curso) con su tamaño.
+        """
+        if not self.directorio:
+            return {}, {}
+        terminados, en_curso = {}, {}
+        for nombre in set(os.listdir(self.directorio)) - self.previos:
+            ruta = os.path.join(self.directorio, nombre)
+            # La carpeta puede ser la salida, donde otros trabajadores crean subcarpetas
+            if not os.path.isfile(ruta):
+                continue
+            try:
+                tamano = os.path.getsize(ruta)
+            except OSError:
+                continue
+            (en_curso if nombre.endswith(EXTENSIONES_TEMPORALES) else terminados)[nombre] = tamano
+        return terminados, en_curso
+    
+    def revisar(self, paso="descarga"):
+        """
+        Revisa una vez los eventos y la carpeta sin bloquear (lo usa esperar() y el
+        procesamiento en pestañas, que atiende varias pestañas en la misma vuelta).
+        
+        Returns:
+            Diccionario {"ruta", "bytes", "segundos"} si la descarga terminó ("ruta" es None
+            si Chrome la dio por completada sin carpeta conocida), None si sigue en curso o
+            aún no empieza
+        
+        Raises:
+            DescargaIncompleta si Chrome cancela la descarga, el PDF queda truncado o no
+            hay carpeta ni eventos con qué verificarla
+        """
+        self._leer_eventos()
+        if not self.eventos and not self.directorio:
+            raise DescargaIncompleta("Sin carpeta de descargas ni eventos de Chrome: no se puede verificar la descarga")
+        terminados, en_curso = self._archivos_nuevos()
+        
+        descarga = next(iter(self.descargas.values()), None)
+        if descarga and descarga.get("estado") == "canceled":
+            raise DescargaIncompleta(f"Chrome canceló la descarga de {descarga.get('nombre')}")
+        completada = bool(descarga) and descarga.get("estado") == "completed"
+        
+        # Con eventos se toma el archivo con el nombre sugerido (o el único nuevo);
+        # sin eventos, un archivo terminado cuyo tamaño no cambió entre dos revisiones
+        nombre = None
+        if descarga and descarga.get("nombre") in terminados:
+            nombre = descarga["nombre"]
+        elif len(terminados) == 1:
+            nombre = next(iter(terminados))
+        listo = nombre is not None and (
+            completada or (not self.descargas and not en_curso and self._anteriores.get(nombre) == terminados[nombre])
+        )
+        
+        if listo:
+            ruta = os.path.join(self.directorio, nombre)
+            tamano = terminados[nombre]
+            error = None
+            if completada and descarga.get("total") and tamano < descarga["total"]:
+                error = f"{nombre}: {tamano} de {descarga['total']} bytes"
+            elif not pdf_completo(ruta):
+                error = f"{nombre}: el PDF está truncado"
+            if error:
+                # Sacar el archivo incompleto para que el reintento no lo confunda con uno bueno
+                try:
+                    os.remove(ruta)
+                except OSError:
+                    pass
+                raise DescargaIncompleta(error)
+            segundos = time.monotonic() - self.inicio
+            LATENCIA.registrar(paso, segundos)
+            return {"ruta": ruta, "bytes": tamano, "segundos": segundos}
+        if completada and not self.directorio:
+            segundos = time.monotonic() - self.inicio
+            LATENCIA.registrar(paso, segundos)
+            return {"ruta": None, "bytes": descarga.get("recibidos"), "segundos": segundos}
+        
+        progreso = (descarga.get("recibidos") if descarga else None, tuple(sorted({**terminados, **en_curso}.items())))
+        if progreso != self._progreso_anterior:
+            self._progreso_anterior = progreso
+            self._ultimo_avance = time.monotonic()
+        self._anteriores = terminados
+        return None
+    
+    def vencida(self, paso="descarga"):
+        """
+        True si pasó el límite del paso desde el último avance (ver esperar()).
+        """
+        return time.monotonic() - self._ultimo_avance >= LATENCIA.espera(paso)
+    
+    @property
+    def empezada(self):
+        """
+        True si Chrome avisó la descarga o apareció algún archivo nuevo en la carpeta.
+        """
+        return bool(self.descargas or self._progreso_anterior and self._progreso_anterior[1])
+    
+    def esperar(self, paso="descarga"):
+        """
+        Espera a que la descarga termine. El límite del paso cuenta desde el último
+        avance (bytes recibidos o archivo creciendo), así una descarga lenta pero
+        activa no se corta.
+        
+        Returns:
+            Diccionario {"ruta", "bytes", "segundos"} (ver revisar()), o None si nunca empezó
+        
+        Raises:
+            DescargaIncompleta si Chrome cancela la descarga, el PDF queda truncado o no
+            se puede verificar
+        """
+        espera = LATENCIA.espera(paso)
+        self._ultimo_avance = time.monotonic()
+        while not self.vencida(paso):
+            resultado = self.revisar(paso)
+            if resultado:
+                return resultado
+            time.sleep(0.2)
+        
+        LATENCIA.registrar(paso, espera)
+        if self.empezada:
+            raise DescargaIncompleta(f"La descarga no avanzó en {espera:.1f} s")
+        return None
+
+def fila_renovada(driver, index, total, fila=None):
+    """
+    Argumentos para repetir descargar_resultado después de renovar la sesión: la fila
+    se vuelve a buscar por su clave en una instantánea del listado restaurado, porque
+    su enlace "Ver" pertenece al DOM de la sesión expirada.
+    """
+    if fila is not None:
+        for posicion, nueva in enumerate(instantanea_listado(driver)):
+            if nueva["clave"] == fila["clave"]:
+                return (posicion, total), {"fila": nueva}
+    return (index, total), {"fila": fila}
+
+#Proceso para descargar resultados
+@con_sesion(fila_renovada)
+@medido("resultado")
+def descargar_resultado(driver, index, total, fila=None):
+    """
+    Función para descargar un resultado individual con mejor manejo de errores.
+    
+    Args:
+        fila: Fila de instantanea_listado para este resultado (si no se indica, se lee
+            la instantánea de la página)
+    
+    Returns:
+        True si la descarga fue exitosa, False en caso contrario
+    """
+    logger.info(f"✅ Enlace Ver {index+1}/{total}: Iniciando secuencia de descarga")
+    
+    try:
+        if fila is None:
+            filas = instantanea_listado(driver)
+            if index >= len(filas):
+                logger.error(f"❌ Índice {index} fuera de rango. Solo hay {len(filas)} enlaces disponibles")
                 return False
-            ver_links[index].click()
-            logger.info("  ↳ 1/5: Clic en enlace 'Ver' completado (después de refrescar)")
-            time.sleep(6)
+            fila = filas[index]
+        nombre_archivo = fila["clave"]
+        
+        # 1. Clic en "Ver"
+        with METRICAS.medir("ver"):
+            LIMITADOR.adquirir()
+            try:
+                fila["enlace"].click()
+                logger.info("  ↳ 1/5: Clic en enlace 'Ver' completado")
+            except StaleElementReferenceException:
+                # Si el listado se volvió a dibujar, leer una instantánea nueva
+                esperar_portal_inactivo(driver, "ver")
+                filas = instantanea_listado(driver)
+                if index >= len(filas) or filas[index]["clave"] != nombre_archivo:
+                    logger.error("❌ El resultado ya no está en la misma fila después de refrescar")
+                    return False
+                filas[index]["enlace"].click()
+                logger.info("  ↳ 1/5: Clic en enlace 'Ver' completado (después de refrescar)")
+            esperar_portal_inactivo(driver, "ver")
         
         # IMPORTANTE: Cambiar al iframe correcto
         logger.info("  ↳ Cambiando al iframe...")
@@ -260,92 +1667,87 @@ def descargar_resultado(driver, index, total):
         
         # 2. Clic en "Descargar Resultados" (IMPRIMIR)
         try:
-            imprimir_btn = WebDriverWait(driver, 15).until(
-                EC.element_to_be_clickable((By.ID, "IMPRIMIR"))
-            )
-            # Hacer scroll hasta el botón para asegurar que sea visible
-            driver.execute_script("arguments[0].scrollIntoView(true);", imprimir_btn)
-            time.sleep(1)
-            imprimir_btn.click()
+            with METRICAS.medir("imprimir"):
+                clic_cuando_listo(driver, By.ID, "IMPRIMIR", "imprimir")
             logger.info("  ↳ 2/5: Clic en botón 'Descargar Resultados' (IMPRIMIR) completado")
-            time.sleep(3)
-        except Exception as e:
-            cancel_btn = WebDriverWait(driver, 15).until(
-                EC.element_to_be_clickable((By.ID, "CANCEL"))
-            )
-            driver.execute_script("arguments[0].scrollIntoView(true);", cancel_btn)
-            time.sleep(1)
-            cancel_btn.click()
+        except TimeoutException:
+            # Solo es un resultado sin PDF si el detalle terminó de cargar (CANCEL presente)
+            # y no tiene IMPRIMIR; si no, fue una respuesta lenta y el resultado se reintenta
+            esperar_portal_inactivo(driver, "imprimir")
+            if driver.find_elements(By.ID, "IMPRIMIR") or not driver.find_elements(By.ID, "CANCEL"):
+                raise
+            logger.info("  ↳ El detalle no tiene botón IMPRIMIR: el resultado no tiene PDF")
+            with METRICAS.medir("cancel"):
+                clic_cuando_listo(driver, By.ID, "CANCEL", "cancel", esperar_despues=False)
             logger.info("  ↳ 3/3: Clic en segundo botón 'Volver' (CANCEL) completado")
-            time.sleep(3)
             
             # Volver al contenido principal
             try:
-                driver.switch_to.default_content()
+                salir_de_marco(driver)
+                esperar_portal_inactivo(driver, "cancel")
                 logger.info("  ↳ Volviendo al contenido principal")
             except Exception as e:
                 logger.error(f"❌ Error al volver al contenido principal: {str(e)}")
                 # No retornamos False aquí, porque la operación principal ya se completó
             
-            # Registrar la descarga en el log
-            log_descarga(nombre_archivo)
+            # Registrar el resultado sin PDF (la próxima corrida lo vuelve a revisar)
+            log_sin_pdf(nombre_archivo)
             
-            logger.info(f"  ✅ Descarga del resultado {index+1}/{total} completada con éxito")
+            logger.info(f"  ✅ Resultado {index+1}/{total} revisado: no tiene PDF")
             return True
     
         # 3. Clic en "Descargar"
-        descargar_btn = WebDriverWait(driver, 15).until(
-            EC.element_to_be_clickable((By.ID, "DESCARGAR"))
-        )
-        driver.execute_script("arguments[0].scrollIntoView(true);", descargar_btn)
-        time.sleep(1)
-        descargar_btn.click()
+        seguimiento = SeguimientoDescarga(driver)
+        with METRICAS.medir("descargar"):
+            clic_cuando_listo(driver, By.ID, "DESCARGAR", "descargar", esperar_despues=False)
         logger.info("  ↳ 3/5: Clic en botón 'Descargar' completado")
-        time.sleep(5)  # Tiempo extra para asegurar que comience la descarga
         
-        # Manejar posible ventana emergente
+        # Verificar si hay alertas JavaScript y aceptarlas (solo se espera hasta el límite "alerta")
         logger.info("  ↳ Esperando a que se procese la ventana emergente de descarga...")
-        time.sleep(5)
+        with METRICAS.medir("alerta"):
+            try:
+                alert = WebDriverWait(driver, LIMITES_ESPERA["alerta"], poll_frequency=0.2).until(
+                    EC.alert_is_present()
+                )
+                logger.info(f"  ↳ Alerta detectada: '{alert.text}'. Aceptando...")
+                alert.accept()
+            except:
+                logger.info("  ↳ No se detectaron alertas JavaScript")
+            esperar_portal_inactivo(driver, "descargar")
         
-        # Verificar si hay alertas JavaScript y aceptarlas
-        try:
-            alert = driver.switch_to.alert
-            logger.info(f"  ↳ Alerta detectada: '{alert.text}'. Aceptando...")
-            alert.accept()
-            time.sleep(2)
-        except:
-            logger.info("  ↳ No se detectaron alertas JavaScript")
+        # Esperar a que el archivo esté completo en disco
+        with METRICAS.medir("descarga"):
+            archivo = seguimiento.esperar()
+        if archivo is None:
+            logger.error("❌ No empezó ninguna descarga después de DESCARGAR")
+            return False
+        if archivo["ruta"]:
+            logger.info(f"  ↳ Archivo {os.path.basename(archivo['ruta'])} completo: {archivo['bytes']} bytes en {archivo['segundos']:.2f} s")
+            salida = descargas_de(driver).directorio_salida
+            if salida:
+                archivo["ruta"] = guardar_resultado(archivo["ruta"], salida, nombre_archivo, fila.get("fecha"))
         
         # 4. Clic en el primer "Volver" (VOLVER)
-        volver_btn = WebDriverWait(driver, 15).until(
-            EC.element_to_be_clickable((By.ID, "VOLVER"))
-        )
-        driver.execute_script("arguments[0].scrollIntoView(true);", volver_btn)
-        time.sleep(1)
-        volver_btn.click()
+        with METRICAS.medir("volver"):
+            clic_cuando_listo(driver, By.ID, "VOLVER", "volver")
         logger.info("  ↳ 4/5: Clic en primer botón 'Volver' (VOLVER) completado")
-        time.sleep(3)
         
         # 5. Clic en el segundo "Volver" (CANCEL)
-        cancel_btn = WebDriverWait(driver, 15).until(
-            EC.element_to_be_clickable((By.ID, "CANCEL"))
-        )
-        driver.execute_script("arguments[0].scrollIntoView(true);", cancel_btn)
-        time.sleep(1)
-        cancel_btn.click()
+        with METRICAS.medir("cancel"):
+            clic_cuando_listo(driver, By.ID, "CANCEL", "cancel", esperar_despues=False)
         logger.info("  ↳ 5/5: Clic en segundo botón 'Volver' (CANCEL) completado")
-        time.sleep(3)
         
         # Volver al contenido principal
         try:
-            driver.switch_to.default_content()
+            salir_de_marco(driver)
+            esperar_portal_inactivo(driver, "cancel")
             logger.info("  ↳ Volviendo al contenido principal")
         except Exception as e:
             logger.error(f"❌ Error al volver al contenido principal: {str(e)}")
             # No retornamos False aquí, porque la operación principal ya se completó
         
         # Registrar la descarga en el log
-        log_descarga(nombre_archivo)
+        log_descarga(nombre_archivo, archivo["ruta"], archivo["bytes"])
         
         logger.info(f"  ✅ Descarga del resultado {index+1}/{total} completada con éxito")
         return True
@@ -359,31 +1761,68 @@ def descargar_resultado(driver, index, total):
         logger.error(f"❌ Detalle del error: {traceback.format_exc()}")
         return False
 #proceso para pasar a la siguiente página
-def pasar_pagina(driver, timeout=15, max_intentos=5):
+def esperar_cambio_pagina(driver, primer_enlace):
+    """
+    Espera a que el listado se reemplace después de pulsar "Siguiente": el primer enlace
+    "Ver" de la página anterior queda obsoleto y el portal vuelve a estar inactivo.
+    
+    Returns:
+        False si el listado no cambió dentro del límite de espera, True en caso contrario
+    """
+    cambio = True
+    if primer_enlace is not None:
+        try:
+            LATENCIA.esperar(driver, EC.staleness_of(primer_enlace), "pagina_siguiente")
+        except TimeoutException:
+            logger.warning("⚠️ El listado no cambió dentro del límite de espera")
+            cambio = False
+    esperar_portal_inactivo(driver, "pagina_siguiente")
+    return cambio
+
+@con_sesion()
+@medido("pagina_siguiente", falso_es_error=False)
+def pasar_pagina(driver, timeout=None, max_intentos=5):
     """
-    Intenta hacer clic en el botón "Siguiente" para navegar a la siguiente página de resultados.
+    Intenta hacer clic en el botón "Siguiente" para navegar a la siguiente página de
+    resultados. Si la sesión expiró, la renueva y lo intenta de nuevo (con_sesion).
+    
+    Args:
+        timeout: Espera fija del botón (segundos); por defecto se ajusta a la latencia del portal
     
     Returns:
         True si se pudo hacer clic en el botón, False en caso contrario
     """
+    return _pasar_pagina(driver, timeout, max_intentos)
+
+def _pasar_pagina(driver, timeout=None, max_intentos=5):
+    """
+    Clic en "Siguiente" sin renovar la sesión (ver pasar_pagina).
+    """
     logger.info("🔄 Intentando pasar a la siguiente página...")
     
     for intento in range(max_intentos):
         try:
+            # Recordar el primer enlace de la página actual para detectar el cambio de página
+            enlaces_actuales = driver.find_elements(By.XPATH, "//span[starts-with(@id, 'span_CTLVER_')]/a")
+            primer_enlace = enlaces_actuales[0] if enlaces_actuales else None
+            
             # Intentar encontrar el botón de siguiente página por su clase CSS
-            siguiente_btn = WebDriverWait(driver, timeout).until(
-                EC.element_to_be_clickable((By.CSS_SELECTOR, ".PagingButtonsNext"))
+            siguiente_btn = _esperar_elemento(
+                driver, EC.element_to_be_clickable((By.CSS_SELECTOR, ".PagingButtonsNext")),
+                ".PagingButtonsNext", timeout, "pagina_siguiente"
             )
             
             # Hacer scroll al botón para asegurar que sea visible
             driver.execute_script("arguments[0].scrollIntoView(true);", siguiente_btn)
-            time.sleep(1)
             
             # Verificar si el botón está habilitado
             if siguiente_btn.is_enabled():
+                LIMITADOR.adquirir()
                 siguiente_btn.click()
+                if not esperar_cambio_pagina(driver, primer_enlace):
+                    logger.info("⚠️ El listado no cambió después de 'Siguiente' - posiblemente es la última página")
+                    return False
                 logger.info("✅ Navegación a la siguiente página exitosa")
-                time.sleep(5)  # Esperar a que cargue la nueva página
                 return True
             else:
                 logger.info("⚠️ Botón 'Siguiente' está deshabilitado - posiblemente es la última página")
@@ -392,61 +1831,89 @@ def pasar_pagina(driver, timeout=15, max_intentos=5):
         except TimeoutException:
             # Intentar con un selector XPath alternativo si el CSS no funciona
             try:
-                siguiente_btn = WebDriverWait(driver, timeout).until(
-                    EC.element_to_be_clickable((By.XPATH, "//button[contains(@class, 'PagingButtonsNext')]"))
+                siguiente_btn = _esperar_elemento(
+                    driver, EC.element_to_be_clickable((By.XPATH, "//button[contains(@class, 'PagingButtonsNext')]")),
+                    "PagingButtonsNext:xpath", timeout, "pagina_siguiente"
                 )
                 driver.execute_script("arguments[0].scrollIntoView(true);", siguiente_btn)
-                time.sleep(1)
+                LIMITADOR.adquirir()
                 siguiente_btn.click()
+                if not esperar_cambio_pagina(driver, primer_enlace):
+                    logger.info("⚠️ El listado no cambió después de 'Siguiente' - posiblemente es la última página")
+                    return False
                 logger.info("✅ Navegación a la siguiente página exitosa (usando XPath)")
-                time.sleep(5)
                 return True
             except:
                 pass
                 
             logger.warning(f"⚠️ No se encontró el botón 'Siguiente' (intento {intento+1}/{max_intentos})")
+            if sesion_expirada(driver):
+                # No tiene sentido reintentar sin sesión; pasar_pagina la renueva y repite el paso
+                return False
             
         except Exception as e:
             logger.warning(f"⚠️ Error al intentar navegar: {str(e)} (intento {intento+1}/{max_intentos})")
             
-        time.sleep(2)  # Esperar antes de reintentar
+        time.sleep(LATENCIA.pausa("pagina_siguiente", intento))  # Esperar antes de reintentar
         
     logger.error("❌ No se pudo navegar a la siguiente página después de varios intentos")
     return False
 
-#proceso para configurar el sistema
-def configurar_sistema(username="1234", password="1234", fecha_desde=None, fecha_hasta=None, descargar_resultados=True, max_reintentos=3, headless=False):
+class NavegadorPerdido(Exception):
     """
-    Configura el sistema de laboratorio con las fechas especificadas y opcionalmente descarga los resultados.
+    Se lanza cuando la navegación no se pudo recuperar y es necesario reiniciar el navegador.
+    """
+
+def rango_fechas_por_defecto():
+    """
+    Devuelve el primer y el último día del mes actual en formato DD/MM/AAAA.
+    """
+    hoy = datetime.datetime.now()
+    primer_dia = datetime.datetime(hoy.year, hoy.month, 1)
     
-    Args:
-        username: Número de documento/usuario (default: "1234")
-        password: Contraseña (default: "1234")
-        fecha_desde: Fecha inicial en formato DD/MM/AAAA (default: primero del mes actual)
-        fecha_hasta: Fecha final en formato DD/MM/AAAA (default: último día del mes actual)
-        descargar_resultados: Si es True, descarga automáticamente todos los resultados disponibles
-        max_reintentos: Número máximo de reintentos para descargar resultados
-        headless: Si es True, ejecuta Chrome en modo headless (sin interfaz gráfica)
+    # Calcular el último día del mes
+    if hoy.month == 12:
+        ultimo_dia = datetime.datetime(hoy.year + 1, 1, 1) - datetime.timedelta(days=1)
+    else:
+        ultimo_dia = datetime.datetime(hoy.year, hoy.month + 1, 1) - datetime.timedelta(days=1)
+    
+    return primer_dia.strftime("%d/%m/%Y"), ultimo_dia.strftime("%d/%m/%Y")
+
+# Recursos que el modo ligero bloquea por DevTools (Network.setBlockedURLs). La hoja de
+# estilos propia del portal se conserva: GeneXus la usa para mostrar y ocultar controles,
+# y las esperas "clickeable" dependen de esa visibilidad.
+RECURSOS_BLOQUEADOS_LIGERO = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.bmp", "*.webp", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*fonts.googleapis.com*", "*fonts.gstatic.com*", "*font-awesome*", "*fontawesome*",
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*", "*hotjar*",
+]
+
+class ConfiguracionNavegador:
+    """
+    Lo necesario para crear los navegadores de una corrida: las opciones de Chrome, la
+    carpeta de salida de los PDF y los recursos a bloquear por DevTools (modo ligero).
     """
-    # Configurar fechas por defecto si no se proporcionan
-    if not fecha_desde or not fecha_hasta:
-        hoy = datetime.datetime.now()
-        primer_dia = datetime.datetime(hoy.year, hoy.month, 1)
-        
-        # Calcular el último día del mes
-        if hoy.month == 12:
-            ultimo_dia = datetime.datetime(hoy.year + 1, 1, 1) - datetime.timedelta(days=1)
-        else:
-            ultimo_dia = datetime.datetime(hoy.year, hoy.month + 1, 1) - datetime.timedelta(days=1)
-        
-        fecha_desde = fecha_desde or primer_dia.strftime("%d/%m/%Y")
-        fecha_hasta = fecha_hasta or ultimo_dia.strftime("%d/%m/%Y")
     
-    logger.info(f"Configurando con las siguientes fechas:")
-    logger.info(f"Desde: {fecha_desde}")
-    logger.info(f"Hasta: {fecha_hasta}")
+    def __init__(self, opciones, directorio_descargas, recursos_bloqueados=None):
+        self.opciones = opciones
+        self.directorio_descargas = directorio_descargas
+        self.recursos_bloqueados = recursos_bloqueados or []
+
+def crear_opciones_chrome(headless=False, directorio_descargas=None, ligero=False):
+    """
+    Construye la configuración de Chrome usada por todas las sesiones.
+    
+    Args:
+        headless: Si es True, ejecuta Chrome en modo headless
+        directorio_descargas: Carpeta de salida de los PDF (default: DIRECTORIO_SALIDA); cada
+            navegador descarga en su propia carpeta de staging dentro de ella
+        ligero: Si es True, no carga imágenes, fuentes ni analítica, usa la estrategia
+            de carga "eager" y el modo headless nuevo (ver crear_navegador)
     
-    # Configurar opciones de Chrome
+    Returns:
+        ConfiguracionNavegador para crear_navegador
+    """
     chrome_options = Options()
     chrome_options.add_argument("--disable-application-cache")
     chrome_options.add_argument("--disable-extensions")
@@ -457,355 +1924,2862 @@ def configurar_sistema(username="1234", password="1234", fecha_desde=None, fecha
     
     # Agregar opción para modo headless si se solicita
     if headless:
-        chrome_options.add_argument("--headless")
+        chrome_options.add_argument("--headless=new" if ligero else "--headless")
         logger.info("Modo headless activado")
     
+    if ligero:
+        # driver.get vuelve con el DOM listo; el resto lo cubre esperar_portal_inactivo
+        chrome_options.page_load_strategy = "eager"
+        chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+        chrome_options.add_argument("--disable-remote-fonts")
+        chrome_options.add_argument("--disable-background-networking")
+        chrome_options.add_argument("--disable-sync")
+        chrome_options.add_argument("--mute-audio")
+    
     # Mejorar la gestión de descargas
-    chrome_options.add_experimental_option("prefs", {
+    prefs = {
         "download.prompt_for_download": False,
         "download.directory_upgrade": True,
         "safebrowsing.enabled": True
-    })
-    
-    # Variable para control de reintentos
-    intentos_login = 0
-    MAX_INTENTOS_LOGIN = 3
+    }
+    directorio_descargas = os.path.abspath(directorio_descargas or DIRECTORIO_SALIDA)
+    os.makedirs(directorio_descargas, exist_ok=True)
+    prefs["download.default_directory"] = directorio_descargas
+    if ligero:
+        prefs["profile.managed_default_content_settings.images"] = 2
+    chrome_options.add_experimental_option("prefs", prefs)
+    # Eventos Page.download* para SeguimientoDescarga, si Chrome los emite (la carpeta es lo principal)
+    chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    chrome_options.add_experimental_option("perfLoggingPrefs", {"enableNetwork": False, "enablePage": True})
+    # crear_navegador aplica el bloqueo por DevTools a cada navegador nuevo
+    return ConfiguracionNavegador(chrome_options, directorio_descargas,
+                                  RECURSOS_BLOQUEADOS_LIGERO if ligero else None)
+
+def crear_navegador(configuracion):
+    """
+    Inicia un navegador Chrome con la configuración dada (ver crear_opciones_chrome) y
+    maximiza la ventana. En el modo ligero bloquea por DevTools los recursos de
+    RECURSOS_BLOQUEADOS_LIGERO (los PDF no se ven afectados).
     
-    driver = None
+    Dirige las descargas a la carpeta de staging de la sesión con
+    Browser.setDownloadBehavior, para que los navegadores en paralelo no se mezclen, y
+    registra ambas carpetas en descargas_de(driver) para SeguimientoDescarga.
     
+    Returns:
+        La instancia del WebDriver
+    """
+    driver = webdriver.Chrome(options=configuracion.opciones)
+    driver.maximize_window()  # Maximizar la ventana para asegurar que todos los elementos sean visibles
+    descargas = _DESCARGAS[driver] = DescargasNavegador(configuracion.directorio_descargas)
+    comportamiento = {"behavior": "allow", "eventsEnabled": True}
+    if descargas.directorio_salida:
+        comportamiento["downloadPath"] = carpeta_staging(descargas.directorio_salida)
     try:
-        # Iniciar el driver
-        driver = webdriver.Chrome(options=chrome_options)
-        driver.maximize_window()  # Maximizar la ventana para asegurar que todos los elementos sean visibles
-        
-        # Espera más larga para cargas lentas
-        wait = WebDriverWait(driver, 20)  # Espera explícita de hasta 20 segundos
-        
-        # Bucle para reintentar el login si falla
-        while intentos_login < MAX_INTENTOS_LOGIN:
-            try:
-                # Abrir la página
-                logger.info("Abriendo la página de login...")
-                driver.get("")
-                time.sleep(5)  # Espera inicial para que la página cargue completamente
-                
-                # Función para intentar seleccionar una opción con reintento
-                def select_option_with_retry(select_id, option_value, max_attempts=5):
-                    for attempt in range(max_attempts):
-                        try:
-                            logger.info(f"Intentando seleccionar {option_value} en {select_id} (intento {attempt+1})")
-                            select_element = wait.until(EC.presence_of_element_located((By.ID, select_id)))
-                            select = Select(select_element)
-                            select.select_by_value(option_value)
-                            time.sleep(1)  # Pequeña pausa después de seleccionar
-                            return True
-                        except Exception as e:
-                            logger.warning(f"Error al seleccionar opción: {e}")
-                            time.sleep(2)  # Esperar antes de reintentar
-                    return False
-                
-                # Seleccionar "Empresa" en el primer select
-                logger.info("Seleccionando tipo 'Empresa'...")
-                if not select_option_with_retry("vTIPO", "E"):
-                    raise Exception("No se pudo seleccionar la opción 'Empresa'")
-                
-                # Seleccionar "NIT" en el segundo select
-                logger.info("Seleccionando tipo de documento 'NIT'...")
-                if not select_option_with_retry("vTIPODCTO_COD", "NI"):
-                    raise Exception("No se pudo seleccionar la opción 'NIT'")
-                
-                # Escribir el número de documento
-                logger.info(f"Ingresando número de documento: {username}")
-                try:
-                    num_doc_input = wait.until(EC.presence_of_element_located((By.ID, "vNUM_DOC")))
-                    num_doc_input.clear()
-                    num_doc_input.send_keys(username)
-                    time.sleep(1)
-                except Exception as e:
-                    logger.error(f"Error al ingresar número de documento: {e}")
-                    raise
-                
-                # Hacer clic en el botón "Siguiente"
-                logger.info("Haciendo clic en 'Siguiente'...")
-                try:
-                    siguiente_btn = wait.until(EC.element_to_be_clickable((By.ID, "SIGUIENTE")))
-                    siguiente_btn.click()
-                    time.sleep(3)  # Esperar a que cargue la página de contraseña
-                except Exception as e:
-                    logger.error(f"Error al hacer clic en 'Siguiente': {e}")
-                    raise
-                
-                # Ingresar la contraseña
-                logger.info(f"Ingresando contraseña...")
-                try:
-                    password_input = wait.until(EC.presence_of_element_located((By.ID, "vPASSWORD")))
-                    password_input.clear()
-                    password_input.send_keys(password)
-                    time.sleep(1)
-                except Exception as e:
-                    logger.error(f"Error al ingresar contraseña: {e}")
-                    raise
-                
-                # Hacer clic en el botón "Ingresar"
-                logger.info("Haciendo clic en 'Ingresar'...")
-                try:
-                    ingresar_btn = wait.until(EC.element_to_be_clickable((By.ID, "INGRESAR")))
-                    ingresar_btn.click()
-                    time.sleep(5)  # Esperar a que cargue la página principal
-                except Exception as e:
-                    logger.error(f"Error al hacer clic en 'Ingresar': {e}")
-                    raise
-                
-                # Verificar si el login fue exitoso buscando un elemento de la página principal
-                try:
-                    criterio_select = wait.until(EC.presence_of_element_located((By.ID, "vCRITERIO")))
-                    logger.info("✅ Login exitoso")
-                    break  # Si llegamos aquí, salimos del bucle de intentos de login
-                except TimeoutException:
-                    logger.warning(f"⚠️ Login fallido (intento {intentos_login+1}/{MAX_INTENTOS_LOGIN})")
-                    intentos_login += 1
-                    if intentos_login >= MAX_INTENTOS_LOGIN:
-                        raise Exception("No se pudo iniciar sesión después de varios intentos")
-                    continue  # Intentar de nuevo
-                
-            except Exception as e:
-                logger.error(f"Error durante el login (intento {intentos_login+1}): {str(e)}")
-                intentos_login += 1
-                if intentos_login >= MAX_INTENTOS_LOGIN:
-                    raise
-                time.sleep(5)  # Esperar antes de reintentar
-                continue
-        
-        # Seleccionar "RANGO FECHAS"
-        logger.info("Seleccionando criterio 'RANGO FECHAS'...")
-        if not select_option_with_retry("vCRITERIO", "1"):
-            raise Exception("No se pudo seleccionar la opción 'RANGO FECHAS'")
-        
-        # Establecer la fecha "Desde"
-        logger.info(f"Estableciendo fecha Desde: {fecha_desde}")
-        try:
-            driver.execute_script(f"""
-                const desde = document.getElementById('vDESDEFEC');
-                desde.value = '{fecha_desde}';
-                desde.dispatchEvent(new Event('change', {{ bubbles: true }}));
-                desde.dispatchEvent(new Event('blur', {{ bubbles: true }}));
-            """)
-            time.sleep(1)
-        except Exception as e:
-            logger.error(f"Error al establecer fecha Desde: {e}")
-            raise
-        
-        # Establecer la fecha "Hasta"
-        logger.info(f"Estableciendo fecha Hasta: {fecha_hasta}")
+        driver.execute_cdp_cmd("Browser.setDownloadBehavior", comportamiento)
+        descargas.directorio_staging = comportamiento.get("downloadPath")
+    except WebDriverException as e:
+        # Chrome sigue descargando en la carpeta de las preferencias (la salida)
+        descargas.directorio_staging = descargas.directorio_salida
+        logger.warning(f"⚠️ No se pudo fijar la carpeta de staging por DevTools; las descargas se vigilan en la salida: {e}")
+    recursos = configuracion.recursos_bloqueados
+    if recursos:
         try:
-            driver.execute_script(f"""
-                const hasta = document.getElementById('vHASFEC');
-                hasta.value = '{fecha_hasta}';
-                hasta.dispatchEvent(new Event('change', {{ bubbles: true }}));
-                hasta.dispatchEvent(new Event('blur', {{ bubbles: true }}));
-            """)
-            time.sleep(1)
-        except Exception as e:
-            logger.error(f"Error al establecer fecha Hasta: {e}")
-            raise
-        
-        # Hacer clic en el botón "Buscar"
-        logger.info("Haciendo clic en 'Buscar'...")
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": recursos})
+        except WebDriverException as e:
+            logger.warning(f"⚠️ No se pudo activar el bloqueo de recursos del modo ligero: {e}")
+    return driver
+
+def seleccionar_opcion(driver, select_id, option_value, max_attempts=5):
+    """
+    Selecciona una opción de un <select> con reintentos, esperando a que la opción exista.
+    
+    Returns:
+        True si se pudo seleccionar la opción, False en caso contrario
+    """
+    wait = WebDriverWait(driver, LIMITES_ESPERA["login"], poll_frequency=0.2)
+    for attempt in range(max_attempts):
         try:
-            buscar_btn = wait.until(EC.element_to_be_clickable((By.ID, "IMAGE5")))
-            buscar_btn.click()
-            time.sleep(5)  # Esperar a que se carguen los resultados
+            logger.info(f"Intentando seleccionar {option_value} en {select_id} (intento {attempt+1})")
+            # Esperar a que la opción exista (GeneXus carga algunas por AJAX)
+            select_element = wait.until(
+                lambda d: d.find_element(By.CSS_SELECTOR, f"#{select_id} option[value='{option_value}']")
+                and d.find_element(By.ID, select_id)
+            )
+            select = Select(select_element)
+            select.select_by_value(option_value)
+            esperar_portal_inactivo(driver, "login")
+            return True
         except Exception as e:
-            logger.error(f"Error al hacer clic en 'Buscar': {e}")
-            raise
-            
-            # Descargar resultados si se ha solicitado
-        if descargar_resultados:
-                logger.info("\n🔄 Iniciando descarga de resultados...")
-                
-                # Variables para seguimiento global
-                pagina_actual = 1
-                total_resultados_descargados = 0
-                hay_mas_paginas = True
-                
-                # Procesar todas las páginas disponibles
-                while hay_mas_paginas:
-                    try:
-                        logger.info(f"\n📄 Procesando página {pagina_actual}...")
-                        
-                        # Esperar a que los enlaces "Ver" estén disponibles
-                        WebDriverWait(driver, 15).until(
-                            EC.presence_of_element_located((By.XPATH, "//span[starts-with(@id, 'span_CTLVER_')]/a"))
-                        )
-                        
-                        # Buscar todos los enlaces "Ver" en la página actual
-                        ver_links = driver.find_elements(By.XPATH, "//span[starts-with(@id, 'span_CTLVER_')]/a")
-                        total_resultados_pagina = len(ver_links)
-                        logger.info(f"Se encontraron {total_resultados_pagina} resultados en la página {pagina_actual}")
-                        
-                        if total_resultados_pagina == 0:
-                            logger.warning(f"⚠️ No se encontraron resultados en la página {pagina_actual}")
-                            # Intentar pasar a la siguiente página
-                            hay_mas_paginas = pasar_pagina(driver)
-                            if hay_mas_paginas:
-                                pagina_actual += 1
-                                continue
-                            else:
-                                break
-                        
-                        # Iterar sobre cada resultado en la página actual
-                        index = 0
-                        resultados_descargados_pagina = 0
-                        intentos_globales = 0
-                        
-                        while index < total_resultados_pagina and intentos_globales < max_reintentos:
-                            try:
-                                # Intentar descargar el resultado actual
-                                exito = descargar_resultado(driver, index, total_resultados_pagina)
-                                
-                                if exito:
-                                    # Si tuvimos éxito, avanzamos al siguiente resultado
-                                    resultados_descargados_pagina += 1
-                                    total_resultados_descargados += 1
-                                    index += 1
-                                    intentos_globales = 0  # Resetear contador de intentos globales
-                                else:
-                                    # Si falló, incrementar contador de intentos globales
-                                    intentos_globales += 1
-                                    logger.warning(f"⚠️ Reintento global {intentos_globales}/{max_reintentos}")
-                                    
-                                    # Intentar recuperar la navegación
-                                    if not recuperar_navegacion(driver):
-                                        # Si la recuperación falló, intentar reiniciar el navegador
-                                        if intentos_globales >= 2:  # Solo reiniciar después de algunos intentos
-                                            logger.warning("⚠️ Intentando reiniciar el navegador...")
-                                            
-                                            # Cerrar el driver actual
-                                            try:
-                                                driver.quit()
-                                            except:
-                                                pass
-                                            
-                                            # Reiniciar el navegador y todo el proceso
-                                            logger.info("🔄 Reiniciando todo el proceso desde cero...")
-                                            return configurar_sistema(
-                                                username=username, 
-                                                password=password, 
-                                                fecha_desde=fecha_desde, 
-                                                fecha_hasta=fecha_hasta, 
-                                                descargar_resultados=descargar_resultados,
-                                                max_reintentos=max_reintentos
-                                            )
-                                    
-                                    # Si recuperamos la navegación, intentar continuar desde donde estábamos
-                                    try:
-                                        # Verificar si todavía estamos en la página de resultados
-                                        if not driver.find_elements(By.XPATH, "//span[starts-with(@id, 'span_CTLVER_')]/a"):
-                                            # Si no encontramos la lista, volver a buscar
-                                            logger.info("Volviendo a hacer clic en 'Buscar'...")
-                                            buscar_btn = WebDriverWait(driver, 15).until(
-                                                EC.element_to_be_clickable((By.ID, "IMAGE5"))
-                                            )
-                                            buscar_btn.click()
-                                            time.sleep(5)
-                                            
-                                            # Si estábamos en una página diferente a la primera, 
-                                            # necesitamos navegar hasta esa página de nuevo
-                                            for i in range(1, pagina_actual):
-                                                logger.info(f"Navegando de nuevo a la página {i+1}...")
-                                                if not pasar_pagina(driver):
-                                                    logger.error(f"No se pudo volver a la página {pagina_actual}")
-                                                    break
-                                                time.sleep(3)
-                                    except:
-                                        logger.error("Error al intentar volver a la página de resultados")
-                            
-                            except Exception as e:
-                                logger.error(f"Error no manejado: {str(e)}")
-                                intentos_globales += 1
-                                
-                                if intentos_globales >= max_reintentos:
-                                    logger.error(f"Se alcanzó el máximo de reintentos ({max_reintentos})")
-                                    break
-                                
-                                # Intentar recuperación
-                                recuperar_navegacion(driver)
-                        
-                        logger.info(f"✅ Página {pagina_actual} completada. Se descargaron {resultados_descargados_pagina} de {total_resultados_pagina} resultados.")
-                        
-                        # Intentar pasar a la siguiente página
-                        hay_mas_paginas = pasar_pagina(driver)
-                        if hay_mas_paginas:
-                            pagina_actual += 1
-                        else:
-                            logger.info("Se han procesado todas las páginas disponibles.")
-                            break
-                    
-                    except Exception as e:
-                        logger.error(f"⚠️ Error al procesar la página {pagina_actual}: {str(e)}")
-                        logger.error(traceback.format_exc())
-                        
-                        # Intentar recuperar y continuar con la siguiente página
-                        if recuperar_navegacion(driver):
-                            hay_mas_paginas = pasar_pagina(driver)
-                            if hay_mas_paginas:
-                                pagina_actual += 1
-                            else:
-                                break
-                        else:
-                            # Si no podemos recuperar, terminamos
-                            logger.error("No se puede continuar después del error.")
-                            break
-                
-                        logger.info(f"\n✅ Proceso de descarga completado. Se descargaron un total de {total_resultados_descargados} resultados en {pagina_actual} páginas.")
+            logger.warning(f"Error al seleccionar opción: {e}")
+            time.sleep(2)  # Esperar antes de reintentar
+    return False
 
-        logger.info("\n✅ Configuración completada correctamente. El navegador permanecerá abierto.")
-        logger.info("📌 IMPORTANTE: No cierre esta ventana de comando mientras desee mantener el navegador abierto.")
-        logger.info("📌 Para cerrar el navegador, cierre esta ventana o presione Ctrl+C.")
-        
-        # Mantener el script en ejecución indefinidamente
-        while True:
-            time.sleep(10)  # Verificar cada 10 segundos si el navegador sigue abierto
-            try:
-                # Simplemente verificar si el driver sigue activo
-                current_url = driver.current_url
-            except:
-                logger.info("Navegador cerrado. Finalizando script.")
-                break
-        
-    except KeyboardInterrupt:
-        logger.info("\nScript interrumpido por el usuario. Finalizando...")
-    except Exception as e:
-        logger.error(f"\n❌ Error durante la configuración: {e}")
-        logger.error(traceback.format_exc())
-        input("\nPresione Enter para finalizar...")
-    finally:
-        # Cerrar el driver si todavía está abierto
-        if driver:
-            try:
-                driver.quit()
-                logger.info("Navegador cerrado correctamente")
-            except:
-                pass
+# Carpeta de la caché de sesiones (cookies y sessionStorage cifrados por usuario)
+RUTA_CACHE_SESIONES = "sesiones_lab_nancy"
+# Antigüedad máxima (en segundos) de una sesión guardada antes de volver a iniciar sesión
+EDAD_MAXIMA_SESION = 8 * 3600
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Configurar fechas en el sistema de laboratorio')
-    parser.add_argument('--username', type=str, default="-1", help='Número de documento/usuario')
-    parser.add_argument('--password', type=str, default="-1", help='Contraseña')
-    parser.add_argument('--desde', type=str, help='Fecha desde (DD/MM/AAAA)')
-    parser.add_argument('--hasta', type=str, help='Fecha hasta (DD/MM/AAAA)')
-    parser.add_argument('--no-descargar', action='store_true', help='No descargar resultados automáticamente')
-    parser.add_argument('--reintentos', type=int, default=3, help='Número máximo de reintentos para descargar resultados')
-    parser.add_argument('--headless', action='store_true', help='Ejecutar en modo headless (sin interfaz gráfica)')
+# Caché de sesiones del proceso actual (None = desactivada)
+CACHE_SESIONES = RUTA_CACHE_SESIONES
+
+def configurar_cache_sesiones(ruta):
+    """
+    Activa la caché de sesiones en la carpeta indicada, o la desactiva con None.
+    """
+    global CACHE_SESIONES
+    CACHE_SESIONES = ruta
+    if ruta and Fernet is None:
+        logger.warning("⚠️ La caché de sesiones requiere el paquete 'cryptography'; se iniciará sesión siempre")
+
+def ranura_sesion():
+    """
+    Identifica la sesión del proceso e hilo actuales ("MainProcess-MainThread",
+    "MainProcess-trabajador-2", "ForkProcess-3-MainThread"...). Cada trabajador o tramo
+    simultáneo usa su propia sesión del portal, porque GeneXus guarda en ella el estado
+    del listado.
+    """
+    return f"{multiprocessing.current_process().name}-{threading.current_thread().name}"
+
+def _ruta_sesion(username, ranura):
+    nombre = hashlib.sha256(f"{URL_PORTAL}|{username}|{ranura}".encode("utf-8")).hexdigest()[:24]
+    return os.path.join(CACHE_SESIONES, f"{nombre}.sesion")
+
+def _cifrador(password, sal):
+    clave = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), sal, 200_000)
+    return Fernet(base64.urlsafe_b64encode(clave))
+
+def leer_sesion(username, password, ranura):
+    """
+    Lee y descifra la sesión guardada de un usuario.
     
-    args = parser.parse_args()
+    Returns:
+        Diccionario con los datos de la sesión, o None si no hay una sesión vigente
+    """
+    if not CACHE_SESIONES or Fernet is None:
+        return None
+    ruta = _ruta_sesion(username, ranura)
+    try:
+        with open(ruta, "rb") as f:
+            contenido = f.read()
+        datos = json.loads(_cifrador(password, contenido[:16]).decrypt(contenido[16:], ttl=EDAD_MAXIMA_SESION))
+        return datos
+    except FileNotFoundError:
+        return None
+    except (InvalidToken, ValueError, OSError) as e:
+        # Vencida, de otra contraseña o dañada: se descarta
+        logger.info(f"🔑 Sesión guardada descartada ({type(e).__name__})")
+        borrar_sesion(username, ranura)
+        return None
+
+def escribir_sesion(username, password, ranura, datos):
+    """
+    Cifra (con una clave derivada de la contraseña) y guarda la sesión de un usuario.
+    """
+    if not CACHE_SESIONES or Fernet is None:
+        return
+    try:
+        os.makedirs(CACHE_SESIONES, exist_ok=True)
+        ruta = _ruta_sesion(username, ranura)
+        sal = os.urandom(16)
+        temporal = f"{ruta}.tmp"
+        with open(temporal, "wb") as f:
+            f.write(sal + _cifrador(password, sal).encrypt(json.dumps(datos).encode("utf-8")))
+        os.chmod(temporal, 0o600)
+        os.replace(temporal, ruta)
+    except OSError as e:
+        logger.warning(f"⚠️ No se pudo guardar la sesión en caché: {e}")
+
+def borrar_sesion(username, ranura):
+    if not CACHE_SESIONES:
+        return
+    try:
+        os.remove(_ruta_sesion(username, ranura))
+    except OSError:
+        pass
+
+def restaurar_sesion(driver, username, password):
+    """
+    Restaura la sesión guardada (cookies y sessionStorage) y comprueba que sigue viva
+    buscando vCRITERIO en la página principal.
+    
+    Returns:
+        True si el navegador quedó con la sesión iniciada, False si hay que iniciar sesión
+    """
+    ranura = ranura_sesion()
+    datos = leer_sesion(username, password, ranura)
+    if not datos:
+        return False
+    try:
+        # Las cookies solo se pueden fijar estando en el dominio del portal
+        driver.get(URL_PORTAL)
+        driver.delete_all_cookies()
+        for cookie in datos["cookies"]:
+            cookie = {campo: valor for campo, valor in cookie.items() if campo != "expiry" or isinstance(valor, int)}
+            try:
+                driver.add_cookie(cookie)
+            except WebDriverException:
+                pass
+        driver.execute_script(
+            "for (var k in arguments[0]) { window.sessionStorage.setItem(k, arguments[0][k]); }",
+            datos.get("session_storage") or {}
+        )
+        driver.get(datos["url"])
+        WebDriverWait(driver, LIMITES_ESPERA["sesion"], poll_frequency=0.2).until(
+            EC.presence_of_element_located((By.ID, "vCRITERIO"))
+        )
+        esperar_portal_inactivo(driver, "pagina")
+        logger.info("✅ Sesión restaurada desde la caché (sin repetir el login)")
+        return True
+    except (TimeoutException, WebDriverException, KeyError) as e:
+        if isinstance(e, InvalidSessionIdException):
+            raise
+        logger.info("🔑 La sesión guardada ya no es válida, se iniciará sesión de nuevo")
+        borrar_sesion(username, ranura)
+        try:
+            driver.delete_all_cookies()
+        except WebDriverException:
+            pass
+        return False
+
+def guardar_sesion(driver, username, password):
+    """
+    Guarda en la caché la sesión recién iniciada del navegador.
+    """
+    if not CACHE_SESIONES or Fernet is None:
+        return
+    try:
+        escribir_sesion(username, password, ranura_sesion(), {
+            "url": driver.current_url,
+            "cookies": driver.get_cookies(),
+            "session_storage": driver.execute_script(
+                "var d = {}; for (var i = 0; i < sessionStorage.length; i++) {"
+                " var k = sessionStorage.key(i); d[k] = sessionStorage.getItem(k); } return d;"
+            ),
+        })
+    except WebDriverException as e:
+        logger.warning(f"⚠️ No se pudo leer la sesión para la caché: {e}")
+
+@medido("login")
+def iniciar_sesion(driver, username, password, max_intentos=3):
+    """
+    Completa el formulario de login (Empresa / NIT / documento / contraseña). Si hay una
+    sesión vigente en la caché, la restaura en lugar de repetir el formulario.
+    
+    Raises:
+        Exception si no se pudo iniciar sesión después de max_intentos
+    """
+    if restaurar_sesion(driver, username, password):
+        return
+    
+    intentos_login = 0
+    wait = WebDriverWait(driver, LIMITES_ESPERA["login"], poll_frequency=0.2)
+    
+    # Bucle para reintentar el login si falla
+    while intentos_login < max_intentos:
+        try:
+            # Abrir la página
+            logger.info("Abriendo la página de login...")
+            driver.get(URL_PORTAL)
+            esperar_portal_inactivo(driver, "pagina")
+            
+            # Seleccionar "Empresa" en el primer select
+            logger.info("Seleccionando tipo 'Empresa'...")
+            if not seleccionar_opcion(driver, "vTIPO", "E"):
+                raise Exception("No se pudo seleccionar la opción 'Empresa'")
+            
+            # Seleccionar "NIT" en el segundo select
+            logger.info("Seleccionando tipo de documento 'NIT'...")
+            if not seleccionar_opcion(driver, "vTIPODCTO_COD", "NI"):
+                raise Exception("No se pudo seleccionar la opción 'NIT'")
+            
+            # Escribir el número de documento
+            logger.info(f"Ingresando número de documento: {username}")
+            try:
+                num_doc_input = wait.until(EC.presence_of_element_located((By.ID, "vNUM_DOC")))
+                num_doc_input.clear()
+                num_doc_input.send_keys(username)
+            except Exception as e:
+                logger.error(f"Error al ingresar número de documento: {e}")
+                raise
+            
+            # Hacer clic en el botón "Siguiente"
+            logger.info("Haciendo clic en 'Siguiente'...")
+            try:
+                siguiente_btn = wait.until(EC.element_to_be_clickable((By.ID, "SIGUIENTE")))
+                siguiente_btn.click()
+                esperar_portal_inactivo(driver, "login")
+            except Exception as e:
+                logger.error(f"Error al hacer clic en 'Siguiente': {e}")
+                raise
+            
+            # Ingresar la contraseña
+            logger.info(f"Ingresando contraseña...")
+            try:
+                password_input = wait.until(EC.presence_of_element_located((By.ID, "vPASSWORD")))
+                password_input.clear()
+                password_input.send_keys(password)
+            except Exception as e:
+                logger.error(f"Error al ingresar contraseña: {e}")
+                raise
+            
+            # Hacer clic en el botón "Ingresar"
+            logger.info("Haciendo clic en 'Ingresar'...")
+            try:
+                ingresar_btn = wait.until(EC.element_to_be_clickable((By.ID, "INGRESAR")))
+                ingresar_btn.click()
+                esperar_portal_inactivo(driver, "pagina")
+            except Exception as e:
+                logger.error(f"Error al hacer clic en 'Ingresar': {e}")
+                raise
+            
+            # Verificar si el login fue exitoso buscando un elemento de la página principal
+            try:
+                wait.until(EC.presence_of_element_located((By.ID, "vCRITERIO")))
+                logger.info("✅ Login exitoso")
+                guardar_sesion(driver, username, password)
+                return
+            except TimeoutException:
+                logger.warning(f"⚠️ Login fallido (intento {intentos_login+1}/{max_intentos})")
+                intentos_login += 1
+                if intentos_login >= max_intentos:
+                    raise Exception("No se pudo iniciar sesión después de varios intentos")
+                continue  # Intentar de nuevo
+            
+        except Exception as e:
+            logger.error(f"Error durante el login (intento {intentos_login+1}): {str(e)}")
+            intentos_login += 1
+            if intentos_login >= max_intentos:
+                raise
+            time.sleep(5)  # Esperar antes de reintentar
+            continue
+
+@medido("buscar")
+def buscar_resultados(driver, fecha_desde, fecha_hasta):
+    """
+    Selecciona el criterio "RANGO FECHAS", establece las fechas y hace clic en "Buscar".
+    """
+    # Seleccionar "RANGO FECHAS"
+    logger.info("Seleccionando criterio 'RANGO FECHAS'...")
+    if not seleccionar_opcion(driver, "vCRITERIO", "1"):
+        raise Exception("No se pudo seleccionar la opción 'RANGO FECHAS'")
+    
+    # Establecer la fecha "Desde"
+    logger.info(f"Estableciendo fecha Desde: {fecha_desde}")
+    try:
+        driver.execute_script(f"""
+            const desde = document.getElementById('vDESDEFEC');
+            desde.value = '{fecha_desde}';
+            desde.dispatchEvent(new Event('change', {{ bubbles: true }}));
+            desde.dispatchEvent(new Event('blur', {{ bubbles: true }}));
+        """)
+        esperar_portal_inactivo(driver, "login")
+    except Exception as e:
+        logger.error(f"Error al establecer fecha Desde: {e}")
+        raise
+    
+    # Establecer la fecha "Hasta"
+    logger.info(f"Estableciendo fecha Hasta: {fecha_hasta}")
+    try:
+        driver.execute_script(f"""
+            const hasta = document.getElementById('vHASFEC');
+            hasta.value = '{fecha_hasta}';
+            hasta.dispatchEvent(new Event('change', {{ bubbles: true }}));
+            hasta.dispatchEvent(new Event('blur', {{ bubbles: true }}));
+        """)
+        esperar_portal_inactivo(driver, "login")
+    except Exception as e:
+        logger.error(f"Error al establecer fecha Hasta: {e}")
+        raise
+    
+    # Hacer clic en el botón "Buscar"
+    logger.info("Haciendo clic en 'Buscar'...")
+    try:
+        clic_cuando_listo(driver, By.ID, "IMAGE5", "buscar")
+    except Exception as e:
+        logger.error(f"Error al hacer clic en 'Buscar': {e}")
+        raise
+
+# Elementos del paginador cuyo texto es un número de página
+SCRIPT_ENLACES_PAGINA = """
+var encontrados = [];
+document.querySelectorAll('[class*="Paging"], [class*="pagination"]').forEach(function(contenedor) {
+    contenedor.querySelectorAll('a, button, span, li').forEach(function(e) {
+        var texto = (e.textContent || '').trim();
+        if (e.children.length === 0 && /^[0-9]+$/.test(texto)) { encontrados.push([e, parseInt(texto, 10)]); }
+    });
+});
+return encontrados;
+"""
+
+def ir_a_pagina(driver, pagina, pagina_actual=1):
+    """
+    Lleva el listado de pagina_actual a `pagina`. Si el paginador muestra números de
+    página salta directamente al número visible más cercano; solo recorre con
+    "Siguiente" las páginas que no se pueden alcanzar de otra forma.
+    
+    Returns:
+        La página en la que quedó el listado
+    """
+    while pagina_actual < pagina:
+        try:
+            enlaces = driver.execute_script(SCRIPT_ENLACES_PAGINA) or []
+        except WebDriverException:
+            enlaces = []
+        candidatos = [(numero, enlace) for enlace, numero in enlaces if pagina_actual < numero <= pagina]
+        
+        if candidatos:
+            numero, enlace = max(candidatos, key=lambda candidato: candidato[0])
+            enlaces_ver = driver.find_elements(By.XPATH, "//span[starts-with(@id, 'span_CTLVER_')]/a")
+            driver.execute_script("arguments[0].scrollIntoView(true);", enlace)
+            enlace.click()
+            if not esperar_cambio_pagina(driver, enlaces_ver[0] if enlaces_ver else None):
+                break
+            logger.info(f"✅ Salto directo a la página {numero}")
+            pagina_actual = numero
+        else:
+            # Sin con_sesion: la guardia restaura la página del cursor, no la de este recorrido
+            with METRICAS.medir("pagina_siguiente"):
+                avanzo = _pasar_pagina(driver)
+            if not avanzo:
+                break
+            pagina_actual += 1
+    return pagina_actual
+
+def rango_acotado(rango, fecha_primera, fecha_ultima):
+    """
+    Calcula un rango de búsqueda en el que la página que empieza en fecha_primera
+    queda como primera página del listado. El orden del listado se deduce de la
+    primera y la última fila de la página.
+    
+    Returns:
+        Tupla (desde, hasta) en formato DD/MM/AAAA, o None si no se puede calcular
+    """
+    if not rango or fecha_primera is None or fecha_ultima is None:
+        return None
+    fecha_desde, fecha_hasta = rango
+    if fecha_primera <= fecha_ultima:
+        # Listado ascendente: las páginas anteriores tienen fechas menores
+        return fecha_primera.strftime("%d/%m/%Y"), fecha_hasta
+    # Listado descendente: las páginas anteriores tienen fechas mayores
+    return fecha_desde, fecha_primera.strftime("%d/%m/%Y")
+
+def volver_a_pagina(driver, pagina_actual, rango_pagina=None):
+    """
+    Si el listado ya no está visible, restaura la posición sin recorrer todas las páginas:
+    
+    1. Si se conoce rango_pagina, repite la búsqueda acotada a ese rango para que la
+       página quede primera en el listado (las filas repetidas las salta el manifiesto).
+    2. Si no, vuelve a hacer clic en "Buscar" y salta con el paginador a pagina_actual.
+    
+    Returns:
+        True si el listado se acotó (las filas se renumeran desde la primera página),
+        False en caso contrario
+    """
+    try:
+        # Verificar si todavía estamos en la página de resultados
+        if driver.find_elements(By.XPATH, "//span[starts-with(@id, 'span_CTLVER_')]/a"):
+            return False
+        
+        if pagina_actual > 1 and rango_pagina:
+            logger.info(f"Repitiendo la búsqueda acotada a {rango_pagina[0]} - {rango_pagina[1]} para volver a la página {pagina_actual}...")
+            buscar_resultados(driver, *rango_pagina)
+            return True
+        
+        # Si no encontramos la lista, volver a buscar
+        logger.info("Volviendo a hacer clic en 'Buscar'...")
+        clic_cuando_listo(driver, By.ID, "IMAGE5", "buscar")
+        
+        # Si estábamos en una página diferente a la primera, saltar de nuevo a esa página
+        if ir_a_pagina(driver, pagina_actual) < pagina_actual:
+            logger.error(f"No se pudo volver a la página {pagina_actual}")
+    except:
+        logger.error("Error al intentar volver a la página de resultados")
+    return False
+
+class CursorDescarga:
+    """
+    Posición persistente de una corrida de descarga: la búsqueda activa (rango de
+    fechas), la página de esa búsqueda y la fila por la que va. Sobrevive a los
+    reinicios del navegador para reanudar exactamente donde se quedó.
+    """
+    
+    def __init__(self, fecha_desde, fecha_hasta):
+        self.fecha_desde = fecha_desde
+        self.fecha_hasta = fecha_hasta
+        self.busqueda = (fecha_desde, fecha_hasta)  # Puede acotarse durante una recuperación
+        self.pagina = 1
+        self.fila = 0
+        self.descargados = 0
+    
+    def acotar(self, rango):
+        """
+        Registra que la búsqueda activa se acotó: la página actual pasa a ser la primera.
+        """
+        self.busqueda = rango
+        self.pagina = 1
+        self.fila = 0
+    
+    def __str__(self):
+        return f"búsqueda {self.busqueda[0]} - {self.busqueda[1]}, página {self.pagina}, fila {self.fila + 1}"
+
+# Pestañas de detalle que cada navegador avanza a la vez (1 = flujo secuencial de descargar_resultado)
+PESTANAS = 1
+
+# Plantilla de URL de la página de detalle ({clave} = CTLCOD). Si no se indica se
+# descubre con el primer "Ver" de la corrida (ver descubrir_url_detalle)
+PLANTILLA_DETALLE = None
+
+def configurar_pestanas(cantidad, plantilla=None):
+    """
+    Define cuántas pestañas de detalle se procesan a la vez por navegador y,
+    opcionalmente, la plantilla de URL del detalle.
+    """
+    global PESTANAS, PLANTILLA_DETALLE
+    PESTANAS = max(1, int(cantidad or 1))
+    if plantilla:
+        PLANTILLA_DETALLE = plantilla
+
+# Navegadores en los que la URL del detalle no identificó al resultado: procesan en una pestaña
+_SIN_PESTANAS = weakref.WeakSet()
+
+def descubrir_url_detalle(driver, fila):
+    """
+    Abre el detalle de una fila con "Ver" en la pestaña del listado, lee la URL de su
+    iframe y lo cierra con CANCEL. Si la URL contiene la clave del resultado se guarda
+    como PLANTILLA_DETALLE para abrir los demás detalles directamente en otras pestañas.
+    
+    Returns:
+        La plantilla, o None si la URL del detalle no identifica al resultado
+    """
+    global PLANTILLA_DETALLE
+    LIMITADOR.adquirir()
+    fila["enlace"].click()
+    esperar_portal_inactivo(driver, "ver")
+    if not cambiar_a_iframe(driver, 1):
+        return None
+    try:
+        url = driver.execute_script("return window.location.href;")
+        clic_cuando_listo(driver, By.ID, "CANCEL", "cancel", esperar_despues=False)
+    finally:
+        salir_de_marco(driver)
+    esperar_portal_inactivo(driver, "cancel")
+    
+    clave = quote(fila["clave"])
+    if PLANTILLA_DETALLE is None and url and clave in url:
+        PLANTILLA_DETALLE = url.replace(clave, "{clave}")
+        logger.info(f"🔗 URL del detalle: {PLANTILLA_DETALLE}")
+    return PLANTILLA_DETALLE
+
+class PestanaDetalle:
+    """
+    Un resultado abierto en su propia pestaña. Avanza por estados sin bloquear:
+    "cargando" (esperando IMPRIMIR) → "imprimiendo" (esperando DESCARGAR) →
+    "descargando" (esperando el archivo). Cada llamada a avanzar() hace como mucho
+    un clic; el límite de cada estado sale de LATENCIA como en el flujo secuencial.
+    """
+    
+    PASOS = {"cargando": "ver", "imprimiendo": "imprimir", "descargando": "descarga"}
+    
+    def __init__(self, fila, handle):
+        self.fila = fila
+        self.clave = fila["clave"]
+        self.handle = handle
+        self.estado = "cargando"
+        self.desde = time.monotonic()
+        self.seguimiento = None
+        self.archivo = None
+    
+    def _cambiar(self, estado):
+        LATENCIA.registrar(self.PASOS[self.estado], time.monotonic() - self.desde)
+        self.estado = estado
+        self.desde = time.monotonic()
+    
+    def _visible(self, driver, id_):
+        return next((e for e in driver.find_elements(By.ID, id_) if e.is_displayed()), None)
+    
+    def _aceptar_alerta(self, driver):
+        try:
+            alerta = EC.alert_is_present()(driver)
+            if alerta:
+                alerta.accept()
+                return True
+        except WebDriverException:
+            pass
+        return False
+    
+    def avanzar(self, driver, puede_descargar):
+        """
+        Da el siguiente paso de esta pestaña si el portal ya lo permite. El driver debe
+        estar en la pestaña.
+        
+        Args:
+            puede_descargar: False si otra pestaña tiene una descarga en curso; la carpeta
+                de descargas no dice de qué pestaña viene cada archivo, así que se hace una a la vez
+        
+        Returns:
+            True cuando el resultado terminó (self.archivo tiene el archivo, o None si
+            el resultado no tiene PDF), False si sigue en curso
+        
+        Raises:
+            TimeoutException si el estado actual superó su límite de espera
+            DescargaIncompleta si la descarga se cortó
+        """
+        if self.estado == "descargando":
+            self._aceptar_alerta(driver)
+            archivo = self.seguimiento.revisar()
+            if archivo:
+                self.archivo = archivo
+                return True
+            if self.seguimiento.vencida():
+                LATENCIA.registrar("descarga", LATENCIA.espera("descarga"))
+                if self.seguimiento.empezada:
+                    raise DescargaIncompleta(f"La descarga de {self.clave} no avanzó")
+                raise TimeoutException(f"No empezó la descarga de {self.clave}")
+            return False
+        
+        paso = self.PASOS[self.estado]
+        if time.monotonic() - self.desde > LATENCIA.espera(paso):
+            LATENCIA.registrar(paso, LATENCIA.espera(paso))
+            raise TimeoutException(f"Resultado {self.clave}: paso '{paso}' sin terminar")
+        if not portal_inactivo(driver):
+            return False
+        
+        if self.estado == "cargando":
+            imprimir = self._visible(driver, "IMPRIMIR")
+            if imprimir is not None:
+                LIMITADOR.adquirir()
+                imprimir.click()
+                self._cambiar("imprimiendo")
+            elif self._visible(driver, "CANCEL") is not None:
+                # Detalle cargado sin IMPRIMIR: el resultado no tiene PDF
+                return True
+            elif sesion_expirada(driver):
+                raise WebDriverException(f"Resultado {self.clave}: la pestaña muestra el login")
+            return False
+        
+        descargar = self._visible(driver, "DESCARGAR")
+        if descargar is None:
+            return False
+        if not puede_descargar:
+            # Esperar turno no cuenta para el límite del paso
+            self.desde = time.monotonic()
+            return False
+        self.seguimiento = SeguimientoDescarga(driver)
+        LIMITADOR.adquirir()
+        descargar.click()
+        self._cambiar("descargando")
+        # Una alerta abierta bloquea los comandos de WebDriver en todas las pestañas:
+        # atenderla aquí antes de pasar a otra, hasta que aparezca o empiece la descarga
+        limite = time.monotonic() + LIMITES_ESPERA["alerta"]
+        while time.monotonic() < limite and not self._aceptar_alerta(driver):
+            self.archivo = self.seguimiento.revisar()
+            if self.archivo:
+                return True
+            if self.seguimiento.empezada:
+                break
+            time.sleep(0.1)
+        return False
+
+def abrir_pestana(driver, url):
+    """
+    Abre la URL en una pestaña nueva sin esperar a que cargue.
+    
+    Returns:
+        El handle de la pestaña nueva
+    """
+    antes = set(driver.window_handles)
+    driver.execute_script("window.open(arguments[0], '_blank');", url)
+    nuevas = set(driver.window_handles) - antes
+    if nuevas:
+        return nuevas.pop()
+    # Si el navegador bloqueó la ventana emergente, abrirla con WebDriver (espera la carga)
+    driver.switch_to.new_window("tab")
+    driver.get(url)
+    return driver.current_window_handle
+
+def cerrar_pestana(driver, pestana, listado):
+    try:
+        driver.switch_to.window(pestana.handle)
+        driver.close()
+    except WebDriverException:
+        pass
+    driver.switch_to.window(listado)
+
+def _tomar_pendiente(pendientes, coordinador=None):
+    """
+    Saca de la cola la siguiente fila que falta descargar y que este trabajador logra
+    reclamar; omite las demás.
+    
+    Returns:
+        La fila reclamada, o None si no queda ninguna
+    """
+    while pendientes:
+        fila = pendientes.popleft()
+        clave = fila["clave"]
+        if MANIFIESTO is not None and MANIFIESTO.completado(clave):
+            logger.info(f"  ↳ Resultado {clave} ya descargado en una corrida anterior, se omite")
+            continue
+        if coordinador is not None and not coordinador.reclamar(clave):
+            logger.info(f"  ↳ Resultado {clave} asignado a otro trabajador, se omite")
+            continue
+        return fila
+    return None
+
+def descargar_en_pestanas(driver, filas, pagina_actual, coordinador=None, max_reintentos=3):
+    """
+    Descarga las filas de la página abriendo el detalle de cada resultado en su propia
+    pestaña del mismo navegador (hasta PESTANAS a la vez) y avanzándolas por turnos.
+    Lo que se solapa es la carga del detalle y el paso IMPRIMIR de cada pestaña; las
+    descargas van de una en una, porque ni la carpeta de staging ni los eventos de
+    descarga dicen de qué pestaña viene cada archivo. La pestaña del listado no se mueve de su página, así que no
+    hay VOLVER / CANCEL ni recuperación del listado.
+    
+    Args:
+        filas: Filas de instantanea_listado a procesar
+        coordinador: CoordinadorDescargas opcional, como en procesar_pagina
+        max_reintentos: Intentos por resultado antes de dejarlo como fallido
+    
+    Returns:
+        Resultados descargados, o None si en este navegador no se conoce la URL del
+        detalle (el llamador usa el flujo secuencial)
+    """
+    if driver in _SIN_PESTANAS:
+        return None
+    listado = driver.current_window_handle
+    pendientes = deque(filas)
+    reclamadas = deque()  # Filas ya reclamadas que esperan su pestaña
+    if PLANTILLA_DETALLE is None:
+        # Descubrir la URL con una fila que de verdad hay que descargar
+        fila = _tomar_pendiente(pendientes, coordinador)
+        if fila is None:
+            return 0
+        if not descubrir_url_detalle(driver, fila):
+            logger.warning("⚠️ La URL del detalle no identifica al resultado; este navegador descarga en una sola pestaña")
+            _SIN_PESTANAS.add(driver)
+            if coordinador is not None:
+                coordinador.liberar(fila["clave"])
+            return None
+        reclamadas.append(fila)
+    
+    abiertas = []
+    intentos = {}
+    descargados = 0
+    try:
+        while reclamadas or pendientes or abiertas:
+            # Completar las pestañas abiertas
+            while (reclamadas or pendientes) and len(abiertas) < PESTANAS:
+                fila = reclamadas.popleft() if reclamadas else _tomar_pendiente(pendientes, coordinador)
+                if fila is None:
+                    break
+                clave = fila["clave"]
+                if MANIFIESTO is not None:
+                    MANIFIESTO.iniciar(clave, pagina_actual, fila)
+                LIMITADOR.adquirir()
+                driver.switch_to.window(listado)
+                url = urljoin(driver.current_url, PLANTILLA_DETALLE.format(clave=quote(clave)))
+                abiertas.append(PestanaDetalle(fila, abrir_pestana(driver, url)))
+                logger.info(f"  ↳ Resultado {clave} abierto en una pestaña ({len(abiertas)}/{PESTANAS})")
+            
+            # Una vuelta por las pestañas abiertas
+            descargando = next((p for p in abiertas if p.estado == "descargando"), None)
+            for pestana in list(abiertas):
+                error = None
+                try:
+                    driver.switch_to.window(pestana.handle)
+                    terminado = pestana.avanzar(driver, descargando in (None, pestana))
+                except InvalidSessionIdException:
+                    raise
+                except Exception as e:
+                    terminado, error = True, e
+                    if sesion_expirada(driver) and _GUARDIAS.get(driver) is not None:
+                        # Sin sesión ninguna pestaña sirve: cerrarlas, renovar la sesión
+                        # y volver a abrir sus resultados sin contarlo como intento
+                        logger.warning(f"⚠️ Sesión expirada con {len(abiertas)} pestañas abiertas")
+                        for otra in abiertas:
+                            cerrar_pestana(driver, otra, listado)
+                            if coordinador is not None:
+                                coordinador.liberar(otra.clave)
+                        pendientes.extendleft(reversed([otra.fila for otra in abiertas]))
+                        abiertas.clear()
+                        recuperar_sesion(driver, comprobar=False)
+                        break
+                if pestana.estado == "descargando":
+                    descargando = pestana
+                if not terminado:
+                    continue
+                
+                abiertas.remove(pestana)
+                if descargando is pestana:
+                    descargando = None
+                cerrar_pestana(driver, pestana, listado)
+                LIMITADOR.registrar(error is None, f"resultado {pestana.clave}")
+                if error is None:
+                    archivo = pestana.archivo
+                    salida = descargas_de(driver).directorio_salida
+                    if archivo and archivo["ruta"] and salida:
+                        archivo["ruta"] = guardar_resultado(archivo["ruta"], salida,
+                                                            pestana.clave, pestana.fila.get("fecha"))
+                    if archivo:
+                        log_descarga(pestana.clave, archivo["ruta"], archivo["bytes"])
+                    else:
+                        log_sin_pdf(pestana.clave)
+                    descargados += 1
+                    if coordinador is not None:
+                        coordinador.registrar_descarga()
+                    logger.info(f"  ✅ Resultado {pestana.clave} completado ({descargados} en esta página)")
+                    continue
+                
+                logger.error(f"❌ Error en el resultado {pestana.clave}: {error}")
+                if coordinador is not None:
+                    coordinador.liberar(pestana.clave)
+                if MANIFIESTO is not None:
+                    MANIFIESTO.fallar(pestana.clave, error)
+                intentos[pestana.clave] = intentos.get(pestana.clave, 0) + 1
+                if intentos[pestana.clave] < max_reintentos:
+                    pendientes.append(pestana.fila)
+            time.sleep(0.1)
+    finally:
+        for pestana in abiertas:
+            if MANIFIESTO is not None:
+                MANIFIESTO.fallar(pestana.clave, "pestaña cerrada sin terminar")
+            if coordinador is not None:
+                coordinador.liberar(pestana.clave)
+            cerrar_pestana(driver, pestana, listado)
+    return descargados
+
+def procesar_pagina(driver, pagina_actual, max_reintentos=3, coordinador=None, cursor=None):
+    """
+    Descarga todos los resultados de la página actual del listado.
+    
+    Args:
+        driver: Instancia del WebDriver
+        pagina_actual: Número de la página que se está procesando (para recuperar la posición)
+        max_reintentos: Número máximo de reintentos consecutivos por resultado
+        coordinador: CoordinadorDescargas opcional; si se indica, solo se descargan los
+            resultados que este trabajador logre reclamar
+        cursor: CursorDescarga opcional. Si se indica, el procesamiento empieza en
+            cursor.fila, el cursor avanza con cada fila y la recuperación puede acotar
+            la búsqueda para volver a esta página en un solo paso
+    
+    Returns:
+        Tupla (resultados descargados, resultados en la página)
+    
+    Raises:
+        NavegadorPerdido si la navegación no se pudo recuperar y hay que reiniciar el navegador
+    """
+    logger.info(f"\n📄 Procesando página {pagina_actual}...")
+    
+    # Esperar a que los enlaces "Ver" estén disponibles
+    WebDriverWait(driver, LIMITES_ESPERA["buscar"], poll_frequency=0.2).until(
+        EC.presence_of_element_located((By.XPATH, "//span[starts-with(@id, 'span_CTLVER_')]/a"))
+    )
+    
+    # Leer todas las filas de la página en un solo viaje (clave, fecha y enlace "Ver")
+    filas = instantanea_listado(driver)
+    total_resultados_pagina = len(filas)
+    logger.info(f"Se encontraron {total_resultados_pagina} resultados en la página {pagina_actual}")
+    
+    # Rango que deja esta página como la primera del listado (para recuperar en O(1))
+    rango_pagina = None
+    if cursor is not None and total_resultados_pagina:
+        rango_pagina = rango_acotado(cursor.busqueda, filas[0]["fecha"], filas[-1]["fecha"])
+    
+    # Iterar sobre cada resultado en la página actual (desde la fila del cursor al reanudar)
+    index = cursor.fila if cursor is not None else 0
+    resultados_descargados_pagina = 0
+    intentos_globales = 0
+    
+    # Con varias pestañas el listado se queda en esta página y los detalles avanzan a la vez
+    if PESTANAS > 1 and index < total_resultados_pagina:
+        descargados = descargar_en_pestanas(driver, filas[index:], pagina_actual, coordinador, max_reintentos)
+        if descargados is not None:
+            if cursor is not None:
+                cursor.fila = total_resultados_pagina
+                cursor.descargados += descargados
+            logger.info(f"✅ Página {pagina_actual} completada. Se descargaron {descargados} de {total_resultados_pagina} resultados.")
+            return descargados, total_resultados_pagina
+        # Si se intentó descubrir la URL se abrió y cerró un detalle: los enlaces anteriores ya no sirven
+        filas = instantanea_listado(driver)
+    
+    while index < total_resultados_pagina and intentos_globales < max_reintentos:
+        clave = None
+        if cursor is not None:
+            cursor.fila = index
+        try:
+            clave = filas[index]["clave"]
+            
+            # Saltar los resultados que el manifiesto ya registra como descargados
+            if MANIFIESTO is not None and MANIFIESTO.completado(clave):
+                logger.info(f"  ↳ Resultado {clave} ya descargado en una corrida anterior, se omite")
+                index += 1
+                continue
+            
+            # En modo paralelo, saltar los resultados que ya reclamó otro trabajador
+            if coordinador is not None and not coordinador.reclamar(clave):
+                logger.info(f"  ↳ Resultado {clave} asignado a otro trabajador, se omite")
+                index += 1
+                continue
+            
+            # Intentar descargar el resultado actual
+            if MANIFIESTO is not None:
+                MANIFIESTO.iniciar(clave, pagina_actual, filas[index])
+            exito = descargar_resultado(driver, index, total_resultados_pagina, filas[index])
+            LIMITADOR.registrar(exito, f"resultado {clave}")
+            
+            if exito:
+                # Si tuvimos éxito, avanzamos al siguiente resultado
+                resultados_descargados_pagina += 1
+                index += 1
+                intentos_globales = 0  # Resetear contador de intentos globales
+                if coordinador is not None:
+                    coordinador.registrar_descarga()
+                if cursor is not None:
+                    cursor.descargados += 1
+            else:
+                if coordinador is not None:
+                    coordinador.liberar(clave)
+                if MANIFIESTO is not None:
+                    MANIFIESTO.fallar(clave, "descarga fallida")
+                
+                # Si falló, incrementar contador de intentos globales
+                intentos_globales += 1
+                logger.warning(f"⚠️ Reintento global {intentos_globales}/{max_reintentos}")
+                
+                # Intentar recuperar la navegación
+                if not recuperar_navegacion(driver):
+                    # Si la recuperación falló, hay que reiniciar el navegador
+                    if intentos_globales >= 2:  # Solo reiniciar después de algunos intentos
+                        raise NavegadorPerdido(f"No se pudo recuperar la navegación en la página {pagina_actual}")
+                
+                # Si recuperamos la navegación, intentar continuar desde donde estábamos
+                acotado = volver_a_pagina(driver, pagina_actual, rango_pagina)
+                # El listado pudo volver a dibujarse: los enlaces anteriores ya no sirven
+                filas = instantanea_listado(driver)
+                if acotado:
+                    # El listado se acotó: recorrer de nuevo sus filas (el manifiesto salta las completadas)
+                    index = 0
+                    total_resultados_pagina = len(filas)
+                    cursor.acotar(rango_pagina)
+                    pagina_actual = 1
+        
+        except NavegadorPerdido:
+            raise
+        except Exception as e:
+            logger.error(f"Error no manejado: {str(e)}")
+            if coordinador is not None and clave is not None:
+                coordinador.liberar(clave)
+            if MANIFIESTO is not None and clave is not None:
+                MANIFIESTO.fallar(clave, e)
+            intentos_globales += 1
+            
+            if intentos_globales >= max_reintentos:
+                logger.error(f"Se alcanzó el máximo de reintentos ({max_reintentos})")
+                break
+            
+            # Intentar recuperación
+            recuperar_navegacion(driver)
+            try:
+                filas = instantanea_listado(driver)
+            except WebDriverException:
+                pass
+    
+    if cursor is not None:
+        cursor.fila = index
+    logger.info(f"✅ Página {pagina_actual} completada. Se descargaron {resultados_descargados_pagina} de {total_resultados_pagina} resultados.")
+    return resultados_descargados_pagina, total_resultados_pagina
+
+def descargar_todas_las_paginas(driver, max_reintentos=3, cursor=None):
+    """
+    Recorre todas las páginas del listado descargando sus resultados, desde la
+    posición del cursor.
+    
+    Args:
+        cursor: CursorDescarga con la posición actual; se actualiza a medida que se
+            avanza (si no se indica, se empieza en la primera fila de la primera página)
+    
+    Returns:
+        Total de resultados descargados en esta llamada
+    
+    Raises:
+        NavegadorPerdido si es necesario reiniciar el navegador
+    """
+    logger.info("\n🔄 Iniciando descarga de resultados...")
+    
+    if cursor is None:
+        cursor = CursorDescarga(None, None)
+    total_resultados_descargados = 0
+    hay_mas_paginas = True
+    
+    # Procesar todas las páginas disponibles
+    while hay_mas_paginas:
+        try:
+            descargados, total_resultados_pagina = procesar_pagina(driver, cursor.pagina, max_reintentos, cursor=cursor)
+            total_resultados_descargados += descargados
+            
+            if total_resultados_pagina == 0:
+                logger.warning(f"⚠️ No se encontraron resultados en la página {cursor.pagina}")
+            
+            # Intentar pasar a la siguiente página
+            hay_mas_paginas = pasar_pagina(driver)
+            if hay_mas_paginas:
+                cursor.pagina += 1
+                cursor.fila = 0
+            else:
+                logger.info("Se han procesado todas las páginas disponibles.")
+                break
+        
+        except NavegadorPerdido:
+            raise
+        except Exception as e:
+            logger.error(f"⚠️ Error al procesar la página {cursor.pagina}: {str(e)}")
+            logger.error(traceback.format_exc())
+            
+            # Si la sesión expiró, el listado vuelve a la página y fila del cursor: repetirla
+            if recuperar_sesion(driver):
+                continue
+            
+            # Intentar recuperar y continuar con la siguiente página
+            if recuperar_navegacion(driver):
+                hay_mas_paginas = pasar_pagina(driver)
+                if hay_mas_paginas:
+                    cursor.pagina += 1
+                    cursor.fila = 0
+                else:
+                    break
+            else:
+                # Si no podemos recuperar, el supervisor reinicia el navegador en esta posición
+                raise NavegadorPerdido(f"No se pudo recuperar la navegación en la página {cursor.pagina}")
+    
+    logger.info(f"\n✅ Proceso de descarga completado. Se descargaron un total de {total_resultados_descargados} resultados en {cursor.pagina} páginas.")
+    return total_resultados_descargados
+
+def reanudar_en_cursor(driver, cursor):
+    """
+    Después de iniciar sesión, repite la búsqueda activa del cursor y lleva el listado
+    a su página. La fila la retoma procesar_pagina.
+    """
+    buscar_resultados(driver, *cursor.busqueda)
+    if cursor.pagina > 1:
+        pagina = ir_a_pagina(driver, cursor.pagina)
+        if pagina < cursor.pagina:
+            raise NavegadorPerdido(f"No se pudo volver a la página {cursor.pagina}")
+        logger.info(f"↪️ Reanudando en {cursor}")
+
+def supervisar_descarga(configuracion, username, password, cursor, max_reintentos=3, max_reinicios=5, driver=None):
+    """
+    Supervisor de una corrida de descarga: si el navegador se pierde, lo reinicia
+    (con la misma configuración, p. ej. headless), vuelve a iniciar sesión y reanuda en
+    la posición del cursor, sin repetir lo ya descargado.
+    
+    Args:
+        driver: Navegador con la sesión ya iniciada para el primer intento (opcional)
+    
+    Returns:
+        El driver activo al terminar (el llamador decide si lo cierra)
+    
+    Raises:
+        NavegadorPerdido si se superó max_reinicios
+    """
+    reinicios = 0
+    while True:
+        try:
+            try:
+                if driver is None:
+                    driver = reiniciar_navegador(configuracion) if reinicios else crear_navegador(configuracion)
+                    if driver is None:
+                        raise NavegadorPerdido("No se pudo iniciar el navegador")
+                    iniciar_sesion(driver, username, password)
+                proteger_sesion(driver, username, password, cursor)
+                reanudar_en_cursor(driver, cursor)
+            except (NavegadorPerdido, WebDriverException):
+                raise
+            except Exception as e:
+                # Login o búsqueda fallidos (p. ej. página de error del portal): se reinicia como los demás
+                raise NavegadorPerdido(f"No se pudo iniciar sesión o repetir la búsqueda: {e}") from e
+            descargar_todas_las_paginas(driver, max_reintentos, cursor)
+            return driver
+        except (NavegadorPerdido, WebDriverException) as e:
+            reinicios += 1
+            logger.warning(f"⚠️ {e}")
+            if driver:
+                try:
+                    driver.quit()
+                except:
+                    pass
+            driver = None
+            if reinicios > max_reinicios:
+                raise NavegadorPerdido(f"Se superó el máximo de reinicios del navegador ({max_reinicios})")
+            logger.info(f"🔄 Reinicio {reinicios}/{max_reinicios} del navegador; se reanudará en {cursor}")
+
+#proceso para configurar el sistema
+def configurar_sistema(username="1234", password="1234", fecha_desde=None, fecha_hasta=None, descargar_resultados=True, max_reintentos=3, headless=False, limites_espera=None, directorio_descargas=None, ruta_manifiesto=RUTA_MANIFIESTO, ligero=False, mantener_abierto=True, al_terminar=None):
+    """
+    Configura el sistema de laboratorio con las fechas especificadas y opcionalmente descarga los resultados.
+    
+    Args:
+        username: Número de documento/usuario (default: "1234")
+        password: Contraseña (default: "1234")
+        fecha_desde: Fecha inicial en formato DD/MM/AAAA (default: primero del mes actual)
+        fecha_hasta: Fecha final en formato DD/MM/AAAA (default: último día del mes actual)
+        descargar_resultados: Si es True, descarga automáticamente todos los resultados disponibles
+        max_reintentos: Número máximo de reintentos para descargar resultados
+        headless: Si es True, ejecuta Chrome en modo headless (sin interfaz gráfica)
+        limites_espera: Techos de espera por paso ("paso=segundos" o dict), ver LIMITES_ESPERA
+        directorio_descargas: Carpeta donde se guardan los PDF (default: la de Chrome)
+        ruta_manifiesto: Archivo SQLite donde se registran las descargas (permite reanudar)
+        ligero: Si es True, usa el perfil ligero de Chrome (ver crear_opciones_chrome)
+        mantener_abierto: Si es False, cierra el navegador al terminar en lugar de esperar
+            a que el usuario lo cierre, y los errores se propagan sin pedir Enter
+            (ejecuciones headless, benchmark)
+        al_terminar: Función opcional que se llama al terminar la descarga, antes de
+            dejar el navegador abierto (exportación, extracción)
+    
+    Returns:
+        Número de resultados descargados
+    """
+    configurar_limites_espera(limites_espera)
+    
+    # Configurar fechas por defecto si no se proporcionan
+    if not fecha_desde or not fecha_hasta:
+        primer_dia, ultimo_dia = rango_fechas_por_defecto()
+        fecha_desde = fecha_desde or primer_dia
+        fecha_hasta = fecha_hasta or ultimo_dia
+    
+    abrir_manifiesto(ruta_manifiesto, fecha_desde, fecha_hasta)
+    
+    logger.info(f"Configurando con las siguientes fechas:")
+    logger.info(f"Desde: {fecha_desde}")
+    logger.info(f"Hasta: {fecha_hasta}")
+    
+    # Configurar Chrome (opciones, carpeta de descargas y bloqueo del modo ligero)
+    configuracion = crear_opciones_chrome(headless, directorio_descargas, ligero)
+    
+    driver = None
+    cursor = CursorDescarga(fecha_desde, fecha_hasta)
+    
+    try:
+        # Descargar resultados si se ha solicitado
+        if descargar_resultados:
+            # El supervisor inicia el navegador y lo reinicia si se pierde, reanudando en el cursor
+            driver = supervisar_descarga(configuracion, username, password, cursor, max_reintentos)
+            # Exportar ya las métricas: el script puede seguir abierto con el navegador
+            METRICAS.exportar()
+            if al_terminar:
+                al_terminar()
+        else:
+            # Iniciar el driver
+            driver = crear_navegador(configuracion)
+            
+            iniciar_sesion(driver, username, password)
+            buscar_resultados(driver, fecha_desde, fecha_hasta)
+        
+        if not mantener_abierto:
+            logger.info("\n✅ Configuración completada correctamente.")
+            return cursor.descargados
+        
+        logger.info("\n✅ Configuración completada correctamente. El navegador permanecerá abierto.")
+        logger.info("📌 IMPORTANTE: No cierre esta ventana de comando mientras desee mantener el navegador abierto.")
+        logger.info("📌 Para cerrar el navegador, cierre esta ventana o presione Ctrl+C.")
+        
+        # Mantener el script en ejecución indefinidamente
+        while True:
+            time.sleep(10)  # Verificar cada 10 segundos si el navegador sigue abierto
+            try:
+                # Simplemente verificar si el driver sigue activo
+                current_url = driver.current_url
+            except:
+                logger.info("Navegador cerrado. Finalizando script.")
+                break
+        
+    except KeyboardInterrupt:
+        logger.info("\nScript interrumpido por el usuario. Finalizando...")
+    except Exception as e:
+        logger.error(f"\n❌ Error durante la configuración: {e}")
+        logger.error(traceback.format_exc())
+        if not mantener_abierto:
+            raise
+        input("\nPresione Enter para finalizar...")
+    finally:
+        # Cerrar el driver si todavía está abierto
+        if driver:
+            try:
+                driver.quit()
+                logger.info("Navegador cerrado correctamente")
+            except:
+                pass
+    return cursor.descargados
+
+class CoordinadorDescargas:
+    """
+    Estado compartido entre los trabajadores del modo paralelo: reparte las páginas del
+    listado (cada página se entrega a un solo trabajador) y registra los resultados
+    reclamados para que ninguno se descargue dos veces.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._siguiente_pagina = 1
+        self._ultima_pagina = None
+        self._reclamados = set()
+        self.total_descargados = 0
+    
+    def tomar_pagina(self):
+        """
+        Entrega la siguiente página sin asignar, o None si ya no quedan páginas.
+        """
+        with self._lock:
+            if self._ultima_pagina is not None and self._siguiente_pagina > self._ultima_pagina:
+                return None
+            pagina = self._siguiente_pagina
+            self._siguiente_pagina += 1
+            return pagina
+    
+    def marcar_ultima_pagina(self, pagina):
+        """
+        Registra que el listado termina en `pagina`; las páginas posteriores no se entregan.
+        """
+        with self._lock:
+            if self._ultima_pagina is None or pagina < self._ultima_pagina:
+                self._ultima_pagina = pagina
+    
+    def reclamar(self, clave):
+        """
+        Reserva un resultado para el trabajador actual.
+        
+        Returns:
+            True si el resultado no había sido reclamado por otro trabajador
+        """
+        if not ManifiestoDescargas.clave_valida(clave):
+            return True
+        with self._lock:
+            if clave in self._reclamados:
+                return False
+            self._reclamados.add(clave)
+            return True
+    
+    def liberar(self, clave):
+        """
+        Libera un resultado cuya descarga falló para que pueda reintentarse.
+        """
+        with self._lock:
+            self._reclamados.discard(clave)
+    
+    def registrar_descarga(self):
+        with self._lock:
+            self.total_descargados += 1
+
+def ejecutar_trabajador(numero, coordinador, username, password, fecha_desde, fecha_hasta, max_reintentos=3, headless=False, directorio_descargas=None, ligero=False):
+    """
+    Bucle de un trabajador del modo paralelo: inicia su propia sesión de Chrome, toma
+    páginas del coordinador y descarga solo los resultados de esas páginas.
+    """
+    configuracion = crear_opciones_chrome(headless, directorio_descargas, ligero)
+    driver = None
+    pagina_en_navegador = 0  # Página que muestra actualmente el navegador (0 = sin búsqueda)
+    pagina = coordinador.tomar_pagina()
+    fallos_pagina = 0
+    # Página que la guardia de sesión restaura si la sesión expira
+    cursor_sesion = CursorDescarga(fecha_desde, fecha_hasta)
+    
+    try:
+        while pagina is not None:
+            try:
+                if driver is None:
+                    driver = crear_navegador(configuracion)
+                    iniciar_sesion(driver, username, password)
+                    proteger_sesion(driver, username, password, cursor_sesion)
+                    buscar_resultados(driver, fecha_desde, fecha_hasta)
+                    pagina_en_navegador = 1
+                
+                # Avanzar hasta la página asignada (las páginas de cada trabajador son crecientes)
+                cursor_sesion.pagina = pagina_en_navegador
+                pagina_en_navegador = ir_a_pagina(driver, pagina, pagina_en_navegador)
+                if pagina_en_navegador < pagina and recuperar_sesion(driver):
+                    # La sesión expiró en el camino: el listado volvió a la página de partida
+                    pagina_en_navegador = ir_a_pagina(driver, pagina, cursor_sesion.pagina)
+                cursor_sesion.pagina = pagina_en_navegador
+                
+                if pagina_en_navegador < pagina:
+                    logger.info(f"La página {pagina} no existe; el listado termina en la página {pagina_en_navegador}")
+                    coordinador.marcar_ultima_pagina(pagina_en_navegador)
+                else:
+                    procesar_pagina(driver, pagina, max_reintentos, coordinador)
+                pagina = coordinador.tomar_pagina()
+                fallos_pagina = 0
+            
+            except Exception as e:
+                # Reiniciar solo este navegador y reintentar la misma página
+                fallos_pagina += 1
+                logger.warning(f"⚠️ Trabajador {numero}: error en la página {pagina} ({e}). Reiniciando su navegador...")
+                if driver:
+                    try:
+                        driver.quit()
+                    except:
+                        pass
+                driver = None
+                if fallos_pagina >= max_reintentos:
+                    logger.error(f"❌ Trabajador {numero}: se abandona la página {pagina} después de {fallos_pagina} intentos")
+                    pagina = coordinador.tomar_pagina()
+                    fallos_pagina = 0
+    except Exception as e:
+        logger.error(f"❌ Trabajador {numero} detenido por un error: {e}")
+        logger.error(traceback.format_exc())
+    finally:
+        if driver:
+            try:
+                driver.quit()
+            except:
+                pass
+    logger.info(f"Trabajador {numero} finalizado")
+
+def descargar_en_paralelo(username="1234", password="1234", fecha_desde=None, fecha_hasta=None, trabajadores=2, max_reintentos=3, headless=False, limites_espera=None, directorio_descargas=None, ruta_manifiesto=RUTA_MANIFIESTO, ligero=False):
+    """
+    Descarga los resultados con varias sesiones de Chrome independientes en paralelo.
+    
+    Cada trabajador inicia sesión por su cuenta y recibe páginas distintas del listado;
+    el CoordinadorDescargas garantiza que ningún resultado se descargue dos veces.
+    
+    Returns:
+        Total de resultados descargados entre todos los trabajadores
+    """
+    configurar_limites_espera(limites_espera)
+    
+    if not fecha_desde or not fecha_hasta:
+        primer_dia, ultimo_dia = rango_fechas_por_defecto()
+        fecha_desde = fecha_desde or primer_dia
+        fecha_hasta = fecha_hasta or ultimo_dia
+    
+    logger.info(f"🔄 Descarga paralela con {trabajadores} trabajadores ({fecha_desde} - {fecha_hasta})")
+    abrir_manifiesto(ruta_manifiesto, fecha_desde, fecha_hasta)
+    
+    coordinador = CoordinadorDescargas()
+    hilos = []
+    for numero in range(1, trabajadores + 1):
+        hilo = threading.Thread(
+            target=ejecutar_trabajador,
+            name=f"trabajador-{numero}",
+            args=(numero, coordinador, username, password, fecha_desde, fecha_hasta, max_reintentos, headless, directorio_descargas, ligero),
+            daemon=True
+        )
+        hilo.start()
+        hilos.append(hilo)
+    
+    try:
+        for hilo in hilos:
+            hilo.join()
+    except KeyboardInterrupt:
+        logger.info("\nScript interrumpido por el usuario. Finalizando...")
+    
+    logger.info(f"\n✅ Descarga paralela completada. Se descargaron un total de {coordinador.total_descargados} resultados.")
+    return coordinador.total_descargados
+
+FORMATO_FECHA = "%d/%m/%Y"
+
+def dividir_rango(fecha_desde, fecha_hasta, particion="semana"):
+    """
+    Divide un rango de fechas DD/MM/AAAA en tramos consecutivos sin solaparse.
+    
+    Args:
+        fecha_desde: Fecha inicial (DD/MM/AAAA)
+        fecha_hasta: Fecha final (DD/MM/AAAA), incluida
+        particion: "dia", "semana" o "adaptativo" (empieza por semanas y se subdivide
+            según la cantidad de resultados de cada tramo)
+    
+    Returns:
+        Lista de tuplas (desde, hasta) en formato DD/MM/AAAA
+    """
+    inicio = datetime.datetime.strptime(fecha_desde, FORMATO_FECHA)
+    fin = datetime.datetime.strptime(fecha_hasta, FORMATO_FECHA)
+    if fin < inicio:
+        raise ValueError(f"Rango de fechas inválido: {fecha_desde} - {fecha_hasta}")
+    
+    dias_por_tramo = 1 if particion == "dia" else 7
+    tramos = []
+    actual = inicio
+    while actual <= fin:
+        final_tramo = min(actual + datetime.timedelta(days=dias_por_tramo - 1), fin)
+        tramos.append((actual.strftime(FORMATO_FECHA), final_tramo.strftime(FORMATO_FECHA)))
+        actual = final_tramo + datetime.timedelta(days=1)
+    return tramos
+
+def partir_tramo(fecha_desde, fecha_hasta):
+    """
+    Parte un tramo en dos mitades. Devuelve None si el tramo es de un solo día.
+    """
+    inicio = datetime.datetime.strptime(fecha_desde, FORMATO_FECHA)
+    fin = datetime.datetime.strptime(fecha_hasta, FORMATO_FECHA)
+    if fin <= inicio:
+        return None
+    mitad = inicio + datetime.timedelta(days=(fin - inicio).days // 2)
+    return [
+        (fecha_desde, mitad.strftime(FORMATO_FECHA)),
+        ((mitad + datetime.timedelta(days=1)).strftime(FORMATO_FECHA), fecha_hasta),
+    ]
+
+def contar_paginas(driver, maximo):
+    """
+    Avanza por el listado hasta contar `maximo` páginas o llegar a la última.
+    
+    Returns:
+        Número de páginas recorridas (como máximo `maximo`)
+    """
+    paginas = 1
+    while paginas < maximo and pasar_pagina(driver):
+        paginas += 1
+    return paginas
+
+def procesar_tramo(username, password, fecha_desde, fecha_hasta, max_reintentos=3, headless=False,
+                   limites_espera=None, directorio_descargas=None, max_paginas=None, ruta_manifiesto=RUTA_MANIFIESTO,
+                   url_portal=None, ligero=False, cache_sesiones=None, tasa=None, pestanas=None, url_detalle=None):
+    """
+    Procesa un tramo de fechas completo en su propio proceso y su propio navegador.
+    
+    Si se indica max_paginas y el tramo tiene más páginas que ese límite (y más de un
+    día), no descarga nada y pide al orquestador que lo divida.
+    
+    Args:
+        tasa: En un proceso hijo, acciones por segundo de este tramo (su parte del límite global)
+        pestanas / url_detalle: En un proceso hijo, la configuración de configurar_pestanas
+    
+    Returns:
+        Diccionario con "estado" ("completado", "dividir" o "fallido"), el rango y
+        la cantidad de resultados descargados
+    """
+    global URL_PORTAL, METRICAS, LIMITADOR
+    # Los procesos hijos no heredan la URL cambiada en tiempo de ejecución (spawn en Windows)
+    if url_portal:
+        URL_PORTAL = url_portal
+    if cache_sesiones is not None:
+        # "" = caché desactivada en el proceso principal
+        configurar_cache_sesiones(cache_sesiones or None)
+    if multiprocessing.parent_process() is not None:
+        # Métricas propias de este tramo; el orquestador las suma a las suyas
+        METRICAS = MetricasPasos()
+        LIMITADOR = LimitadorPortal(tasa)
+        configurar_pestanas(pestanas, url_detalle)
+    configurar_limites_espera(limites_espera)
+    abrir_manifiesto(ruta_manifiesto, fecha_desde, fecha_hasta)
+    resultado = {"desde": fecha_desde, "hasta": fecha_hasta, "descargados": 0, "estado": "fallido"}
+    configuracion = crear_opciones_chrome(headless, directorio_descargas, ligero)
+    cursor = CursorDescarga(fecha_desde, fecha_hasta)
+    driver = None
+    
+    try:
+        logger.info(f"📅 Tramo {fecha_desde} - {fecha_hasta}")
+        if max_paginas and fecha_desde != fecha_hasta:
+            driver = crear_navegador(configuracion)
+            iniciar_sesion(driver, username, password)
+            buscar_resultados(driver, fecha_desde, fecha_hasta)
+            paginas = contar_paginas(driver, max_paginas + 1)
+            if paginas > max_paginas:
+                logger.info(f"Tramo {fecha_desde} - {fecha_hasta} con más de {max_paginas} páginas, se divide")
+                resultado["estado"] = "dividir"
+                return resultado
+        
+        # El supervisor reutiliza la sesión del sondeo y reanuda en el cursor si hay que reiniciar
+        driver = supervisar_descarga(configuracion, username, password, cursor, max_reintentos, driver=driver)
+        resultado["estado"] = "completado"
+    except Exception as e:
+        logger.error(f"❌ Error en el tramo {fecha_desde} - {fecha_hasta}: {e}")
+    finally:
+        resultado["descargados"] = cursor.descargados
+        resultado["metricas"] = METRICAS.instantanea()
+        if driver:
+            try:
+                driver.quit()
+            except:
+                pass
+    return resultado
+
+def descargar_por_tramos(username="1234", password="1234", fecha_desde=None, fecha_hasta=None, particion="semana",
+                         procesos=2, max_reintentos=3, headless=False, limites_espera=None,
+                         directorio_descargas=None, max_paginas_tramo=5, ruta_manifiesto=RUTA_MANIFIESTO, ligero=False):
+    """
+    Orquesta la descarga dividiendo el rango de fechas en tramos que se procesan en
+    procesos independientes. Todos los procesos guardan en el mismo directorio de
+    descargas y registran en el mismo manifiesto.
+    
+    Args:
+        particion: "dia", "semana" o "adaptativo"
+        procesos: Número máximo de procesos (navegadores) simultáneos
+        max_paginas_tramo: En modo adaptativo, páginas máximas por tramo antes de dividirlo
+    
+    Returns:
+        Lista con el resultado de cada tramo procesado
+    """
+    if not fecha_desde or not fecha_hasta:
+        primer_dia, ultimo_dia = rango_fechas_por_defecto()
+        fecha_desde = fecha_desde or primer_dia
+        fecha_hasta = fecha_hasta or ultimo_dia
+    
+    pendientes = dividir_rango(fecha_desde, fecha_hasta, particion)
+    max_paginas = max_paginas_tramo if particion == "adaptativo" else None
+    logger.info(f"🔄 {len(pendientes)} tramos ({particion}) entre {fecha_desde} y {fecha_hasta} con {procesos} procesos")
+    
+    resultados = []
+    with ProcessPoolExecutor(max_workers=procesos) as ejecutor:
+        en_curso = set()
+        while pendientes or en_curso:
+            while pendientes and len(en_curso) < procesos:
+                desde, hasta = pendientes.pop(0)
+                en_curso.add(ejecutor.submit(
+                    procesar_tramo, username, password, desde, hasta, max_reintentos, headless,
+                    limites_espera, directorio_descargas, max_paginas, ruta_manifiesto, URL_PORTAL, ligero,
+                    CACHE_SESIONES or "", LIMITADOR.tasa / procesos if LIMITADOR.tasa else None,
+                    PESTANAS, PLANTILLA_DETALLE
+                ))
+            terminados, en_curso = esperar_futuros(en_curso, return_when=FIRST_COMPLETED)
+            for futuro in terminados:
+                try:
+                    resultado = futuro.result()
+                except Exception as e:
+                    logger.error(f"❌ Un proceso terminó con error: {e}")
+                    continue
+                METRICAS.combinar(resultado["metricas"])
+                if resultado["estado"] == "dividir":
+                    mitades = partir_tramo(resultado["desde"], resultado["hasta"])
+                    pendientes.extend(mitades)
+                    continue
+                resultados.append(resultado)
+                logger.info(f"Tramo {resultado['desde']} - {resultado['hasta']}: {resultado['estado']} ({resultado['descargados']} descargados)")
+    
+    total = sum(r["descargados"] for r in resultados)
+    fallidos = [r for r in resultados if r["estado"] != "completado"]
+    logger.info(f"\n✅ Descarga por tramos completada. {total} resultados en {len(resultados)} tramos ({len(fallidos)} fallidos).")
+    for r in fallidos:
+        logger.warning(f"⚠️ Tramo sin completar: {r['desde']} - {r['hasta']}")
+    return resultados
+
+def liberar_navegador(driver):
+    """
+    Deja el navegador en reposo entre ciclos del modo servicio: descarga la página del
+    portal y vacía la caché de Chrome, sin cerrar el proceso.
+    """
+    try:
+        driver.get("about:blank")
+        driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+    except WebDriverException as e:
+        logger.warning(f"⚠️ No se pudo liberar el navegador entre ciclos: {e}")
+
+def ejecutar_servicio(username="1234", password="1234", intervalo=60, fecha_desde=None, solapamiento=3,
+                      max_reintentos=3, headless=True, limites_espera=None, directorio_descargas=None,
+                      ruta_manifiesto=RUTA_MANIFIESTO, ligero=False, max_ciclos=None):
+    """
+    Modo servicio: cada `intervalo` minutos descarga solo lo nuevo desde la marca de agua
+    guardada en el manifiesto, con un único navegador que se mantiene abierto entre ciclos.
+    
+    Cada ciclo busca desde (marca - solapamiento días) hasta hoy; el solapamiento cubre
+    los resultados que el laboratorio publica con fecha atrasada y el manifiesto salta
+    los que ya se descargaron. La marca solo avanza cuando el ciclo termina sin errores.
+    
+    Args:
+        intervalo: Minutos entre el inicio de un ciclo y el siguiente
+        fecha_desde: Fecha inicial (DD/MM/AAAA) si todavía no hay marca (default: primero del mes)
+        solapamiento: Días que se repiten antes de la marca en cada ciclo
+        max_ciclos: Número de ciclos antes de terminar (default: sin límite)
+    """
+    configurar_limites_espera(limites_espera)
+    manifiesto = abrir_manifiesto(ruta_manifiesto)
+    nombre_marca = f"servicio:{username}"
+    configuracion = crear_opciones_chrome(headless, directorio_descargas, ligero)
+    driver = None
+    ciclo = 0
+    logger.info(f"🛰️ Modo servicio: un ciclo cada {intervalo} min (solapamiento de {solapamiento} días)")
+    
+    try:
+        while max_ciclos is None or ciclo < max_ciclos:
+            ciclo += 1
+            inicio = time.monotonic()
+            inicio_ciclo = datetime.datetime.now()
+            hoy = datetime.date.today()
+            marca = manifiesto.marca(nombre_marca)
+            if marca:
+                desde = datetime.datetime.strptime(marca, FORMATO_FECHA).date() - datetime.timedelta(days=solapamiento)
+            elif fecha_desde:
+                desde = datetime.datetime.strptime(fecha_desde, FORMATO_FECHA).date()
+            else:
+                desde = hoy.replace(day=1)
+            desde, hasta = min(desde, hoy).strftime(FORMATO_FECHA), hoy.strftime(FORMATO_FECHA)
+            abrir_manifiesto(ruta_manifiesto, desde, hasta)
+            cursor = CursorDescarga(desde, hasta)
+            logger.info(f"\n🔁 Ciclo {ciclo}: {desde} - {hasta} (marca anterior: {marca or 'ninguna'})")
+            
+            try:
+                if driver is not None:
+                    # Navegador del ciclo anterior: restaurar la sesión o volver a iniciarla
+                    try:
+                        iniciar_sesion(driver, username, password)
+                    except Exception as e:
+                        logger.warning(f"⚠️ El navegador del ciclo anterior no sirve, se inicia otro: {e}")
+                        try:
+                            driver.quit()
+                        except:
+                            pass
+                        driver = None
+                driver = supervisar_descarga(configuracion, username, password, cursor, max_reintentos, driver=driver)
+                manifiesto.fijar_marca(nombre_marca, hasta)
+                logger.info(f"✅ Ciclo {ciclo} completado: {cursor.descargados} resultados nuevos; marca en {hasta}")
+            except Exception as e:
+                logger.error(f"❌ Ciclo {ciclo} fallido, la marca no avanza: {e}")
+                if driver:
+                    try:
+                        driver.quit()
+                    except:
+                        pass
+                driver = None
+            
+            METRICAS.exportar()
+            exportar_corrida(inicio_ciclo, "servicio", desde, hasta, ruta_manifiesto, pasos=METRICAS.reporte()["pasos"])
+            if max_ciclos is not None and ciclo >= max_ciclos:
+                break
+            if driver:
+                liberar_navegador(driver)
+            espera = max(0, intervalo * 60 - (time.monotonic() - inicio))
+            logger.info(f"💤 Próximo ciclo en {espera / 60:.1f} min")
+            time.sleep(espera)
+    except KeyboardInterrupt:
+        logger.info("\nServicio detenido por el usuario. Finalizando...")
+    finally:
+        if driver:
+            try:
+                driver.quit()
+                logger.info("Navegador cerrado correctamente")
+            except:
+                pass
+
+def crear_sesion_http(driver, conexiones=8):
+    """
+    Crea una sesión HTTP con las cookies de la sesión autenticada de Selenium.
+    
+    Args:
+        driver: WebDriver con la sesión ya iniciada
+        conexiones: Tamaño del pool de conexiones (descargas simultáneas)
+    
+    Returns:
+        requests.Session lista para consultar el portal
+    """
+    if requests is None:
+        raise RuntimeError("El motor HTTP requiere el paquete 'requests' (pip install requests)")
+    
+    sesion = requests.Session()
+    adaptador = HTTPAdapter(pool_connections=conexiones, pool_maxsize=conexiones, max_retries=2)
+    sesion.mount("http://", adaptador)
+    sesion.mount("https://", adaptador)
+    sesion.headers["User-Agent"] = driver.execute_script("return navigator.userAgent;")
+    sesion.headers["Referer"] = driver.current_url
+    for cookie in driver.get_cookies():
+        sesion.cookies.set(cookie["name"], cookie["value"], domain=cookie.get("domain"), path=cookie.get("path", "/"))
+    return sesion
+
+def listar_claves_resultados(driver):
+    """
+    Recorre todas las páginas del listado y devuelve sus resultados.
+    
+    Returns:
+        Lista de filas de instantanea_listado (sin el enlace) con su "pagina"
+    """
+    resultados = []
+    pagina = 1
+    while True:
+        try:
+            WebDriverWait(driver, LIMITES_ESPERA["buscar"], poll_frequency=0.2).until(
+                EC.presence_of_element_located((By.XPATH, "//span[starts-with(@id, 'span_CTLVER_')]/a"))
+            )
+        except TimeoutException:
+            logger.warning(f"⚠️ No se encontraron resultados en la página {pagina}")
+            break
+        # Solo los datos de las filas: no hace falta serializar los enlaces
+        filas = filas_desde_instantanea(driver.execute_script(SCRIPT_INSTANTANEA_LISTADO, False) or [], pagina)
+        total = len(filas)
+        resultados.extend(dict(fila, enlace=None, pagina=pagina) for fila in filas)
+        logger.info(f"Página {pagina}: {total} resultados listados")
+        if not pasar_pagina(driver):
+            break
+        pagina += 1
+    return resultados
+
+RUTA_LISTADO = "listado_lab_nancy.json"
+
+def enumerar_resultados(username="1234", password="1234", fecha_desde=None, fecha_hasta=None, headless=True,
+                        limites_espera=None, ruta_listado=RUTA_LISTADO, ruta_manifiesto=RUTA_MANIFIESTO, ligero=False):
+    """
+    Modo enumeración: recorre todas las páginas del listado leyendo cada una con una sola
+    instantánea, sin abrir ni descargar ningún resultado, y guarda un listado JSON con el
+    total, los conteos por día y por página y cada resultado marcado según el manifiesto
+    (ya descargado o pendiente). Sirve para dimensionar trabajadores y tramos antes de
+    una corrida larga.
+    
+    Returns:
+        El diccionario guardado en ruta_listado
+    """
+    configurar_limites_espera(limites_espera)
+    if not fecha_desde or not fecha_hasta:
+        primer_dia, ultimo_dia = rango_fechas_por_defecto()
+        fecha_desde = fecha_desde or primer_dia
+        fecha_hasta = fecha_hasta or ultimo_dia
+    manifiesto = abrir_manifiesto(ruta_manifiesto, fecha_desde, fecha_hasta)
+    
+    inicio = time.monotonic()
+    driver = crear_navegador(crear_opciones_chrome(headless, None, ligero))
+    try:
+        iniciar_sesion(driver, username, password)
+        buscar_resultados(driver, fecha_desde, fecha_hasta)
+        resultados = listar_claves_resultados(driver)
+    finally:
+        driver.quit()
+    
+    por_dia = {}
+    por_pagina = {}
+    for fila in resultados:
+        dia = fila["fecha"].isoformat() if fila["fecha"] else "sin_fecha"
+        por_dia[dia] = por_dia.get(dia, 0) + 1
+        por_pagina[fila["pagina"]] = por_pagina.get(fila["pagina"], 0) + 1
+    pendientes = [fila for fila in resultados if not manifiesto.completado(fila["clave"])]
+    listado = {
+        "desde": fecha_desde,
+        "hasta": fecha_hasta,
+        "generado": datetime.datetime.now().isoformat(timespec="seconds"),
+        "segundos": round(time.monotonic() - inicio, 1),
+        "total": len(resultados),
+        "paginas": len(por_pagina),
+        "descargados": len(resultados) - len(pendientes),
+        "pendientes": len(pendientes),
+        "por_dia": dict(sorted(por_dia.items())),
+        "por_pagina": por_pagina,
+        "resultados": [
+            {
+                "clave": fila["clave"],
+                "fecha": fila["fecha"].isoformat() if fila["fecha"] else None,
+                "examen": fila.get("examen"),
+                "pagina": fila["pagina"],
+                "descargado": manifiesto.completado(fila["clave"]),
+            }
+            for fila in resultados
+        ],
+    }
+    temporal = f"{ruta_listado}.tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(listado, f, indent=2, ensure_ascii=False)
+    os.replace(temporal, ruta_listado)
+    
+    logger.info(f"\n📋 {listado['total']} resultados en {listado['paginas']} páginas ({fecha_desde} - {fecha_hasta}), "
+                f"{listado['pendientes']} pendientes de descargar; listado en {ruta_listado} ({listado['segundos']} s)")
+    for dia, cantidad in listado["por_dia"].items():
+        logger.info(f"  {dia}: {cantidad}")
+    return listado
+
+@medido("pdf_http")
+def descargar_pdf_http(sesion, url, destino, timeout=60):
+    """
+    Descarga un PDF con la sesión HTTP y lo guarda en `destino` solo si está completo.
+    
+    Returns:
+        Número de bytes escritos
+    
+    Raises:
+        ValueError si la respuesta no es un PDF (p. ej. la página de login por sesión vencida)
+        DescargaIncompleta si llegan menos bytes de los anunciados o falta el %%EOF
+    """
+    temporal = destino + ".part"
+    LIMITADOR.adquirir()
+    try:
+        with sesion.get(url, stream=True, timeout=timeout) as respuesta:
+            respuesta.raise_for_status()
+            # Con compresión, Content-Length no es el tamaño de lo que se escribe
+            esperado = None if respuesta.headers.get("Content-Encoding") else respuesta.headers.get("Content-Length")
+            bloques = respuesta.iter_content(chunk_size=64 * 1024)
+            primero = next(bloques, b"")
+            if not primero.startswith(b"%PDF"):
+                raise ValueError(f"La respuesta de {url} no es un PDF ({respuesta.headers.get('Content-Type')})")
+            tamano = len(primero)
+            with open(temporal, "wb") as f:
+                f.write(primero)
+                for bloque in bloques:
+                    f.write(bloque)
+                    tamano += len(bloque)
+        if esperado and esperado.isdigit() and tamano != int(esperado):
+            raise DescargaIncompleta(f"{url}: {tamano} de {esperado} bytes")
+        if not pdf_completo(temporal, destino):
+            raise DescargaIncompleta(f"{url}: el PDF está truncado")
+        os.replace(temporal, destino)
+    except (requests.RequestException, ValueError, DescargaIncompleta) as e:
+        LIMITADOR.registrar(False, e)
+        raise
+    finally:
+        # Una descarga fallida no deja su .part: el reintento empieza de cero
+        if os.path.exists(temporal):
+            try:
+                os.remove(temporal)
+            except OSError:
+                pass
+    LIMITADOR.registrar(True)
+    return tamano
+
+def descargar_por_http(username="1234", password="1234", fecha_desde=None, fecha_hasta=None, url_pdf=None,
+                       conexiones=8, headless=False, limites_espera=None, directorio_descargas=None,
+                       ruta_manifiesto=RUTA_MANIFIESTO, ligero=False):
+    """
+    Motor de descarga directa: Selenium solo inicia sesión y lista los resultados; cada
+    PDF se pide al portal con una única petición HTTP, varias a la vez.
+    
+    Args:
+        url_pdf: Plantilla de la URL del PDF de un resultado, con {clave} donde va el
+            identificador (CTLCOD). Puede ser relativa a la página del listado.
+        conexiones: Número de descargas HTTP simultáneas
+    
+    Returns:
+        Tupla (descargados, lista de claves que fallaron)
+    """
+    if not url_pdf or "{clave}" not in url_pdf:
+        raise ValueError("url_pdf debe incluir el marcador {clave}")
+    configurar_limites_espera(limites_espera)
+    
+    if not fecha_desde or not fecha_hasta:
+        primer_dia, ultimo_dia = rango_fechas_por_defecto()
+        fecha_desde = fecha_desde or primer_dia
+        fecha_hasta = fecha_hasta or ultimo_dia
+    
+    directorio = os.path.abspath(directorio_descargas or DIRECTORIO_SALIDA)
+    os.makedirs(directorio, exist_ok=True)
+    manifiesto = abrir_manifiesto(ruta_manifiesto, fecha_desde, fecha_hasta)
+    
+    driver = crear_navegador(crear_opciones_chrome(headless, directorio, ligero))
+    try:
+        iniciar_sesion(driver, username, password)
+        buscar_resultados(driver, fecha_desde, fecha_hasta)
+        resultados = listar_claves_resultados(driver)
+        url_base = driver.current_url
+        sesion = crear_sesion_http(driver, conexiones)
+    finally:
+        # Selenium ya no es necesario: las descargas usan la sesión HTTP
+        driver.quit()
+    
+    pendientes = [fila for fila in resultados if not manifiesto.completado(fila["clave"])]
+    logger.info(f"{len(resultados) - len(pendientes)} resultados ya estaban descargados según el manifiesto")
+    # Sin identificador no hay URL del PDF: esas filas solo se pueden descargar desde el navegador
+    fallidos = [fila["clave"] for fila in pendientes if not ManifiestoDescargas.clave_valida(fila["clave"])]
+    if fallidos:
+        logger.warning(f"⚠️ {len(fallidos)} resultados sin identificador no se pueden pedir por HTTP: {', '.join(fallidos)}")
+        pendientes = [fila for fila in pendientes if ManifiestoDescargas.clave_valida(fila["clave"])]
+    logger.info(f"🔄 Descargando {len(pendientes)} resultados por HTTP con {conexiones} conexiones...")
+    descargados = 0
+    
+    def descargar_clave(fila):
+        clave = fila["clave"]
+        url = urljoin(url_base, url_pdf.format(clave=quote(clave)))
+        destino = ruta_resultado(directorio, clave, fila.get("fecha"))
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        manifiesto.iniciar(clave, fila["pagina"], fila)
+        inicio = time.monotonic()
+        tamano = descargar_pdf_http(sesion, url, destino)
+        return destino, tamano, time.monotonic() - inicio
+    
+    with ThreadPoolExecutor(max_workers=conexiones) as ejecutor:
+        futuros = {ejecutor.submit(descargar_clave, fila): fila["clave"] for fila in pendientes}
+        for futuro in as_completed(futuros):
+            clave = futuros[futuro]
+            try:
+                destino, tamano, duracion = futuro.result()
+                descargados += 1
+                log_descarga(clave, destino, tamano)
+                logger.info(f"  ✅ {clave}: {tamano} bytes en {duracion:.2f} s")
+            except Exception as e:
+                fallidos.append(clave)
+                manifiesto.fallar(clave, e)
+                logger.error(f"  ❌ {clave}: {e}")
+    
+    logger.info(f"\n✅ Descarga HTTP completada: {descargados} de {len(pendientes)} resultados pendientes ({len(fallidos)} fallidos).")
+    return descargados, fallidos
+
+# ---------------------------------------------------------------------------
+# Motor asíncrono: varias sesiones en un solo proceso y un solo bucle de eventos.
+# Mientras una sesión espera al portal, las demás siguen trabajando.
+# ---------------------------------------------------------------------------
+
+XPATH_ENLACES_VER = "//span[starts-with(@id, 'span_CTLVER_')]/a"
+
+def _ms(paso):
+    """
+    Espera adaptativa del paso (LATENCIA) en milisegundos, para los timeouts de Playwright.
+    """
+    return LATENCIA.espera(paso) * 1000
+
+async def esperar_portal_inactivo_async(frame, paso="pagina"):
+    """
+    Versión asíncrona de esperar_portal_inactivo para una página o frame de Playwright.
+    """
+    try:
+        await LATENCIA.esperar_async(
+            lambda ms: frame.wait_for_function("() => {" + SCRIPT_PORTAL_INACTIVO + "}", timeout=ms, polling=200),
+            paso, f"{paso}:inactivo"
+        )
+        return True
+    except PlaywrightTimeout:
+        espera = LATENCIA.espera(paso, f"{paso}:inactivo")
+        logger.warning(f"⚠️ El portal sigue ocupado después de {espera:.1f} s (paso '{paso}')")
+        return False
+
+async def clic_cuando_listo_async(frame, selector, paso, esperar_despues=True):
+    """
+    Versión asíncrona de clic_cuando_listo: Playwright espera a que el elemento sea interactuable.
+    """
+    await LIMITADOR.adquirir_async()
+    await LATENCIA.esperar_async(lambda ms: frame.click(selector, timeout=ms), paso)
+    if esperar_despues:
+        await esperar_portal_inactivo_async(frame, paso)
+
+async def entrar_a_marco_async(page, index, marco="detalle"):
+    """
+    Versión asíncrona de cambiar_a_iframe: el frame de la página que contiene alguno de
+    los elementos de MARCOS_PORTAL[marco], esperando hasta la espera adaptativa de
+    "iframe". Si ninguno lo tiene, se usa el iframe en la posición `index` (último recurso).
+    
+    Returns:
+        El Frame de Playwright
+    """
+    selector = ", ".join(f"#{marcador}" for marcador in MARCOS_PORTAL[marco])
+    
+    async def buscar(ms):
+        limite = time.monotonic() + ms / 1000
+        while True:
+            for frame in page.frames:
+                if frame is page.main_frame or frame.is_detached():
+                    continue
+                try:
+                    if await frame.query_selector(selector) is not None:
+                        return frame
+                except Exception:
+                    continue  # El portal reemplazó el frame mientras se revisaba
+            if time.monotonic() >= limite:
+                raise PlaywrightTimeout(f"Ningún iframe tiene el contenido de '{marco}'")
+            await asyncio.sleep(0.2)
+    
+    try:
+        frame = await LATENCIA.esperar_async(buscar, "iframe")
+    except PlaywrightTimeout:
+        logger.warning(f"⚠️ Ningún iframe tiene el contenido de '{marco}', se usa el iframe {index}")
+        iframe = page.locator("iframe").nth(index)
+        await iframe.wait_for(state="attached", timeout=_ms("iframe"))
+        frame = await (await iframe.element_handle()).content_frame()
+    await esperar_portal_inactivo_async(frame, "iframe")
+    return frame
+
+@medido("login")
+async def iniciar_sesion_async(page, username, password, max_intentos=3, ranura=None):
+    """
+    Mismo flujo de login que iniciar_sesion, sobre una página de Playwright.
+    
+    Args:
+        ranura: Nombre de la sesión en la caché de sesiones (None = sin caché)
+    """
+    datos = leer_sesion(username, password, ranura) if ranura else None
+    if datos:
+        try:
+            await page.context.add_cookies(datos["cookies"])
+            await page.goto(datos["url"], timeout=_ms("pagina"))
+            await page.wait_for_selector("#vCRITERIO", state="attached", timeout=_ms("sesion"))
+            await esperar_portal_inactivo_async(page, "pagina")
+            logger.info("✅ Sesión restaurada desde la caché (sin repetir el login)")
+            return
+        except Exception:
+            logger.info("🔑 La sesión guardada ya no es válida, se iniciará sesión de nuevo")
+            borrar_sesion(username, ranura)
+            await page.context.clear_cookies()
+    
+    for intento in range(max_intentos):
+        try:
+            logger.info("Abriendo la página de login...")
+            await page.goto(URL_PORTAL, timeout=_ms("pagina"))
+            await esperar_portal_inactivo_async(page, "pagina")
+            # select_option espera a que exista la opción (GeneXus carga algunas por AJAX)
+            await page.select_option("#vTIPO", "E", timeout=_ms("login"))
+            await esperar_portal_inactivo_async(page, "login")
+            await page.select_option("#vTIPODCTO_COD", "NI", timeout=_ms("login"))
+            await esperar_portal_inactivo_async(page, "login")
+            await page.fill("#vNUM_DOC", username, timeout=_ms("login"))
+            await clic_cuando_listo_async(page, "#SIGUIENTE", "login")
+            await page.fill("#vPASSWORD", password, timeout=_ms("login"))
+            await clic_cuando_listo_async(page, "#INGRESAR", "pagina")
+            await page.wait_for_selector("#vCRITERIO", state="attached", timeout=_ms("login"))
+            logger.info("✅ Login exitoso")
+            if ranura:
+                escribir_sesion(username, password, ranura, {"url": page.url, "cookies": await page.context.cookies()})
+            return
+        except PlaywrightTimeout as e:
+            logger.warning(f"⚠️ Login fallido (intento {intento+1}/{max_intentos}): {e}")
+    raise Exception("No se pudo iniciar sesión después de varios intentos")
+
+async def buscar_resultados_async(page, fecha_desde, fecha_hasta):
+    """
+    Selecciona "RANGO FECHAS", establece las fechas y hace clic en "Buscar".
+    """
+    await page.select_option("#vCRITERIO", "1", timeout=_ms("login"))
+    await esperar_portal_inactivo_async(page, "login")
+    for campo, valor in (("vDESDEFEC", fecha_desde), ("vHASFEC", fecha_hasta)):
+        await page.evaluate("""([campo, valor]) => {
+            const control = document.getElementById(campo);
+            control.value = valor;
+            control.dispatchEvent(new Event('change', { bubbles: true }));
+            control.dispatchEvent(new Event('blur', { bubbles: true }));
+        }""", [campo, valor])
+        await esperar_portal_inactivo_async(page, "login")
+    await clic_cuando_listo_async(page, "#IMAGE5", "buscar")
+
+@medido("pagina_siguiente", falso_es_error=False)
+async def pasar_pagina_async(page):
+    """
+    Hace clic en "Siguiente" y espera a que el listado se reemplace.
+    
+    Returns:
+        True si el listado cambió de página, False si ya estaba en la última
+    """
+    siguiente = page.locator(".PagingButtonsNext").first
+    try:
+        if not await siguiente.is_enabled(timeout=_ms("pagina_siguiente")):
+            return False
+        primer_enlace = await page.query_selector(f"xpath={XPATH_ENLACES_VER}")
+        await LIMITADOR.adquirir_async()
+        await siguiente.click(timeout=_ms("pagina_siguiente"))
+        if primer_enlace is not None:
+            await page.wait_for_function("e => !e.isConnected", arg=primer_enlace, timeout=_ms("pagina_siguiente"))
+        await esperar_portal_inactivo_async(page, "pagina_siguiente")
+        return True
+    except PlaywrightTimeout:
+        logger.info("⚠️ El listado no cambió después de 'Siguiente' - posiblemente es la última página")
+        return False
+
+@medido("resultado")
+async def descargar_resultado_async(page, index, total, directorio, fila):
+    """
+    Secuencia Ver → IMPRIMIR → DESCARGAR → VOLVER → CANCEL de un resultado con Playwright.
+    Playwright descarga en su carpeta temporal; el archivo se copia a un .part junto a su
+    ruta definitiva y se renombra cuando está completo.
+    
+    Returns:
+        Ruta del archivo descargado, o None si el resultado no tiene PDF
+    """
+    enlaces = page.locator(f"xpath={XPATH_ENLACES_VER}")
+    await LIMITADOR.adquirir_async()
+    await LATENCIA.esperar_async(lambda ms: enlaces.nth(index).click(timeout=ms), "ver")
+    logger.info(f"  ↳ {index+1}/{total} 1/5: Clic en enlace 'Ver' completado")
+    
+    # Esperar el iframe de detalle, reconocido por su contenido como en cambiar_a_iframe
+    frame = await entrar_a_marco_async(page, 1)
+    
+    try:
+        await clic_cuando_listo_async(frame, "#IMPRIMIR", "imprimir")
+    except PlaywrightTimeout:
+        # Resultado sin PDF solo si el detalle cargó (CANCEL presente) sin IMPRIMIR;
+        # si no, fue una respuesta lenta y el llamador reintenta
+        await esperar_portal_inactivo_async(frame, "imprimir")
+        if await frame.locator("#IMPRIMIR").count() or not await frame.locator("#CANCEL").count():
+            raise
+        logger.info(f"  ↳ {index+1}/{total} El detalle no tiene botón IMPRIMIR: el resultado no tiene PDF")
+        await clic_cuando_listo_async(frame, "#CANCEL", "cancel", esperar_despues=False)
+        await esperar_portal_inactivo_async(page, "cancel")
+        return None
+    
+    async with page.expect_download(timeout=_ms("descargar")) as descarga_info:
+        await clic_cuando_listo_async(frame, "#DESCARGAR", "descargar", esperar_despues=False)
+    descarga = await descarga_info.value
+    ruta = ruta_resultado(directorio, fila["clave"], fila.get("fecha"),
+                          os.path.splitext(descarga.suggested_filename)[1].lower() or ".pdf")
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    await descarga.save_as(ruta + ".part")
+    os.replace(ruta + ".part", ruta)
+    
+    await esperar_portal_inactivo_async(frame, "descargar")
+    await clic_cuando_listo_async(frame, "#VOLVER", "volver")
+    await clic_cuando_listo_async(frame, "#CANCEL", "cancel", esperar_despues=False)
+    await esperar_portal_inactivo_async(page, "cancel")
+    return ruta
+
+async def bloquear_recurso_async(ruta):
+    """
+    Manejador de page.route para el modo ligero: cancela imágenes, fuentes, multimedia
+    y los recursos de RECURSOS_BLOQUEADOS_LIGERO; el resto (incluidos los PDF) continúa.
+    """
+    peticion = ruta.request
+    if peticion.resource_type in ("image", "font", "media") or \
+       any(fnmatch(peticion.url, patron) for patron in RECURSOS_BLOQUEADOS_LIGERO):
+        await ruta.abort()
+    else:
+        await ruta.continue_()
+
+async def ejecutar_sesion_async(navegador, numero, coordinador, username, password, fecha_desde, fecha_hasta,
+                                directorio, max_reintentos=3, ligero=False):
+    """
+    Una sesión del motor asíncrono: su propio contexto (cookies y login independientes)
+    dentro del navegador compartido. Toma páginas del coordinador como los trabajadores
+    del modo --workers.
+    """
+    contexto = await navegador.new_context(accept_downloads=True)
+    if ligero:
+        await contexto.route("**/*", bloquear_recurso_async)
+    page = await contexto.new_page()
+    # Aceptar las alertas JavaScript que aparecen después de DESCARGAR
+    page.on("dialog", lambda dialogo: asyncio.ensure_future(dialogo.accept()))
+    try:
+        await iniciar_sesion_async(page, username, password, ranura=f"{ranura_sesion()}-async-{numero}")
+        await buscar_resultados_async(page, fecha_desde, fecha_hasta)
+        pagina_en_navegador = 1
+        
+        pagina = coordinador.tomar_pagina()
+        while pagina is not None:
+            while pagina_en_navegador < pagina and await pasar_pagina_async(page):
+                pagina_en_navegador += 1
+            if pagina_en_navegador < pagina:
+                coordinador.marcar_ultima_pagina(pagina_en_navegador)
+                pagina = coordinador.tomar_pagina()
+                continue
+            
+            try:
+                await page.wait_for_selector(f"xpath={XPATH_ENLACES_VER}", timeout=_ms("buscar"))
+            except PlaywrightTimeout:
+                logger.warning(f"⚠️ Sesión {numero}: no hay resultados en la página {pagina}")
+                pagina = coordinador.tomar_pagina()
+                continue
+            total = await page.locator(f"xpath={XPATH_ENLACES_VER}").count()
+            logger.info(f"Sesión {numero}: {total} resultados en la página {pagina}")
+            
+            filas = filas_desde_instantanea(
+                await page.evaluate(f"(function() {{ {SCRIPT_INSTANTANEA_LISTADO} }})", False), pagina
+            )
+            for index, fila in enumerate(filas):
+                clave = fila["clave"]
+                if MANIFIESTO is not None and MANIFIESTO.completado(clave):
+                    continue
+                if not coordinador.reclamar(clave):
+                    continue
+                
+                for intento in range(max_reintentos):
+                    try:
+                        if MANIFIESTO is not None:
+                            MANIFIESTO.iniciar(clave, pagina, fila)
+                        ruta = await descargar_resultado_async(page, index, total, directorio, fila)
+                        LIMITADOR.registrar(True)
+                        if ruta:
+                            log_descarga(clave, ruta, os.path.getsize(ruta))
+                        else:
+                            log_sin_pdf(clave)
+                        coordinador.registrar_descarga()
+                        break
+                    except Exception as e:
+                        logger.warning(f"⚠️ Sesión {numero}: intento {intento+1}/{max_reintentos} fallido para {clave}: {e}")
+                        LIMITADOR.registrar(False, e)
+                        if MANIFIESTO is not None:
+                            MANIFIESTO.fallar(clave, e)
+                        # Volver al listado de la misma página antes de reintentar
+                        await asyncio.sleep(LATENCIA.pausa("recuperacion", intento))
+                        await page.reload(timeout=_ms("pagina"))
+                        await buscar_resultados_async(page, fecha_desde, fecha_hasta)
+                        pagina_en_navegador = 1
+                        while pagina_en_navegador < pagina and await pasar_pagina_async(page):
+                            pagina_en_navegador += 1
+                else:
+                    coordinador.liberar(clave)
+            pagina = coordinador.tomar_pagina()
+    except Exception as e:
+        logger.error(f"❌ Sesión {numero} detenida por un error: {e}")
+    finally:
+        await contexto.close()
+    logger.info(f"Sesión {numero} finalizada")
+
+async def descargar_async(username="1234", password="1234", fecha_desde=None, fecha_hasta=None, sesiones=4,
+                          max_reintentos=3, headless=True, limites_espera=None, directorio_descargas=None,
+                          ruta_manifiesto=RUTA_MANIFIESTO, ligero=False):
+    """
+    Motor asíncrono: un único navegador Chromium con `sesiones` contextos independientes
+    manejados desde un solo bucle de eventos. El flujo (login, criterio, rango de
+    fechas, paginación, descarga) es el mismo que el de configurar_sistema.
+    
+    Returns:
+        Total de resultados descargados
+    """
+    if async_playwright is None:
+        raise RuntimeError("El motor asíncrono requiere el paquete 'playwright' (pip install playwright)")
+    configurar_limites_espera(limites_espera)
+    
+    if not fecha_desde or not fecha_hasta:
+        primer_dia, ultimo_dia = rango_fechas_por_defecto()
+        fecha_desde = fecha_desde or primer_dia
+        fecha_hasta = fecha_hasta or ultimo_dia
+    
+    directorio = os.path.abspath(directorio_descargas or DIRECTORIO_SALIDA)
+    os.makedirs(directorio, exist_ok=True)
+    abrir_manifiesto(ruta_manifiesto, fecha_desde, fecha_hasta)
+    coordinador = CoordinadorDescargas()
+    
+    logger.info(f"🔄 Motor asíncrono con {sesiones} sesiones ({fecha_desde} - {fecha_hasta})")
+    async with async_playwright() as playwright:
+        navegador = await playwright.chromium.launch(headless=headless)
+        try:
+            await asyncio.gather(*[
+                ejecutar_sesion_async(navegador, numero, coordinador, username, password,
+                                      fecha_desde, fecha_hasta, directorio, max_reintentos, ligero)
+                for numero in range(1, sesiones + 1)
+            ])
+        finally:
+            await navegador.close()
+    
+    logger.info(f"\n✅ Motor asíncrono completado. Se descargaron un total de {coordinador.total_descargados} resultados.")
+    return coordinador.total_descargados
+
+# Patrones para extraer datos del texto de un resultado. Ajustar a la plantilla real del laboratorio.
+PATRON_PACIENTE = re.compile(r"Paciente\s*:?\s*(.+)", re.IGNORECASE)
+PATRON_DOCUMENTO = re.compile(r"(?:Documento|Identificaci[oó]n|C\.?C\.?|NIT)\s*(?:No\.?|N[°º])?\s*:?\s*([\w.\-]+\d)", re.IGNORECASE)
+PATRON_EXAMEN = re.compile(r"(?:Examen|Estudio|Prueba)\s*:?\s*(.+)", re.IGNORECASE)
+PATRON_FECHA = re.compile(
+    r"Fecha\s+(?:de\s+)?(\w+)?\s*:?\s*(\d{2}/\d{2}/\d{4}(?:\s+\d{1,2}:\d{2}(?::\d{2})?)?)", re.IGNORECASE
+)
+# "GLUCOSA   95.2  mg/dL   70 - 110"  /  "Hemoglobina: 13,5 g/dL (12 - 16)"
+PATRON_VALOR = re.compile(
+    r"^\s*(?P<analito>[A-Za-zÁÉÍÓÚÑÜáéíóúñü][\w ÁÉÍÓÚÑÜáéíóúñü.,/()%\-]{1,60}?)\s*(?::|\s{2,})\s*"
+    r"(?P<valor>[<>]?\s*\d+(?:[.,]\d+)?)\s*(?P<unidad>[A-Za-zµ/%][\w/%µ^.³]*)?"
+    r"(?:\s+\(?\s*(?P<minimo>\d+(?:[.,]\d+)?)\s*-\s*(?P<maximo>\d+(?:[.,]\d+)?)\s*\)?)?\s*$"
+)
+
+# Líneas de encabezado del resultado, que no son analitos aunque terminen en un número
+PATRONES_ENCABEZADO = (PATRON_PACIENTE, PATRON_DOCUMENTO, PATRON_EXAMEN)
+
+def _numero(texto):
+    return float(texto.replace(",", ".")) if texto else None
+
+def analizar_texto_resultado(texto):
+    """
+    Extrae paciente, documento, examen, fechas y valores de analitos del texto de un resultado.
+    
+    Returns:
+        Diccionario con "paciente", "documento", "examen", "fechas" ({tipo: fecha}) y
+        "valores" (lista de {analito, valor, unidad, minimo, maximo})
+    """
+    def primero(patron):
+        coincidencia = patron.search(texto)
+        return coincidencia.group(1).strip() if coincidencia else None
+    
+    fechas = {}
+    for tipo, fecha in PATRON_FECHA.findall(texto):
+        fechas.setdefault((tipo or "fecha").lower(), fecha)
+    
+    valores = []
+    for linea in texto.splitlines():
+        coincidencia = PATRON_VALOR.match(linea)
+        if not coincidencia or PATRON_FECHA.search(linea) or \
+           any(patron.match(linea.strip()) for patron in PATRONES_ENCABEZADO):
+            continue
+        valor = coincidencia.group("valor").replace(" ", "")
+        valores.append({
+            "analito": coincidencia.group("analito").strip(),
+            "valor": valor,
+            "numero": _numero(valor.lstrip("<>")),
+            "unidad": coincidencia.group("unidad"),
+            "minimo": _numero(coincidencia.group("minimo")),
+            "maximo": _numero(coincidencia.group("maximo")),
+        })
+    
+    return {
+        "paciente": primero(PATRON_PACIENTE),
+        "documento": primero(PATRON_DOCUMENTO),
+        "examen": primero(PATRON_EXAMEN),
+        "fechas": fechas,
+        "valores": valores,
+    }
+
+def extraer_datos_pdf(ruta, archivo=None):
+    """
+    Lee un PDF de resultado y extrae sus datos. Se ejecuta en los procesos del ProcesadorPDF.
+    
+    Args:
+        ruta: Ruta del PDF
+        archivo: Identificador del registro (default: el nombre del archivo); el
+            ProcesadorPDF usa la ruta relativa a la salida, la misma con la que lo reconoce
+    
+    Returns:
+        Diccionario con "archivo", los campos de analizar_texto_resultado y "error" (o None)
+    """
+    registro = {"archivo": archivo or os.path.basename(ruta), "error": None}
+    try:
+        lector = PdfReader(ruta)
+        texto = "\n".join(pagina.extract_text() or "" for pagina in lector.pages)
+        registro.update(analizar_texto_resultado(texto))
+    except Exception as e:
+        registro["error"] = f"{type(e).__name__}: {e}"
+    return registro
+
+class ProcesadorPDF:
+    """
+    Etapa de extracción que corre en paralelo con la descarga: un hilo vigila el
+    directorio de descargas y, en cuanto un PDF termina de escribirse (sin extensión
+    parcial y con tamaño estable), lo envía a un pool acotado de procesos. Los registros
+    se escriben desde el proceso principal en JSONL y/o SQLite.
+    
+    Los archivos ya extraídos en corridas anteriores (según la salida) no se repiten: cada
+    registro guarda en "archivo" la ruta relativa del PDF, la misma que usa la vigilancia.
+    """
+    
+    ESQUEMA = """
+    CREATE TABLE IF NOT EXISTS resultados_pdf (
+        archivo TEXT PRIMARY KEY,
+        paciente TEXT,
+        documento TEXT,
+        examen TEXT,
+        fechas TEXT,
+        procesado TEXT,
+        error TEXT
+    );
+    CREATE TABLE IF NOT EXISTS valores_pdf (
+        archivo TEXT NOT NULL,
+        analito TEXT NOT NULL,
+        valor TEXT,
+        numero REAL,
+        unidad TEXT,
+        minimo REAL,
+        maximo REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_valores_archivo ON valores_pdf (archivo);
+    """
+    
+    def __init__(self, directorio, ruta_jsonl=None, ruta_db=None, procesos=2, intervalo=0.5):
+        self.directorio = directorio
+        self.ruta_jsonl = ruta_jsonl
+        self.ruta_db = ruta_db
+        self.procesos = procesos
+        self.intervalo = intervalo
+        self.procesados = 0
+        self._vistos = set()
+        self._tamanos = {}
+        self._en_curso = set()
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        self._hilo = None
+        self._pool = None
+        self._conexion = None
+    
+    def iniciar(self):
+        if PdfReader is None:
+            logger.warning("⚠️ La extracción de PDF requiere el paquete 'pypdf'; no se extraerán datos")
+            return self
+        os.makedirs(self.directorio, exist_ok=True)
+        if self.ruta_db:
+            self._conexion = sqlite3.connect(self.ruta_db, check_same_thread=False)
+            self._conexion.executescript(self.ESQUEMA)
+            self._vistos.update(fila[0] for fila in self._conexion.execute("SELECT archivo FROM resultados_pdf"))
+        if self.ruta_jsonl and os.path.exists(self.ruta_jsonl):
+            with open(self.ruta_jsonl, encoding="utf-8") as f:
+                for linea in f:
+                    try:
+                        self._vistos.add(json.loads(linea)["archivo"])
+                    except (ValueError, KeyError):
+                        pass
+        self._pool = ProcessPoolExecutor(max_workers=self.procesos)
+        self._hilo = threading.Thread(target=self._vigilar, name="extractor-pdf", daemon=True)
+        self._hilo.start()
+        logger.info(f"🧾 Extracción de PDF activa en {self.directorio} con {self.procesos} procesos")
+        return self
+    
+    def _archivos_listos(self):
+        """
+        PDF nuevos de toda la salida (sin la carpeta de staging) cuyo tamaño no cambió
+        desde la revisión anterior; se identifican por su ruta relativa.
+        """
+        listos = []
+        nombres = []
+        for raiz, carpetas, archivos in os.walk(self.directorio):
+            # Las descargas en curso están en staging; las del motor HTTP terminan en .part
+            carpetas[:] = [c for c in carpetas if c != CARPETA_STAGING]
+            # Con "/" en todos los sistemas, para que la salida sirva al cambiar de equipo
+            nombres.extend(
+                os.path.relpath(os.path.join(raiz, archivo), self.directorio).replace(os.sep, "/")
+                for archivo in archivos if archivo.lower().endswith(".pdf")
+            )
+        for nombre in nombres:
+            if nombre in self._vistos:
+                continue
+            try:
+                tamano = os.path.getsize(os.path.join(self.directorio, nombre))
+            except OSError:
+                continue
+            if tamano > 0 and self._tamanos.get(nombre) == tamano:
+                listos.append(nombre)
+            self._tamanos[nombre] = tamano
+        return listos
+    
+    def _vigilar(self):
+        while not self._detener.is_set():
+            self._revisar()
+            self._detener.wait(self.intervalo)
+    
+    def _revisar(self):
+        for nombre in self._archivos_listos():
+            # Acotar el trabajo pendiente para no acumular archivos en memoria
+            while len(self._en_curso) >= self.procesos * 2 and not self._detener.is_set():
+                time.sleep(self.intervalo)
+            self._vistos.add(nombre)
+            self._tamanos.pop(nombre, None)
+            futuro = self._pool.submit(extraer_datos_pdf, os.path.join(self.directorio, nombre), nombre)
+            with self._lock:
+                self._en_curso.add(futuro)
+            futuro.add_done_callback(self._guardar)
+    
+    def _guardar(self, futuro):
+        with self._lock:
+            self._en_curso.discard(futuro)
+            try:
+                registro = futuro.result()
+            except Exception as e:
+                logger.error(f"❌ Error en el proceso de extracción: {e}")
+                return
+            registro["procesado"] = datetime.datetime.now().isoformat(timespec="seconds")
+            if self.ruta_jsonl:
+                with open(self.ruta_jsonl, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+            if self._conexion is not None:
+                self._conexion.execute(
+                    "INSERT OR REPLACE INTO resultados_pdf VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (registro["archivo"], registro.get("paciente"), registro.get("documento"), registro.get("examen"),
+                     json.dumps(registro.get("fechas") or {}), registro["procesado"], registro["error"])
+                )
+                self._conexion.execute("DELETE FROM valores_pdf WHERE archivo = ?", (registro["archivo"],))
+                self._conexion.executemany(
+                    "INSERT INTO valores_pdf VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(registro["archivo"], v["analito"], v["valor"], v["numero"], v["unidad"], v["minimo"], v["maximo"])
+                     for v in registro.get("valores", [])]
+                )
+                self._conexion.commit()
+            self.procesados += 1
+        if registro["error"]:
+            logger.warning(f"⚠️ No se pudieron extraer datos de {registro['archivo']}: {registro['error']}")
+        else:
+            logger.info(f"🧾 Datos extraídos de {registro['archivo']} ({len(registro['valores'])} valores)")
+    
+    def detener(self):
+        """
+        Procesa los PDF que falten, espera a que termine el pool y cierra la salida.
+        """
+        if self._hilo is None:
+            return
+        self._detener.set()
+        self._hilo.join()
+        # Última pasada: los archivos recién terminados necesitan dos revisiones con el mismo tamaño
+        self._detener.clear()
+        for _ in range(2):
+            self._revisar()
+            time.sleep(self.intervalo)
+        self._pool.shutdown(wait=True)
+        if self._conexion is not None:
+            self._conexion.close()
+        self._hilo = None
+        logger.info(f"🧾 Extracción finalizada: {self.procesados} PDF procesados")
+
+# Carpeta del historial en Parquet (None = no se exporta)
+DIRECTORIO_PARQUET = None
+
+# Archivos por corrida que se acumulan en un mes antes de compactarlo en un solo archivo
+ARCHIVOS_POR_COMPACTAR = 10
+
+# Columna que identifica cada fila al compactar (gana la versión más reciente)
+CLAVES_PARQUET = {"resultados": "clave", "corridas": "corrida"}
+
+def configurar_parquet(directorio):
+    """
+    Activa la exportación del historial en Parquet a la carpeta indicada, o la desactiva con None.
+    """
+    global DIRECTORIO_PARQUET
+    DIRECTORIO_PARQUET = directorio
+    if directorio and pa is None:
+        logger.warning("⚠️ La exportación a Parquet requiere el paquete 'pyarrow'; no se exportará el historial")
+
+def _esquemas_parquet():
+    return {
+        "resultados": pa.schema([
+            ("clave", pa.string()),
+            ("fecha_resultado", pa.date32()),
+            ("examen", pa.string()),
+            ("fecha_desde", pa.date32()),
+            ("fecha_hasta", pa.date32()),
+            ("pagina", pa.int32()),
+            ("estado", pa.string()),
+            ("intentos", pa.int32()),
+            ("inicio", pa.timestamp("s")),
+            ("fin", pa.timestamp("s")),
+            ("duracion", pa.float64()),
+            ("bytes", pa.int64()),
+            ("sha256", pa.string()),
+            ("ruta_archivo", pa.string()),
+            ("error", pa.string()),
+            ("corrida", pa.string()),
+        ]),
+        "corridas": pa.schema([
+            ("corrida", pa.string()),
+            ("modo", pa.string()),
+            ("inicio", pa.timestamp("s")),
+            ("fin", pa.timestamp("s")),
+            ("segundos", pa.float64()),
+            ("fecha_desde", pa.date32()),
+            ("fecha_hasta", pa.date32()),
+            ("resultados", pa.int64()),
+            ("completados", pa.int64()),
+            ("fallidos", pa.int64()),
+            ("bytes", pa.int64()),
+            ("pasos", pa.string()),
+        ]),
+    }
+
+def _fecha_portal(texto):
+    try:
+        return datetime.datetime.strptime(texto, FORMATO_FECHA).date() if texto else None
+    except ValueError:
+        return None
+
+def _escribir_parquet(tabla, ruta):
+    """
+    Escribe la tabla en un archivo temporal y lo mueve a su ruta final, para que un
+    lector nunca vea un archivo a medias.
+    """
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = f"{ruta}.tmp"
+    pq.write_table(tabla, temporal, compression="zstd")
+    os.replace(temporal, ruta)
+
+def exportar_corrida(inicio_corrida, modo, fecha_desde=None, fecha_hasta=None, ruta_manifiesto=RUTA_MANIFIESTO,
+                     directorio=None, pasos=None):
+    """
+    Exporta a Parquet los resultados que tocó la corrida (según el manifiesto) y una fila
+    con el resumen de la corrida, en particiones Hive por mes:
+    
+        <directorio>/resultados/mes=AAAA-MM/corrida-<id>.parquet  (mes de la fecha del resultado)
+        <directorio>/corridas/mes=AAAA-MM/corrida-<id>.parquet    (mes de inicio de la corrida)
+    
+    Se leen con pyarrow.dataset.dataset(ruta, partitioning="hive"), DuckDB o Polars.
+    Al final se compactan los meses que acumulan ARCHIVOS_POR_COMPACTAR archivos.
+    
+    Args:
+        inicio_corrida: datetime de inicio; se exportan las filas iniciadas o terminadas desde entonces
+        modo: Motor usado (secuencial, workers, tramos, http, async, servicio)
+        pasos: Reporte de tiempos por paso (METRICAS.reporte()["pasos"])
+    
+    Returns:
+        Número de resultados exportados
+    """
+    directorio = directorio or DIRECTORIO_PARQUET
+    if not directorio or pa is None:
+        return 0
+    desde_iso = inicio_corrida.isoformat(timespec="seconds")
+    corrida = f"{inicio_corrida.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+    conexion = sqlite3.connect(ruta_manifiesto, timeout=30)
+    conexion.row_factory = sqlite3.Row
+    try:
+        filas = conexion.execute(
+            """SELECT clave, fecha_resultado, examen, fecha_desde, fecha_hasta, pagina, estado, intentos,
+                      inicio, fin, duracion, bytes, sha256, ruta_archivo, error
+               FROM descargas WHERE inicio >= ? OR fin >= ?""",
+            (desde_iso, desde_iso)
+        ).fetchall()
+    finally:
+        conexion.close()
+    
+    esquemas = _esquemas_parquet()
+    por_mes = {}
+    for fila in filas:
+        registro = dict(fila)
+        registro["fecha_resultado"] = datetime.date.fromisoformat(fila["fecha_resultado"]) if fila["fecha_resultado"] else None
+        registro["fecha_desde"] = _fecha_portal(fila["fecha_desde"])
+        registro["fecha_hasta"] = _fecha_portal(fila["fecha_hasta"])
+        for campo in ("inicio", "fin"):
+            registro[campo] = datetime.datetime.fromisoformat(fila[campo]) if fila[campo] else None
+        registro["corrida"] = corrida
+        referencia = registro["fecha_resultado"] or registro["inicio"] or registro["fin"] or inicio_corrida
+        por_mes.setdefault(referencia.strftime("%Y-%m"), []).append(registro)
+    
+    fin_corrida = datetime.datetime.now().replace(microsecond=0)
+    resumen = {
+        "corrida": corrida,
+        "modo": modo,
+        "inicio": inicio_corrida.replace(microsecond=0),
+        "fin": fin_corrida,
+        "segundos": round((fin_corrida - inicio_corrida).total_seconds(), 1),
+        "fecha_desde": _fecha_portal(fecha_desde),
+        "fecha_hasta": _fecha_portal(fecha_hasta),
+        "resultados": len(filas),
+        "completados": sum(1 for f in filas if f["estado"] == "completado"),
+        "fallidos": sum(1 for f in filas if f["estado"] == "fallido"),
+        "bytes": sum(f["bytes"] or 0 for f in filas if f["estado"] == "completado"),
+        "pasos": json.dumps(pasos, ensure_ascii=False) if pasos is not None else None,
+    }
+    
+    try:
+        for mes, registros in por_mes.items():
+            _escribir_parquet(
+                pa.Table.from_pylist(registros, schema=esquemas["resultados"]),
+                os.path.join(directorio, "resultados", f"mes={mes}", f"corrida-{corrida}.parquet")
+            )
+        _escribir_parquet(
+            pa.Table.from_pylist([resumen], schema=esquemas["corridas"]),
+            os.path.join(directorio, "corridas", f"mes={inicio_corrida.strftime('%Y-%m')}", f"corrida-{corrida}.parquet")
+        )
+        logger.info(f"🗃️ Historial Parquet: {len(filas)} resultados de la corrida {corrida} en {directorio}")
+        compactar_parquet(directorio)
+    except OSError as e:
+        logger.error(f"❌ No se pudo exportar el historial a Parquet en {directorio}: {e}")
+    return len(filas)
+
+def compactar_parquet(directorio=None, minimo=ARCHIVOS_POR_COMPACTAR):
+    """
+    Une los archivos por corrida de cada mes con su compactado.parquet anterior, se queda
+    con la versión más reciente de cada resultado (o corrida) y borra los archivos unidos.
+    
+    Args:
+        minimo: Archivos por corrida necesarios para compactar un mes (1 = compactar todos)
+    
+    Returns:
+        Número de meses compactados
+    """
+    directorio = directorio or DIRECTORIO_PARQUET
+    if not directorio or pa is None:
+        return 0
+    esquemas = _esquemas_parquet()
+    compactados = 0
+    for tabla, clave in CLAVES_PARQUET.items():
+        raiz = os.path.join(directorio, tabla)
+        if not os.path.isdir(raiz):
+            continue
+        for particion in sorted(os.listdir(raiz)):
+            carpeta = os.path.join(raiz, particion)
+            # El id de la corrida empieza con su fecha y hora: el orden alfabético es cronológico
+            archivos = sorted(
+                os.path.join(carpeta, nombre) for nombre in os.listdir(carpeta)
+                if nombre.startswith("corrida-") and nombre.endswith(".parquet")
+            )
+            if not archivos or len(archivos) < minimo:
+                continue
+            destino = os.path.join(carpeta, "compactado.parquet")
+            anteriores = [destino] if os.path.exists(destino) else []
+            ultimas = {}
+            for ruta in anteriores + archivos:
+                for fila in pq.read_table(ruta).to_pylist():
+                    ultimas[fila[clave]] = fila
+            unida = pa.Table.from_pylist(list(ultimas.values()), schema=esquemas[tabla])
+            orden = "fecha_resultado" if tabla == "resultados" else "inicio"
+            _escribir_parquet(unida.sort_by([(orden, "ascending"), (clave, "ascending")]), destino)
+            for ruta in archivos:
+                os.remove(ruta)
+            compactados += 1
+            logger.info(f"🗜️ {tabla}/{particion}: {len(archivos)} archivos compactados ({unida.num_rows} filas)")
+    return compactados
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Configurar fechas en el sistema de laboratorio')
+    parser.add_argument('--username', type=str, default="-1", help='Número de documento/usuario')
+    parser.add_argument('--password', type=str, default="-1", help='Contraseña')
+    parser.add_argument('--desde', type=str, help='Fecha desde (DD/MM/AAAA)')
+    parser.add_argument('--hasta', type=str, help='Fecha hasta (DD/MM/AAAA)')
+    parser.add_argument('--no-descargar', action='store_true', help='No descargar resultados automáticamente')
+    parser.add_argument('--enumerate', nargs='?', const=RUTA_LISTADO, metavar='ARCHIVO',
+                        help=f'Solo listar los resultados (conteo por día, claves, páginas) sin descargar (default: {RUTA_LISTADO}); '
+                             'con --lean el recorrido es más rápido')
+    parser.add_argument('--reintentos', type=int, default=3, help='Número máximo de reintentos para descargar resultados')
+    parser.add_argument('--headless', action='store_true', help='Ejecutar en modo headless (sin interfaz gráfica)')
+    parser.add_argument('--limite-espera', action='append', metavar='PASO=SEG',
+                        help=f'Techo de espera por paso, repetible ({", ".join(LIMITES_ESPERA)})')
+    parser.add_argument('--workers', type=int, default=1, help='Número de sesiones de Chrome en paralelo para descargar')
+    parser.add_argument('--particion', choices=['dia', 'semana', 'adaptativo'],
+                        help='Dividir el rango de fechas en tramos procesados en procesos independientes')
+    parser.add_argument('--procesos', type=int, default=2, help='Número de procesos simultáneos con --particion')
+    parser.add_argument('--max-paginas-tramo', type=int, default=5,
+                        help='Con --particion adaptativo, páginas máximas por tramo antes de dividirlo')
+    parser.add_argument('--salida', type=str, help='Directorio donde se guardan los resultados descargados')
+    parser.add_argument('--url-pdf', type=str,
+                        help='Plantilla de URL del PDF ({clave} = CTLCOD) para descargar por HTTP directo')
+    parser.add_argument('--conexiones', type=int, default=8, help='Descargas HTTP simultáneas con --url-pdf')
+    parser.add_argument('--sesiones-async', type=int, default=0,
+                        help='Usar el motor asíncrono (Playwright) con este número de sesiones en un solo proceso')
+    parser.add_argument('--manifiesto', type=str, default=RUTA_MANIFIESTO,
+                        help='Archivo SQLite que registra las descargas y permite reanudar')
+    parser.add_argument('--url', type=str, default=URL_PORTAL,
+                        help='URL de la página de login (p. ej. la de Simulador_LabNancy.py)')
+    parser.add_argument('--servicio', action='store_true',
+                        help='Ejecutar como servicio: descargar periódicamente solo lo nuevo desde la última marca')
+    parser.add_argument('--intervalo', type=float, default=60, help='Minutos entre ciclos con --servicio')
+    parser.add_argument('--solapamiento', type=int, default=3,
+                        help='Días anteriores a la marca que se vuelven a revisar en cada ciclo de --servicio')
+    parser.add_argument('--cache-sesiones', type=str, default=RUTA_CACHE_SESIONES,
+                        help='Carpeta donde se guarda la sesión cifrada de cada usuario para no repetir el login')
+    parser.add_argument('--sin-cache-sesiones', action='store_true', help='Iniciar sesión siempre, sin caché')
+    parser.add_argument('--extraer-jsonl', type=str, help='Extraer los datos de cada PDF descargado a este archivo JSONL')
+    parser.add_argument('--extraer-db', type=str, help='Extraer los datos de cada PDF descargado a esta base SQLite')
+    parser.add_argument('--procesos-extraccion', type=int, default=2, help='Procesos para extraer datos de los PDF')
+    parser.add_argument('--lean', action='store_true',
+                        help='Perfil ligero: sin imágenes, fuentes ni analítica, carga "eager" y headless nuevo')
+    parser.add_argument('--metricas-json', type=str, help='Archivo donde guardar el reporte de tiempos por paso (JSON)')
+    parser.add_argument('--metricas-prom', type=str,
+                        help='Archivo .prom para el textfile collector de Prometheus con los histogramas por paso')
+    parser.add_argument('--tasa', type=float,
+                        help='Máximo de acciones por segundo contra el portal entre todos los trabajadores')
+    parser.add_argument('--rafaga', type=int, help='Acciones seguidas permitidas con --tasa (default: la tasa)')
+    parser.add_argument('--pestanas', type=int, default=1,
+                        help='Detalles de resultados que cada navegador abre y avanza a la vez en pestañas separadas')
+    parser.add_argument('--url-detalle', type=str,
+                        help='Plantilla de URL del detalle ({clave} = CTLCOD) para --pestanas; por defecto se descubre con el primer "Ver"')
+    parser.add_argument('--esperas-fijas', action='store_true',
+                        help='No ajustar las esperas a la latencia del portal; usar siempre LIMITES_ESPERA')
+    parser.add_argument('--parquet', type=str,
+                        help='Carpeta donde se exporta el historial de resultados y corridas en Parquet (particionado por mes)')
+    parser.add_argument('--compactar-parquet', action='store_true',
+                        help='Compactar todos los meses del historial Parquet en un archivo por mes y terminar')
+    
+    args = parser.parse_args()
+    URL_PORTAL = args.url
+    configurar_cache_sesiones(None if args.sin_cache_sesiones else args.cache_sesiones)
+    configurar_metricas(args.metricas_json, args.metricas_prom)
+    configurar_parquet(args.parquet)
+    LATENCIA.activa = not args.esperas_fijas
+    LIMITADOR.configurar(args.tasa, args.rafaga)
+    configurar_pestanas(args.pestanas, args.url_detalle)
+    inicio_corrida = datetime.datetime.now()
+    
+    if args.compactar_parquet:
+        compactar_parquet(minimo=1)
+        sys.exit(0)
+    
+    # La extracción de datos corre mientras se descarga; necesita un directorio de descargas conocido
+    procesador = None
+    if args.extraer_jsonl or args.extraer_db:
+        args.salida = args.salida or DIRECTORIO_SALIDA
+        procesador = ProcesadorPDF(args.salida, args.extraer_jsonl, args.extraer_db, args.procesos_extraccion).iniciar()
+    
+    corrida_finalizada = False
+    
+    def finalizar_corrida():
+        """
+        Cierra la corrida una sola vez: resumen de métricas, exportación a Parquet y fin
+        de la extracción de datos.
+        """
+        global corrida_finalizada
+        if corrida_finalizada:
+            return
+        corrida_finalizada = True
+        METRICAS.log_resumen()
+        LATENCIA.log_resumen()
+        METRICAS.exportar()
+        if not args.servicio and not args.no_descargar and not args.enumerate:
+            if args.sesiones_async:
+                modo = "async"
+            elif args.url_pdf:
+                modo = "http"
+            elif args.particion:
+                modo = "tramos"
+            elif args.workers > 1:
+                modo = "workers"
+            else:
+                modo = "secuencial"
+            exportar_corrida(inicio_corrida, modo, args.desde, args.hasta, args.manifiesto, pasos=METRICAS.reporte()["pasos"])
+        if procesador:
+            procesador.detener()
+    
+    if args.enumerate:
+        enumerar_resultados(
+            username=args.username,
+            password=args.password,
+            fecha_desde=args.desde,
+            fecha_hasta=args.hasta,
+            headless=args.headless,
+            limites_espera=args.limite_espera,
+            ruta_listado=args.enumerate,
+            ruta_manifiesto=args.manifiesto,
+            ligero=args.lean
+        )
+    elif args.servicio:
+        ejecutar_servicio(
+            username=args.username,
+            password=args.password,
+            intervalo=args.intervalo,
+            fecha_desde=args.desde,
+            solapamiento=args.solapamiento,
+            max_reintentos=args.reintentos,
+            headless=args.headless,
+            limites_espera=args.limite_espera,
+            directorio_descargas=args.salida,
+            ruta_manifiesto=args.manifiesto,
+            ligero=args.lean
+        )
+    elif args.sesiones_async and not args.no_descargar:
+        asyncio.run(descargar_async(
+            username=args.username,
+            password=args.password,
+            fecha_desde=args.desde,
+            fecha_hasta=args.hasta,
+            sesiones=args.sesiones_async,
+            max_reintentos=args.reintentos,
+            headless=args.headless,
+            limites_espera=args.limite_espera,
+            directorio_descargas=args.salida,
+            ruta_manifiesto=args.manifiesto,
+            ligero=args.lean
+        ))
+    elif args.url_pdf and not args.no_descargar:
+        descargar_por_http(
+            username=args.username,
+            password=args.password,
+            fecha_desde=args.desde,
+            fecha_hasta=args.hasta,
+            url_pdf=args.url_pdf,
+            conexiones=args.conexiones,
+            headless=args.headless,
+            limites_espera=args.limite_espera,
+            directorio_descargas=args.salida,
+            ruta_manifiesto=args.manifiesto,
+            ligero=args.lean
+        )
+    elif args.particion and not args.no_descargar:
+        descargar_por_tramos(
+            username=args.username,
+            password=args.password,
+            fecha_desde=args.desde,
+            fecha_hasta=args.hasta,
+            particion=args.particion,
+            procesos=args.procesos,
+            max_reintentos=args.reintentos,
+            headless=args.headless,
+            limites_espera=args.limite_espera,
+            directorio_descargas=args.salida,
+            max_paginas_tramo=args.max_paginas_tramo,
+            ruta_manifiesto=args.manifiesto,
+            ligero=args.lean
+        )
+    elif args.workers > 1 and not args.no_descargar:
+        # Identificar el trabajador en cada línea del log
+        for handler in logging.getLogger().handlers:
+            handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - [%(threadName)s] %(message)s'))
+        descargar_en_paralelo(
+            username=args.username,
+            password=args.password,
+            fecha_desde=args.desde,
+            fecha_hasta=args.hasta,
+            trabajadores=args.workers,
+            max_reintentos=args.reintentos,
+            headless=args.headless,
+            limites_espera=args.limite_espera,
+            directorio_descargas=args.salida,
+            ruta_manifiesto=args.manifiesto,
+            ligero=args.lean
+        )
+    else:
+        # La corrida se cierra al terminar la descarga, no cuando el usuario cierra el navegador
+        configurar_sistema(
+            username=args.username,
+            password=args.password,
+            fecha_desde=args.desde,
+            fecha_hasta=args.hasta,
+            descargar_resultados=not args.no_descargar,
+            max_reintentos=args.reintentos,
+            headless=args.headless,
+            limites_espera=args.limite_espera,
+            directorio_descargas=args.salida,
+            ruta_manifiesto=args.manifiesto,
+            ligero=args.lean,
+            mantener_abierto=not args.headless,
+            al_terminar=finalizar_corrida
+        )
     
-    configurar_sistema(
-        username=args.username,
-        password=args.password,
-        fecha_desde=args.desde,
-        fecha_hasta=args.hasta,
-        descargar_resultados=not args.no_descargar,
-        max_reintentos=args.reintentos,
-        headless=args.headless
-    )
\ No newline at end of file
+    finalizar_corrida()
@@ -0,0 +1,431 @@
+"""
+Portal de laboratorio simulado para probar y medir Descargar_LabNancy.py sin tocar el
+portal real.
+
+Reproduce el contrato del DOM del que depende el script: login (vTIPO, vTIPODCTO_COD,
+vNUM_DOC, SIGUIENTE, vPASSWORD, INGRESAR), criterio y rango de fechas (vCRITERIO,
+vDESDEFEC, vHASFEC, IMAGE5), listado con enlaces span_CTLVER_*, iframe de detalle con
+IMPRIMIR / DESCARGAR / VOLVER / CANCEL y paginación con .PagingButtonsNext. Las cargas
+dinámicas usan XMLHttpRequest y muestran gx_ajax_notification como lo hace GeneXus.
+
+Uso:
+    python Simulador_LabNancy.py --puerto 8765 --resultados 200 --latencia 150
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import argparse
+import datetime
+import json
+import logging
+import random
+import secrets
+import sys
+import threading
+import time
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler(sys.stdout)
+    ]
+)
+
+logger = logging.getLogger(__name__)
+
+class ConfiguracionSimulador:
+    """
+    Parámetros del portal simulado.
+
+    Args:
+        resultados: Número total de resultados disponibles
+        por_pagina: Resultados por página del listado
+        latencia: Latencia media de cada respuesta (en milisegundos)
+        variacion: Variación aleatoria de la latencia (en milisegundos)
+        tamano_pdf: Tamaño de cada PDF (en bytes)
+        fecha_desde / fecha_hasta: Fechas (DD/MM/AAAA) entre las que se reparten los resultados
+        alerta: Si es True, DESCARGAR muestra una alerta JavaScript
+        duracion_sesion: Segundos de inactividad tras los que vence la sesión (0 = nunca)
+    """
+
+    def __init__(self, resultados=50, por_pagina=10, latencia=100, variacion=50, tamano_pdf=50_000,
+                 fecha_desde=None, fecha_hasta=None, alerta=False, duracion_sesion=0, usuario=None, clave=None):
+        hoy = datetime.date.today()
+        self.resultados = resultados
+        self.por_pagina = por_pagina
+        self.latencia = latencia
+        self.variacion = variacion
+        self.tamano_pdf = tamano_pdf
+        self.fecha_desde = fecha_desde or hoy.replace(day=1).strftime("%d/%m/%Y")
+        self.fecha_hasta = fecha_hasta or hoy.strftime("%d/%m/%Y")
+        self.alerta = alerta
+        self.duracion_sesion = duracion_sesion
+        self.usuario = usuario
+        self.clave = clave
+
+def generar_resultados(config):
+    """
+    Genera resultados deterministas repartidos uniformemente entre las fechas configuradas.
+
+    Returns:
+        Lista de diccionarios {clave, fecha (date), examen} ordenada por fecha
+    """
+    inicio = datetime.datetime.strptime(config.fecha_desde, "%d/%m/%Y").date()
+    fin = datetime.datetime.strptime(config.fecha_hasta, "%d/%m/%Y").date()
+    dias = (fin - inicio).days + 1
+    examenes = ["HEMOGRAMA", "GLICEMIA", "PERFIL LIPIDICO", "CARGA VIRAL", "CD4", "CREATININA"]
+    resultados = []
+    for i in range(config.resultados):
+        resultados.append({
+            "clave": f"{100000 + i}",
+            "fecha": inicio + datetime.timedelta(days=(i * dias) // max(config.resultados, 1)),
+            "examen": examenes[i % len(examenes)],
+        })
+    return resultados
+
+PAGINA_LOGIN = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Portal de resultados (simulado)</title>
+<script>
+function ajax(url, alTerminar) {
+    var aviso = document.getElementById('gx_ajax_notification');
+    aviso.style.display = 'block';
+    var xhr = new XMLHttpRequest();
+    xhr.open('GET', url);
+    xhr.onload = function() { aviso.style.display = 'none'; alTerminar(xhr); };
+    xhr.send();
+}
+function cambiarTipo() {
+    ajax('/api/tipos_documento?tipo=' + document.getElementById('vTIPO').value, function(xhr) {
+        var select = document.getElementById('vTIPODCTO_COD');
+        select.innerHTML = '';
+        JSON.parse(xhr.responseText).forEach(function(op) {
+            var o = document.createElement('option'); o.value = op[0]; o.text = op[1]; select.appendChild(o);
+        });
+    });
+}
+function siguiente() {
+    ajax('/api/siguiente', function() { document.getElementById('paso_clave').style.display = 'block'; });
+}
+function ingresar() {
+    var url = '/api/login?usuario=' + encodeURIComponent(document.getElementById('vNUM_DOC').value)
+        + '&clave=' + encodeURIComponent(document.getElementById('vPASSWORD').value);
+    ajax(url, function(xhr) {
+        if (xhr.status === 200) { window.location = '/principal'; }
+        else { document.getElementById('error').innerText = 'Usuario o contraseña inválidos'; }
+    });
+}
+</script></head>
+<body>
+<div id="gx_ajax_notification" style="display:none">Procesando...</div>
+<select id="vTIPO" onchange="cambiarTipo()"><option value="">Seleccione</option><option value="P">Persona</option><option value="E">Empresa</option></select>
+<select id="vTIPODCTO_COD"></select>
+<input id="vNUM_DOC" type="text">
+<input id="SIGUIENTE" type="button" value="Siguiente" onclick="siguiente()">
+<div id="paso_clave" style="display:none">
+  <input id="vPASSWORD" type="password">
+  <input id="INGRESAR" type="button" value="Ingresar" onclick="ingresar()">
+</div>
+<div id="error"></div>
+</body></html>
+"""
+
+PAGINA_PRINCIPAL = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Consulta de resultados (simulado)</title>
+<style>.PagingButtonsNext[disabled] { opacity: 0.5; }</style>
+<script>
+var paginaActual = 1;
+function ajax(url, alTerminar) {
+    var aviso = document.getElementById('gx_ajax_notification');
+    aviso.style.display = 'block';
+    var xhr = new XMLHttpRequest();
+    xhr.open('GET', url);
+    xhr.onload = function() {
+        aviso.style.display = 'none';
+        if (xhr.status === 401) { window.location = '/'; return; }
+        alTerminar(xhr);
+    };
+    xhr.send();
+}
+function buscar() { cargarPagina(1); }
+function cargarPagina(pagina) {
+    var url = '/api/listado?desde=' + encodeURIComponent(document.getElementById('vDESDEFEC').value)
+        + '&hasta=' + encodeURIComponent(document.getElementById('vHASFEC').value) + '&pagina=' + pagina;
+    ajax(url, function(xhr) {
+        var datos = JSON.parse(xhr.responseText);
+        paginaActual = datos.pagina;
+        var cuerpo = document.getElementById('GridresultadosContainerTbl');
+        cuerpo.innerHTML = '';
+        datos.filas.forEach(function(fila, i) {
+            var n = ('0000' + (i + 1)).slice(-4);
+            var tr = document.createElement('tr');
+            tr.innerHTML = '<td id="span_CTLCOD_' + n + '">' + fila.clave + '</td>'
+                + '<td id="span_CTLFEC_' + n + '">' + fila.fecha + '</td>'
+                + '<td id="span_CTLEXA_' + n + '">' + fila.examen + '</td>'
+                + '<td><span id="span_CTLVER_' + n + '"><a href="javascript:void(0)" data-clave="' + fila.clave
+                + '" onclick="verDetalle(this.getAttribute(\\'data-clave\\'))">Ver</a></span></td>';
+            cuerpo.appendChild(tr);
+        });
+        document.getElementById('paginas').style.display = datos.paginas > 0 ? 'block' : 'none';
+        var numeros = document.getElementById('numeros');
+        numeros.innerHTML = '';
+        for (var p = Math.max(1, paginaActual - 4); p <= Math.min(datos.paginas, paginaActual + 5); p++) {
+            var a = document.createElement('a');
+            a.href = 'javascript:void(0)'; a.innerText = '' + p;
+            a.setAttribute('onclick', 'cargarPagina(' + p + ')');
+            numeros.appendChild(a);
+        }
+        document.getElementById('siguiente').disabled = paginaActual >= datos.paginas;
+    });
+}
+function verDetalle(clave) {
+    var iframe = document.createElement('iframe');
+    iframe.id = 'detalle';
+    iframe.src = '/detalle?clave=' + encodeURIComponent(clave);
+    iframe.style.width = '100%'; iframe.style.height = '300px';
+    document.getElementById('contenedor_detalle').appendChild(iframe);
+}
+function cerrarDetalle() { document.getElementById('contenedor_detalle').innerHTML = ''; }
+</script></head>
+<body>
+<div id="gx_ajax_notification" style="display:none">Procesando...</div>
+<iframe id="encabezado" src="/encabezado" style="height:40px;width:100%"></iframe>
+<select id="vCRITERIO"><option value="0">DOCUMENTO</option><option value="1">RANGO FECHAS</option></select>
+<input id="vDESDEFEC" type="text"><input id="vHASFEC" type="text">
+<input id="IMAGE5" type="button" value="Buscar" onclick="buscar()">
+<table><thead><tr><th>Código</th><th>Fecha</th><th>Examen</th><th></th></tr></thead>
+<tbody id="GridresultadosContainerTbl"></tbody></table>
+<div id="paginas" class="GridPaging" style="display:none">
+  <span id="numeros"></span>
+  <button id="siguiente" class="PagingButtonsNext" onclick="cargarPagina(paginaActual + 1)">Siguiente</button>
+</div>
+<div id="contenedor_detalle"></div>
+</body></html>
+"""
+
+PAGINA_DETALLE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Detalle</title>
+<script>
+function imprimir() {
+    document.getElementById('detalle').style.display = 'none';
+    document.getElementById('impresion').style.display = 'block';
+}
+function descargar() {
+    window.location = '/pdf?clave=%(clave)s';
+    %(alerta)s
+}
+function volver() {
+    document.getElementById('impresion').style.display = 'none';
+    document.getElementById('detalle').style.display = 'block';
+}
+</script></head>
+<body>
+<div id="detalle">
+  <p>Resultado %(clave)s</p>
+  %(imprimir)s
+  <input id="CANCEL" type="button" value="Volver" onclick="parent.cerrarDetalle()">
+</div>
+<div id="impresion" style="display:none">
+  <input id="DESCARGAR" type="button" value="Descargar" onclick="descargar()">
+  <input id="VOLVER" type="button" value="Volver" onclick="volver()">
+</div>
+</body></html>
+"""
+
+def generar_pdf(clave, tamano):
+    """
+    Genera un PDF mínimo válido de aproximadamente `tamano` bytes.
+    """
+    lineas = [
+        f"Resultado {clave}",
+        f"Paciente: PACIENTE SIMULADO {clave}",
+        f"Documento: {clave}",
+        "Examen: QUIMICA SANGUINEA",
+        "Fecha de toma: 01/01/2026",
+        f"GLUCOSA   {70 + int(clave) % 60}  mg/dL   70 - 110",
+        f"CREATININA   {0.5 + (int(clave) % 10) / 10:.1f}  mg/dL   0.6 - 1.2",
+    ] if clave.isdigit() else [f"Resultado {clave}"]
+    texto = " ".join(f"({linea}) Tj 0 -16 Td" for linea in lineas)
+    contenido = f"BT /F1 12 Tf 72 720 Td {texto} ET".encode("latin-1")
+    cuerpo = (
+        b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+        b"2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n"
+        b"3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 612 792]/Contents 4 0 R"
+        b"/Resources<</Font<</F1 5 0 R>>>>>>endobj\n"
+        b"5 0 obj<</Type/Font/Subtype/Type1/BaseFont/Helvetica>>endobj\n"
+        + f"4 0 obj<</Length {len(contenido)}>>stream\n".encode("latin-1") + contenido + b"\nendstream endobj\n"
+    )
+    relleno = max(0, tamano - len(cuerpo) - 32)
+    return cuerpo + b"%" + b"0" * relleno + b"\ntrailer<</Root 1 0 R>>\n%%EOF\n"
+
+class ManejadorSimulador(BaseHTTPRequestHandler):
+    """
+    Atiende las páginas y las llamadas AJAX del portal simulado.
+    """
+    config = None
+    resultados = []
+    sesiones = {}
+    lock = threading.Lock()
+    estadisticas = {"peticiones": 0, "pdf": 0, "bytes_pdf": 0}
+
+    def log_message(self, formato, *args):
+        logger.debug(formato % args)
+
+    def _latencia(self):
+        demora = self.config.latencia + random.uniform(-self.config.variacion, self.config.variacion)
+        time.sleep(max(0, demora) / 1000)
+
+    def _responder(self, cuerpo, tipo="text/html; charset=utf-8", estado=200, cabeceras=None):
+        if isinstance(cuerpo, str):
+            cuerpo = cuerpo.encode("utf-8")
+        self.send_response(estado)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(cuerpo)))
+        for nombre, valor in (cabeceras or {}).items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def _sesion_valida(self):
+        cookie = self.headers.get("Cookie", "")
+        for parte in cookie.split(";"):
+            nombre, _, valor = parte.strip().partition("=")
+            if nombre == "SIMSESSION":
+                with self.lock:
+                    ultimo_uso = self.sesiones.get(valor)
+                    if ultimo_uso is None:
+                        return False
+                    if self.config.duracion_sesion and time.time() - ultimo_uso > self.config.duracion_sesion:
+                        del self.sesiones[valor]
+                        return False
+                    self.sesiones[valor] = time.time()
+                    return True
+        return False
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parametros = {clave: valores[0] for clave, valores in parse_qs(url.query).items()}
+        with self.lock:
+            self.estadisticas["peticiones"] += 1
+        self._latencia()
+
+        if url.path == "/":
+            return self._responder(PAGINA_LOGIN)
+        if url.path == "/api/tipos_documento":
+            opciones = [["NI", "NIT"], ["CC", "Cédula"]] if parametros.get("tipo") == "E" else [["CC", "Cédula"]]
+            return self._responder(json.dumps(opciones), "application/json")
+        if url.path == "/api/siguiente":
+            return self._responder("{}", "application/json")
+        if url.path == "/api/login":
+            if (self.config.usuario and parametros.get("usuario") != self.config.usuario) or \
+               (self.config.clave and parametros.get("clave") != self.config.clave):
+                return self._responder("{}", "application/json", 403)
+            token = secrets.token_hex(16)
+            with self.lock:
+                self.sesiones[token] = time.time()
+            return self._responder("{}", "application/json", cabeceras={"Set-Cookie": f"SIMSESSION={token}; Path=/"})
+
+        # El resto de rutas requiere una sesión iniciada
+        if not self._sesion_valida():
+            if url.path.startswith("/api/"):
+                return self._responder("{}", "application/json", 401)
+            return self._responder("", estado=302, cabeceras={"Location": "/"})
+
+        if url.path == "/principal":
+            return self._responder(PAGINA_PRINCIPAL)
+        if url.path == "/encabezado":
+            return self._responder("<html><body>Laboratorio (simulado)</body></html>")
+        if url.path == "/api/listado":
+            return self._listado(parametros)
+        if url.path == "/detalle":
+            clave = parametros.get("clave", "")
+            sin_pdf = clave.endswith("7")  # Algunos resultados no tienen PDF (solo CANCEL)
+            return self._responder(PAGINA_DETALLE % {
+                "clave": clave,
+                "alerta": "alert('Descarga iniciada');" if self.config.alerta else "",
+                "imprimir": "" if sin_pdf else '<input id="IMPRIMIR" type="button" value="Descargar Resultados" onclick="imprimir()">',
+            })
+        if url.path == "/pdf":
+            clave = parametros.get("clave", "")
+            pdf = generar_pdf(clave, self.config.tamano_pdf)
+            with self.lock:
+                self.estadisticas["pdf"] += 1
+                self.estadisticas["bytes_pdf"] += len(pdf)
+            return self._responder(pdf, "application/pdf", cabeceras={
+                "Content-Disposition": f'attachment; filename="resultado_{clave}.pdf"'
+            })
+        return self._responder("No encontrado", estado=404)
+
+    def _listado(self, parametros):
+        try:
+            desde = datetime.datetime.strptime(parametros.get("desde", ""), "%d/%m/%Y").date()
+            hasta = datetime.datetime.strptime(parametros.get("hasta", ""), "%d/%m/%Y").date()
+        except ValueError:
+            return self._responder(json.dumps({"filas": [], "pagina": 1, "paginas": 0}), "application/json")
+        filas = [r for r in self.resultados if desde <= r["fecha"] <= hasta]
+        paginas = (len(filas) + self.config.por_pagina - 1) // self.config.por_pagina
+        pagina = min(max(1, int(parametros.get("pagina", 1))), max(paginas, 1))
+        inicio = (pagina - 1) * self.config.por_pagina
+        datos = {
+            "pagina": pagina,
+            "paginas": paginas,
+            "filas": [
+                {"clave": r["clave"], "fecha": r["fecha"].strftime("%d/%m/%Y"), "examen": r["examen"]}
+                for r in filas[inicio:inicio + self.config.por_pagina]
+            ],
+        }
+        return self._responder(json.dumps(datos), "application/json")
+
+def iniciar_simulador(config, puerto=0):
+    """
+    Inicia el portal simulado en un hilo de fondo.
+
+    Returns:
+        Tupla (servidor, url base). Llamar a servidor.shutdown() para detenerlo.
+    """
+    manejador = type("Manejador", (ManejadorSimulador,), {
+        "config": config,
+        "resultados": generar_resultados(config),
+        "sesiones": {},
+        "lock": threading.Lock(),
+        "estadisticas": {"peticiones": 0, "pdf": 0, "bytes_pdf": 0},
+    })
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto), manejador)
+    servidor.daemon_threads = True
+    hilo = threading.Thread(target=servidor.serve_forever, name="simulador", daemon=True)
+    hilo.start()
+    url = f"http://127.0.0.1:{servidor.server_address[1]}/"
+    logger.info(f"🧪 Portal simulado en {url} ({config.resultados} resultados, {config.por_pagina} por página)")
+    return servidor, url
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Portal de laboratorio simulado para pruebas locales')
+    parser.add_argument('--puerto', type=int, default=8765, help='Puerto HTTP')
+    parser.add_argument('--resultados', type=int, default=50, help='Número total de resultados')
+    parser.add_argument('--por-pagina', type=int, default=10, help='Resultados por página del listado')
+    parser.add_argument('--latencia', type=float, default=100, help='Latencia media por petición (ms)')
+    parser.add_argument('--variacion', type=float, default=50, help='Variación aleatoria de la latencia (ms)')
+    parser.add_argument('--tamano-pdf', type=int, default=50_000, help='Tamaño de cada PDF (bytes)')
+    parser.add_argument('--desde', type=str, help='Fecha del primer resultado (DD/MM/AAAA)')
+    parser.add_argument('--hasta', type=str, help='Fecha del último resultado (DD/MM/AAAA)')
+    parser.add_argument('--alerta', action='store_true', help='Mostrar una alerta JavaScript al descargar')
+    parser.add_argument('--duracion-sesion', type=float, default=0, help='Segundos de inactividad hasta que vence la sesión')
+
+    args = parser.parse_args()
+
+    servidor, url = iniciar_simulador(ConfiguracionSimulador(
+        resultados=args.resultados,
+        por_pagina=args.por_pagina,
+        latencia=args.latencia,
+        variacion=args.variacion,
+        tamano_pdf=args.tamano_pdf,
+        fecha_desde=args.desde,
+        fecha_hasta=args.hasta,
+        alerta=args.alerta,
+        duracion_sesion=args.duracion_sesion,
+    ), args.puerto)
+    logger.info("Presione Ctrl+C para detener el simulador.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        servidor.shutdown()
@@ -0,0 +1,212 @@
+"""
+Pruebas de Cargar_LabNancy.py con una base MySQL simulada en memoria.
+
+BaseSimulada interpreta solo las sentencias que emite el cargador (catálogos, lectura
+de conteos existentes, INSERT multi-fila ... ON DUPLICATE KEY UPDATE en
+daily_appointments y el recálculo de monthly_projections), con la misma semántica de
+claves únicas que estadistica/database/schema.sql.
+"""
+import datetime
+import sqlite3
+from collections import Counter
+
+import pytest
+
+import Cargar_LabNancy as cargador
+
+D = datetime.date
+
+
+class CursorSimulado:
+    def __init__(self, base):
+        self.base = base
+        self.filas = []
+
+    def execute(self, sql, parametros=()):
+        self.base.sentencias.append((sql, list(parametros)))
+        self.filas = self.base.ejecutar(" ".join(sql.split()), list(parametros))
+
+    def fetchall(self):
+        return self.filas
+
+    def close(self):
+        pass
+
+
+class BaseSimulada:
+    def __init__(self, eps=None, especialidades=None, periodos=None):
+        self.eps = eps or [(1, "Nueva EPS")]
+        self.especialidades = especialidades or [(1, "Laboratorios"), (2, "Hematología")]
+        self.periodos = periodos or [(1, D(2025, 1, 1), D(2025, 12, 31))]
+        self.diarios = {}
+        self.mensuales = {}
+        self.sentencias = []
+        self.confirmada = False
+        self.revertida = False
+
+    def cursor(self):
+        return CursorSimulado(self)
+
+    def commit(self):
+        self.confirmada = True
+
+    def rollback(self):
+        self.revertida = True
+
+    def close(self):
+        pass
+
+    def ejecutar(self, sql, p):
+        if sql.startswith("SELECT id, name FROM eps"):
+            return self.eps
+        if sql.startswith("SELECT id, name FROM specialties"):
+            return self.especialidades
+        if sql.startswith("SELECT id, start_date, end_date FROM annual_periods"):
+            return self.periodos
+        if sql.startswith("SELECT appointment_date, appointments_count FROM daily_appointments"):
+            eps_id, periodo_id, especialidad_id, desde, hasta = p
+            return [
+                (fecha, cantidad) for (e, per, esp, fecha), cantidad in self.diarios.items()
+                if (e, per, esp) == (eps_id, periodo_id, especialidad_id) and desde <= fecha <= hasta
+            ]
+        if sql.startswith("INSERT INTO daily_appointments"):
+            assert "ON DUPLICATE KEY UPDATE" in sql
+            for i in range(0, len(p), 5):
+                eps_id, periodo_id, especialidad_id, fecha, cantidad = p[i:i + 5]
+                self.diarios[(eps_id, periodo_id, especialidad_id, fecha)] = cantidad
+            return []
+        if sql.startswith("INSERT INTO monthly_projections"):
+            eps_id, periodo_id, especialidad_id, anio, mes = p
+            inicio, fin = next((i, f) for id_, i, f in self.periodos if id_ == periodo_id)
+            total = sum(
+                cantidad for (e, per, esp, fecha), cantidad in self.diarios.items()
+                if (e, per, esp) == (eps_id, periodo_id, especialidad_id)
+                and fecha.year == anio and fecha.month == mes and inicio <= fecha <= fin
+            )
+            self.mensuales[(eps_id, periodo_id, especialidad_id, mes)] = total
+            return []
+        raise AssertionError(f"Sentencia no esperada: {sql}")
+
+
+class PoolSimulado:
+    def __init__(self, base):
+        self.base = base
+
+    def get_connection(self):
+        return self.base
+
+
+@pytest.fixture
+def manifiesto(tmp_path):
+    ruta = tmp_path / "manifiesto.db"
+    conexion = sqlite3.connect(ruta)
+    conexion.execute("CREATE TABLE descargas (clave TEXT, estado TEXT, fecha_resultado TEXT, examen TEXT)")
+    conexion.executemany("INSERT INTO descargas VALUES (?, ?, ?, ?)", [
+        ("1", "completado", "2025-03-01", "GLUCOSA"),
+        ("2", "completado", "2025-03-01", "HEMOGRAMA"),
+        ("3", "completado", "2025-03-02", "GLUCOSA"),
+        ("4", "fallido", "2025-03-02", "GLUCOSA"),
+        ("5", "completado", None, "GLUCOSA"),
+        ("6", "sin_pdf", "2025-03-02", "HEMOGRAMA"),
+    ])
+    conexion.commit()
+    conexion.close()
+    return str(ruta)
+
+
+def test_leer_resultados_solo_completados_con_fecha(manifiesto):
+    assert sorted(cargador.leer_resultados(manifiesto)) == [
+        (D(2025, 3, 1), "GLUCOSA"), (D(2025, 3, 1), "HEMOGRAMA"), (D(2025, 3, 2), "GLUCOSA"),
+        (D(2025, 3, 2), "HEMOGRAMA"),
+    ]
+    assert sorted(cargador.leer_resultados(manifiesto, desde=D(2025, 3, 2))) == [
+        (D(2025, 3, 2), "GLUCOSA"), (D(2025, 3, 2), "HEMOGRAMA"),
+    ]
+
+
+def test_periodo_de():
+    periodos = [(1, D(2024, 7, 1), D(2025, 6, 30)), (2, D(2025, 7, 1), D(2026, 6, 30))]
+    assert cargador.periodo_de(D(2025, 6, 30), periodos) == 1
+    assert cargador.periodo_de(D(2025, 7, 1), periodos) == 2
+    assert cargador.periodo_de(D(2027, 1, 1), periodos) is None
+
+
+def test_especialidad_de():
+    mapa = {r"hemo": "Hematología"}
+    assert cargador.especialidad_de("HEMOGRAMA", mapa, "Laboratorios") == "Hematología"
+    assert cargador.especialidad_de("GLUCOSA", mapa, "Laboratorios") == "Laboratorios"
+    assert cargador.especialidad_de(None, mapa, "Laboratorios") == "Laboratorios"
+
+
+def test_agregar_conteos():
+    resultados = [
+        (D(2025, 3, 1), "GLUCOSA"), (D(2025, 3, 1), "GLUCOSA"),
+        (D(2025, 3, 1), "HEMOGRAMA"), (D(2030, 1, 1), "GLUCOSA"),
+    ]
+    conteos, omitidos = cargador.agregar_conteos(
+        resultados, 7, {"laboratorios": 1, "hematología": 2}, [(1, D(2025, 1, 1), D(2025, 12, 31))],
+        {r"hemo": "Hematología"}
+    )
+    assert conteos == Counter({(7, 1, 1, D(2025, 3, 1)): 2, (7, 1, 2, D(2025, 3, 1)): 1})
+    assert omitidos == 1
+
+
+def test_agregar_conteos_omite_especialidad_desconocida():
+    conteos, omitidos = cargador.agregar_conteos(
+        [(D(2025, 3, 1), "GLUCOSA")], 1, {}, [(1, D(2025, 1, 1), D(2025, 12, 31))]
+    )
+    assert not conteos and omitidos == 1
+
+
+def test_escribir_diarios_por_lotes():
+    base = BaseSimulada()
+    conteos = Counter({(1, 1, 1, D(2025, 3, dia)): dia for dia in range(1, 6)})
+    cargador.escribir_diarios(base, conteos, tamano_lote=2)
+    inserts = [(sql, p) for sql, p in base.sentencias if sql.startswith("INSERT INTO daily_appointments")]
+    assert [len(p) // 5 for _, p in inserts] == [2, 2, 1]
+    assert all(sql.count("(%s, %s, %s, %s, %s)") == len(p) // 5 for sql, p in inserts)
+    assert base.diarios == dict(conteos)
+
+
+def test_actualizar_mensuales_no_mezcla_anios():
+    base = BaseSimulada(periodos=[(1, D(2025, 1, 15), D(2026, 1, 14))])
+    base.diarios = {(1, 1, 1, D(2025, 1, 20)): 4, (1, 1, 1, D(2026, 1, 10)): 6}
+    cargador.actualizar_mensuales(base, Counter({(1, 1, 1, D(2026, 1, 10)): 6}))
+    assert base.mensuales == {(1, 1, 1, 1): 6}
+
+
+def test_cargar_resultados(manifiesto, monkeypatch):
+    base = BaseSimulada()
+    monkeypatch.setattr(cargador, "crear_pool", lambda conexion=None: PoolSimulado(base))
+    dias = cargador.cargar_resultados("nueva eps", manifiesto, mapa_examenes={r"hemo": "Hematología"})
+    assert dias == 4
+    assert base.diarios == {
+        (1, 1, 1, D(2025, 3, 1)): 1, (1, 1, 2, D(2025, 3, 1)): 1,
+        (1, 1, 1, D(2025, 3, 2)): 1, (1, 1, 2, D(2025, 3, 2)): 1,
+    }
+    assert base.mensuales == {(1, 1, 1, 3): 2, (1, 1, 2, 3): 2}
+    assert base.confirmada
+
+    # Repetir la misma carga no cambia nada ni se considera una diferencia
+    assert cargador.cargar_resultados("Nueva EPS", manifiesto, mapa_examenes={r"hemo": "Hematología"}) == 4
+
+
+def test_cargar_resultados_no_pisa_conteos_manuales(manifiesto, monkeypatch):
+    base = BaseSimulada()
+    base.diarios = {(1, 1, 1, D(2025, 3, 1)): 40}
+    monkeypatch.setattr(cargador, "crear_pool", lambda conexion=None: PoolSimulado(base))
+
+    with pytest.raises(ValueError, match="--reemplazar"):
+        cargador.cargar_resultados("Nueva EPS", manifiesto)
+    assert base.diarios == {(1, 1, 1, D(2025, 3, 1)): 40}
+    assert base.revertida and not base.confirmada
+
+    cargador.cargar_resultados("Nueva EPS", manifiesto, reemplazar=True)
+    assert base.diarios[(1, 1, 1, D(2025, 3, 1))] == 2
+
+
+def test_cargar_resultados_eps_desconocida(manifiesto, monkeypatch):
+    base = BaseSimulada()
+    monkeypatch.setattr(cargador, "crear_pool", lambda conexion=None: PoolSimulado(base))
+    with pytest.raises(ValueError, match="no existe"):
+        cargador.cargar_resultados("Otra EPS", manifiesto)
@@ -0,0 +1,314 @@
+"""
+Pruebas de la lógica de Descargar_LabNancy.py que no necesita un navegador.
+"""
+import datetime
+import json
+import os
+import sqlite3
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("selenium")
+
+import Descargar_LabNancy as descargador
+
+D = datetime.date
+
+
+class PaginaSimulada:
+    def __init__(self, texto):
+        self.texto = texto
+
+    def extract_text(self):
+        return self.texto
+
+
+class LectorSimulado:
+    """Sustituto de pypdf.PdfReader: el "PDF" es un archivo de texto."""
+
+    def __init__(self, ruta):
+        with open(ruta, encoding="utf-8") as f:
+            self.pages = [PaginaSimulada(f.read())]
+
+
+@pytest.fixture
+def procesador_simulado(monkeypatch):
+    # Hilos en lugar de procesos para que el lector simulado se use también en el pool
+    monkeypatch.setattr(descargador, "PdfReader", LectorSimulado)
+    monkeypatch.setattr(descargador, "ProcessPoolExecutor", ThreadPoolExecutor)
+
+    def procesar(directorio, ruta_jsonl, ruta_db):
+        procesador = descargador.ProcesadorPDF(directorio, ruta_jsonl, ruta_db, procesos=1, intervalo=0.01)
+        procesador.iniciar()
+        procesador.detener()
+        return procesador
+
+    return procesar
+
+
+def escribir(ruta, texto):
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    with open(ruta, "w", encoding="utf-8") as f:
+        f.write(texto)
+
+
+def test_procesador_pdf_no_repite_archivos_ya_extraidos(tmp_path, procesador_simulado):
+    salida = tmp_path / "salida"
+    escribir(str(salida / "2026" / "10" / "123.pdf"), "Paciente: Ana\nGLUCOSA: 95 mg/dL 70 - 110\n")
+    escribir(str(salida / "sin_fecha" / "124.pdf"), "Paciente: Luis\n")
+    escribir(str(salida / descargador.CARPETA_STAGING / "main" / "125.pdf"), "a medias")
+    ruta_jsonl, ruta_db = str(tmp_path / "datos.jsonl"), str(tmp_path / "datos.db")
+
+    assert procesador_simulado(str(salida), ruta_jsonl, ruta_db).procesados == 2
+    with open(ruta_jsonl, encoding="utf-8") as f:
+        lineas = f.readlines()
+    assert sorted(json.loads(linea)["archivo"] for linea in lineas) == ["2026/10/123.pdf", "sin_fecha/124.pdf"]
+
+    # Una segunda corrida sobre la misma salida no emite nada nuevo
+    assert procesador_simulado(str(salida), ruta_jsonl, ruta_db).procesados == 0
+    with open(ruta_jsonl, encoding="utf-8") as f:
+        assert f.readlines() == lineas
+    conexion = sqlite3.connect(ruta_db)
+    assert conexion.execute("SELECT COUNT(*) FROM resultados_pdf").fetchone() == (2,)
+    assert conexion.execute("SELECT COUNT(*) FROM valores_pdf").fetchone() == (1,)
+    conexion.close()
+
+    # Solo con el JSONL (sin base) también se reconocen
+    assert procesador_simulado(str(salida), ruta_jsonl, None).procesados == 0
+
+
+TEXTO_RESULTADO = """Resultado 12345
+Paciente: PACIENTE SIMULADO 12345
+Documento: 12345
+C.C. No. 1.023.456
+Examen: QUIMICA SANGUINEA
+Fecha de toma: 01/01/2026
+Fecha de validación: 02/01/2026 10:30
+GLUCOSA   95  mg/dL   70 - 110
+Hemoglobina: 13,5 g/dL (12 - 16)
+PCR: <0,5 mg/L
+Nitrógeno ureico: 15 mg/dL 7 - 20
+TSH   >100  mUI/L
+"""
+
+
+def test_analizar_texto_resultado_encabezado():
+    datos = descargador.analizar_texto_resultado(TEXTO_RESULTADO)
+    assert datos["paciente"] == "PACIENTE SIMULADO 12345"
+    assert datos["documento"] == "12345"
+    assert datos["examen"] == "QUIMICA SANGUINEA"
+    assert datos["fechas"] == {"toma": "01/01/2026", "validación": "02/01/2026 10:30"}
+
+
+def test_analizar_texto_resultado_no_toma_el_encabezado_como_analito():
+    analitos = [v["analito"] for v in descargador.analizar_texto_resultado(TEXTO_RESULTADO)["valores"]]
+    assert analitos == ["GLUCOSA", "Hemoglobina", "PCR", "Nitrógeno ureico", "TSH"]
+
+
+def test_analizar_texto_resultado_valores():
+    valores = {v["analito"]: v for v in descargador.analizar_texto_resultado(TEXTO_RESULTADO)["valores"]}
+    assert valores["GLUCOSA"] == {
+        "analito": "GLUCOSA", "valor": "95", "numero": 95.0, "unidad": "mg/dL", "minimo": 70.0, "maximo": 110.0,
+    }
+    # Decimales con coma y rango entre paréntesis
+    assert (valores["Hemoglobina"]["numero"], valores["Hemoglobina"]["minimo"], valores["Hemoglobina"]["maximo"]) == (13.5, 12.0, 16.0)
+    # Valores fuera del rango de medición: se conserva el signo en "valor"
+    assert (valores["PCR"]["valor"], valores["PCR"]["numero"], valores["PCR"]["minimo"]) == ("<0,5", 0.5, None)
+    assert (valores["TSH"]["valor"], valores["TSH"]["numero"], valores["TSH"]["unidad"]) == (">100", 100.0, "mUI/L")
+
+
+def test_analizar_texto_resultado_sin_datos():
+    assert descargador.analizar_texto_resultado("Resultado ABC") == {
+        "paciente": None, "documento": None, "examen": None, "fechas": {}, "valores": [],
+    }
+
+
+class Reloj:
+    """Sustituto de time.monotonic que solo avanza cuando la prueba lo pide."""
+
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(descargador.time, "monotonic", reloj)
+    return reloj
+
+
+@pytest.fixture
+def manifiesto(tmp_path, monkeypatch):
+    manifiesto = descargador.ManifiestoDescargas(str(tmp_path / "manifiesto.db"), "01/03/2025", "31/03/2025")
+    monkeypatch.setattr(descargador, "MANIFIESTO", manifiesto)
+    yield manifiesto
+    manifiesto.cerrar()
+
+
+def estado(manifiesto, clave):
+    fila = manifiesto._conexion.execute("SELECT estado, intentos FROM descargas WHERE clave = ?", (clave,)).fetchone()
+    return fila and tuple(fila)
+
+
+def test_dividir_rango():
+    assert descargador.dividir_rango("01/03/2025", "16/03/2025") == [
+        ("01/03/2025", "07/03/2025"), ("08/03/2025", "14/03/2025"), ("15/03/2025", "16/03/2025"),
+    ]
+    assert descargador.dividir_rango("30/12/2025", "01/01/2026", "dia") == [
+        ("30/12/2025", "30/12/2025"), ("31/12/2025", "31/12/2025"), ("01/01/2026", "01/01/2026"),
+    ]
+    assert descargador.dividir_rango("05/03/2025", "05/03/2025") == [("05/03/2025", "05/03/2025")]
+    with pytest.raises(ValueError):
+        descargador.dividir_rango("10/03/2025", "01/03/2025")
+
+
+def test_partir_tramo():
+    assert descargador.partir_tramo("01/03/2025", "07/03/2025") == [
+        ("01/03/2025", "04/03/2025"), ("05/03/2025", "07/03/2025"),
+    ]
+    assert descargador.partir_tramo("01/03/2025", "02/03/2025") == [
+        ("01/03/2025", "01/03/2025"), ("02/03/2025", "02/03/2025"),
+    ]
+    assert descargador.partir_tramo("01/03/2025", "01/03/2025") is None
+
+
+def test_rango_acotado():
+    rango = ("01/03/2025", "31/03/2025")
+    # Listado ascendente: la página empieza en la fecha de su primera fila
+    assert descargador.rango_acotado(rango, D(2025, 3, 10), D(2025, 3, 12)) == ("10/03/2025", "31/03/2025")
+    # Listado descendente: la página termina en la fecha de su primera fila
+    assert descargador.rango_acotado(rango, D(2025, 3, 20), D(2025, 3, 18)) == ("01/03/2025", "20/03/2025")
+    assert descargador.rango_acotado(rango, None, D(2025, 3, 18)) is None
+    assert descargador.rango_acotado(None, D(2025, 3, 20), D(2025, 3, 18)) is None
+
+
+def test_limitador_ritmo(reloj):
+    limitador = descargador.LimitadorPortal(tasa=2, rafaga=2)
+    assert [limitador._reservar() for _ in range(2)] == [0, 0]
+    assert limitador._reservar() == pytest.approx(0.5)
+    reloj.ahora += 0.5
+    assert limitador._reservar() == 0
+    # Sin tasa no hay espera
+    assert descargador.LimitadorPortal()._reservar() == 0
+
+
+def test_limitador_circuito(reloj):
+    limitador = descargador.LimitadorPortal()
+    for _ in range(descargador.UMBRAL_CIRCUITO - 1):
+        limitador.registrar(False, "error")
+    assert not limitador.abierto
+    limitador.registrar(False, "error")
+    assert limitador.abierto
+    assert limitador._reservar() == pytest.approx(descargador.PAUSA_CIRCUITO)
+
+    # A prueba después de la pausa: el primer fallo lo vuelve a abrir con el doble de pausa
+    reloj.ahora += descargador.PAUSA_CIRCUITO
+    assert limitador._reservar() == 0
+    limitador.registrar(False, "error")
+    assert limitador._reservar() == pytest.approx(descargador.PAUSA_CIRCUITO * 2)
+
+    # El primer éxito después de la pausa lo normaliza
+    reloj.ahora += descargador.PAUSA_CIRCUITO * 2
+    limitador.registrar(True)
+    for _ in range(descargador.UMBRAL_CIRCUITO - 1):
+        limitador.registrar(False, "error")
+    assert not limitador.abierto
+
+
+def test_limitador_olvida_fallos_fuera_de_la_ventana(reloj):
+    limitador = descargador.LimitadorPortal()
+    for _ in range(descargador.UMBRAL_CIRCUITO - 1):
+        limitador.registrar(False, "error")
+    reloj.ahora += descargador.VENTANA_CIRCUITO + 1
+    limitador.registrar(False, "error")
+    assert not limitador.abierto
+
+
+def test_latencia_espera():
+    latencia = descargador.LatenciaPortal()
+    limite = descargador.LIMITES_ESPERA["ver"]
+    for _ in range(descargador.MUESTRAS_MINIMAS - 1):
+        latencia.registrar("ver", 0.1)
+    assert latencia.espera("ver") == limite
+    latencia.registrar("ver", 0.1)
+    assert latencia.espera("ver") == descargador.ESPERA_MINIMA
+    for _ in range(descargador.VENTANA_LATENCIA):
+        latencia.registrar("ver", limite * 10)
+    assert latencia.espera("ver") == limite * descargador.TECHO_ADAPTATIVO
+    latencia.activa = False
+    assert latencia.espera("ver") == limite
+
+
+def test_latencia_no_acorta_los_pasos_que_clasifican_resultados():
+    latencia = descargador.LatenciaPortal()
+    for paso in descargador.PASOS_SIN_ACORTAR:
+        for _ in range(descargador.MUESTRAS_MINIMAS):
+            latencia.registrar(paso, 0.1)
+        assert latencia.espera(paso) == descargador.LIMITES_ESPERA[paso]
+
+
+def test_metricas_pasos():
+    metricas = descargador.MetricasPasos()
+    metricas.registrar("ver", 0.3)
+    with pytest.raises(RuntimeError):
+        with metricas.medir("ver"):
+            raise RuntimeError("falla")
+    otras = descargador.MetricasPasos()
+    otras.registrar("ver", 1000)
+    metricas.combinar(otras.instantanea())
+
+    ver = metricas.reporte()["pasos"]["ver"]
+    assert (ver["conteo"], ver["errores"], ver["maximo_segundos"]) == (3, 1, 1000)
+    assert sum(ver["histograma"].values()) == 3
+    assert ver["histograma"][f">{descargador.BUCKETS_METRICAS[-1]}"] == 1
+
+
+def test_manifiesto_estados(manifiesto, tmp_path):
+    fila = {"fecha": D(2025, 3, 5), "examen": "GLUCOSA"}
+    manifiesto.iniciar("100", 1, fila)
+    assert estado(manifiesto, "100") == ("en_curso", 1)
+    manifiesto.fallar("100", "tiempo agotado")
+    assert estado(manifiesto, "100") == ("fallido", 1)
+    assert not manifiesto.completado("100")
+
+    manifiesto.iniciar("100", 1, fila)
+    assert estado(manifiesto, "100") == ("en_curso", 2)
+    manifiesto.completar("100", "/salida/100.pdf", 1234)
+    assert estado(manifiesto, "100") == ("completado", 2)
+    assert manifiesto.completado("100")
+
+    manifiesto.iniciar("200", 1, fila)
+    manifiesto.sin_pdf("200")
+    assert estado(manifiesto, "200") == ("sin_pdf", 1)
+    assert not manifiesto.completado("200")
+
+    # Las claves provisionales nunca se registran
+    manifiesto.iniciar("resultado_1_3", 1, fila)
+    manifiesto.completar("resultado_1_3")
+    assert estado(manifiesto, "resultado_1_3") is None
+    assert not manifiesto.completado("resultado_1_3")
+
+    # Al reabrir el manifiesto se conservan los completados
+    otro = descargador.ManifiestoDescargas(manifiesto.ruta)
+    assert otro.completado("100") and not otro.completado("200")
+    otro.cerrar()
+
+
+def test_reanudar_omite_completados_y_reclamados(manifiesto):
+    manifiesto.completar("1")
+    coordinador = descargador.CoordinadorDescargas()
+    assert coordinador.reclamar("2")
+    pendientes = deque({"clave": clave} for clave in ("1", "2", "3", "4"))
+
+    assert descargador._tomar_pendiente(pendientes, coordinador)["clave"] == "3"
+    assert descargador._tomar_pendiente(pendientes, coordinador)["clave"] == "4"
+    assert descargador._tomar_pendiente(pendientes, coordinador) is None
+
+    # Una clave liberada (descarga fallida) se puede volver a reclamar
+    coordinador.liberar("2")
+    assert descargador._tomar_pendiente(deque([{"clave": "2"}]), coordinador)["clave"] == "2"